@@ -1,4 +1,4 @@
-from fastapi import Depends, HTTPException, status, Path
+from fastapi import Depends, HTTPException, status, Path, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from app.core.config import settings
@@ -21,7 +21,8 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
         token = credentials.credentials
         payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
         user_id: str = payload.get("sub")
-        if user_id is None:
+        # Scoped tokens (the live usage stream's) only open what they were issued for
+        if user_id is None or payload.get("scope") is not None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
@@ -40,3 +41,26 @@ def check_realm_access(realm_id: str = Path(...), current_user: dict = Depends(g
     if not realm:
         raise HTTPException(status_code=403, detail="You don't have access to this realm")
     return realm
+
+LIVE_USAGE_SCOPE = "live_usage"
+
+def check_live_usage_access(
+    realm_id: str = Path(...),
+    token: str = Query(..., description="Stream token of the realm, from POST /usage/live/token"),
+    db: Session = Depends(get_db)
+):
+    """
+    Realm access of the live usage stream: browsers' EventSource cannot send an Authorization
+    header, so a short-lived token scoped to the realm is passed in the query string instead.
+    """
+    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate stream token")
+    try:
+        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+    if payload.get("scope") != LIVE_USAGE_SCOPE or payload.get("realm_id") != realm_id or payload.get("sub") is None:
+        raise credentials_exception
+    realm = db.query(Realm).filter(Realm.id == realm_id, Realm.created_by == payload["sub"]).first()
+    if not realm:
+        raise HTTPException(status_code=403, detail="You don't have access to this realm")
+    return realm
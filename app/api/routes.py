@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 from .v1 import v1_router
 from app.core.config import settings
+from app.core import metrics
 
 main_router = APIRouter()
 
@@ -11,4 +12,9 @@ async def health_check():
         "version": settings.PROJECT_VERSION
     }
 
+@main_router.get("/metrics")
+async def get_metrics():
+    """In-process metrics of the worker serving the request"""
+    return metrics.snapshot()
+
 main_router.include_router(v1_router, prefix="/v1")
@@ -9,6 +9,10 @@ from .bill_limit import router as bill_limit_router
 from .overhead import router as overhead_router
 from .account import router as account_router
 from .api_log import router as api_log_router
+from .usage_import import router as usage_import_router
+from .usage_export import router as usage_export_router
+from .usage_quota import router as usage_quota_router
+from .alert_rule import router as alert_rule_router
 
 v1_router = APIRouter()
 v1_router.include_router(auth_router, prefix="/auth", tags=["Authentication"])
@@ -21,3 +25,7 @@ v1_router.include_router(bill_limit_router, prefix="/realms/{realm_id}/bill-limi
 v1_router.include_router(overhead_router, prefix="/realms/{realm_id}/overheads", tags=["Overheads"])
 v1_router.include_router(account_router, prefix="/realms/{realm_id}/accounts", tags=["Accounts"])
 v1_router.include_router(api_log_router, prefix="/realms/{realm_id}/usage", tags=["API Logs"])
+v1_router.include_router(usage_import_router, prefix="/realms/{realm_id}/usage-imports", tags=["Usage Imports"])
+v1_router.include_router(usage_export_router, prefix="/realms/{realm_id}/usage", tags=["Usage Export"])
+v1_router.include_router(usage_quota_router, prefix="/realms/{realm_id}/quotas", tags=["Usage Quotas"])
+v1_router.include_router(alert_rule_router, prefix="/realms/{realm_id}/alert-rules", tags=["Alert Rules"])
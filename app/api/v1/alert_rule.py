@@ -0,0 +1,61 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from app.db.database import get_db
+from app.schemas.alert_rule import AlertRuleCreate, AlertRuleUpdate, AlertRuleResponse
+from app.services import alert_service
+from app.api.deps import get_current_user, check_realm_access
+from typing import List, Optional
+import uuid
+
+router = APIRouter()
+
+@router.post("/", response_model=AlertRuleResponse)
+def create_alert_rule(
+    rule: AlertRuleCreate,
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Notify a webhook when the spend of the realm (or of an account) in the current budget period
+    reaches a percentage of its bill limit or an amount. Each crossing is notified once.
+    """
+    return alert_service.create_alert_rule(db, rule, realm.id)
+
+@router.get("/", response_model=List[AlertRuleResponse])
+def get_alert_rules(
+    account_id: Optional[uuid.UUID] = Query(None, description="Only the rules of this account"),
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    return alert_service.get_alert_rules(db, realm.id, account_id)
+
+@router.get("/{rule_id}", response_model=AlertRuleResponse)
+def get_alert_rule(
+    rule_id: uuid.UUID,
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    return alert_service.get_alert_rule(db, rule_id, realm.id)
+
+@router.put("/{rule_id}", response_model=AlertRuleResponse)
+def update_alert_rule(
+    rule_id: uuid.UUID,
+    rule: AlertRuleUpdate,
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    return alert_service.update_alert_rule(db, rule_id, rule, realm.id)
+
+@router.delete("/{rule_id}")
+def delete_alert_rule(
+    rule_id: uuid.UUID,
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    alert_service.delete_alert_rule(db, rule_id, realm.id)
+    return {"message": "Alert rule deleted successfully"}
@@ -1,21 +1,53 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from app.db.database import get_db
-from app.services import kpi_service
-from app.api.deps import get_current_user, check_realm_access
-from datetime import date, datetime, timezone
-from typing import Optional
+from app.services import kpi_service, kpi_cache_service, live_usage_service, user_service
+from app.services.kpi_cache_service import CachedKPI
+from app.api.deps import LIVE_USAGE_SCOPE, get_current_user, check_realm_access, check_live_usage_access
+from app.core.config import settings
+from datetime import date, datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Annotated, List, Literal, Optional
 from uuid import UUID
+from pydantic import Field
+import json
 
 router = APIRouter()
 
+def _not_modified(request: Request, cached: CachedKPI) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return cached.etag in [etag.strip() for etag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(if_modified_since) >= cached.last_modified
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _kpi_response(request: Request, cached: CachedKPI) -> Response:
+    """Cached KPI payload with its validators, or a 304 when the client already has it"""
+    headers = {
+        "ETag": cached.etag,
+        "Last-Modified": format_datetime(cached.last_modified, usegmt=True),
+        # Browsers revalidate on every poll and get a 304 while nothing changed
+        "Cache-Control": "private, no-cache"
+    }
+    if _not_modified(request, cached):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
 @router.get("/cost")
-def get_kpi_cost(
+async def get_kpi_cost(
+    request: Request,
     realm: dict = Depends(check_realm_access),
     start_date: date = Query(..., description="Start date for the KPI calculation"),
     end_date: date = Query(..., description="End date for the KPI calculation"),
     account_id: Optional[UUID] = Query(None, description="Optional account ID to filter results"),
-    db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -27,25 +59,160 @@ def get_kpi_cost(
     - Model costs
     - Current budget and usage percentage
     """
-    return kpi_service.get_kpi_cost(db, realm.id, start_date, end_date, account_id)
+    cached = await kpi_cache_service.get_cached_kpi(
+        realm.id, "cost", start_date, end_date, account_id,
+        lambda: kpi_service.get_kpi_cost_with_expiry(realm.id, start_date, end_date, account_id)
+    )
+    return _kpi_response(request, cached)
 
 @router.get("/activity")
-def get_kpi_activity(
+async def get_kpi_activity(
+    request: Request,
     realm: dict = Depends(check_realm_access),
     start_date: date = Query(..., description="Start date for the KPI calculation"),
     end_date: date = Query(..., description="End date for the KPI calculation"),
     account_id: Optional[str] = Query(None, description="Optional account ID to filter results"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get activity KPIs including:
+    - Daily tokens, in total and per model
+    - Top users
+    - Top API keys
+    """
+    async def compute():
+        return await kpi_service.get_kpi_activity(realm.id, start_date, end_date, account_id), None
+
+    cached = await kpi_cache_service.get_cached_kpi(realm.id, "activity", start_date, end_date, account_id, compute)
+    return _kpi_response(request, cached)
+
+@router.get("/timeseries")
+async def get_kpi_timeseries(
+    request: Request,
+    realm: dict = Depends(check_realm_access),
+    start_date: date = Query(..., description="Start date of the series"),
+    end_date: date = Query(..., description="End date of the series"),
+    metric: Literal["cost", "tokens", "events"] = Query("cost", description="Value of the points"),
+    granularity: Optional[Literal["hour", "day", "week", "month"]] = Query(None, description="Bucket size, the finest one fitting max_points when omitted"),
+    max_points: Optional[int] = Query(None, ge=3, le=10000, description="Most points per series"),
+    account_id: Optional[UUID] = Query(None, description="Optional account ID to filter results"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get a metric over time, in total and per model.
+    Empty buckets are returned with a zero value; series longer than max_points are downsampled.
+    """
+    if end_date < start_date:
+        raise HTTPException(status_code=422, detail="end_date must not be before start_date")
+
+    cached = await kpi_cache_service.get_cached_kpi(
+        realm.id, f"timeseries:{metric}:{granularity}:{max_points}", start_date, end_date, account_id,
+        lambda: kpi_service.get_kpi_timeseries_async(
+            realm.id, start_date, end_date, metric, granularity, max_points, account_id
+        )
+    )
+    return _kpi_response(request, cached)
+
+@router.get("/top")
+def get_kpi_top(
+    realm: dict = Depends(check_realm_access),
+    dimension: Literal["accounts", "api_keys"] = Query("accounts", description="What to rank"),
+    measure: Literal["events", "tokens", "cost"] = Query("events", description="What to rank by"),
+    start_date: date = Query(..., description="Start date for the KPI calculation"),
+    end_date: date = Query(..., description="End date for the KPI calculation"),
+    limit: int = Query(10, ge=1, le=100, description="Number of items"),
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    daily_tokens = kpi_service.get_daily_tokens(db, realm.id, start_date, end_date, account_id)
-    model_daily_tokens = kpi_service.get_model_daily_tokens(db, realm.id, start_date, end_date, account_id)
-    top_users = kpi_service.get_top_users(db, realm.id, start_date, end_date)
-    top_api_keys = kpi_service.get_top_api_keys(db, realm.id, start_date, end_date)
+    """
+    Get the approximate top accounts or API keys, with the error bound of every value.
+    Read from the usage sketches: new usage is included within a few seconds.
+    """
+    return kpi_service.get_kpi_top(db, realm.id, dimension, measure, start_date, end_date, limit)
 
-    return {
-        "daily_tokens": daily_tokens,
-        "model_daily_tokens": model_daily_tokens,
-        "top_users": top_users,
-        "top_api_keys": top_api_keys
-    }
+@router.get("/active-accounts")
+def get_kpi_active_accounts(
+    realm: dict = Depends(check_realm_access),
+    start_date: date = Query(..., description="Start date for the KPI calculation"),
+    end_date: date = Query(..., description="End date for the KPI calculation"),
+    period: Literal["day", "week", "month"] = Query("day", description="Period of the active account counts (DAU, WAU or MAU)"),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get the approximate number of distinct accounts with usage, over the range,
+    per period and per model. Counts are within about 1% of the exact ones.
+    """
+    if end_date < start_date:
+        raise HTTPException(status_code=422, detail="end_date must not be before start_date")
+    return kpi_service.get_kpi_active_accounts(db, realm.id, start_date, end_date, period)
+
+@router.get("/distribution")
+def get_kpi_distribution(
+    realm: dict = Depends(check_realm_access),
+    metric: Literal["input_tokens", "output_tokens", "cost"] = Query("cost", description="Per-request value to describe"),
+    start_date: date = Query(..., description="Start date for the KPI calculation"),
+    end_date: date = Query(..., description="End date for the KPI calculation"),
+    percentiles: List[Annotated[float, Field(ge=0, le=100)]] = Query([50, 90, 95, 99], description="Percentiles to return"),
+    buckets: int = Query(20, ge=1, le=200, description="Number of histogram buckets"),
+    provider_name: Optional[str] = Query(None, description="Optional provider to filter results"),
+    model_name: Optional[str] = Query(None, description="Optional model to filter results"),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get percentiles and a log-scale histogram of a per-request value (e.g. the p95 cost per call
+    of a model). Percentiles are within 1% of the exact values.
+    """
+    return kpi_service.get_kpi_distribution(
+        db, realm.id, metric, start_date, end_date, percentiles, buckets, provider_name, model_name
+    )
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+@router.post("/live/token")
+def create_live_usage_token(
+    realm: dict = Depends(check_realm_access),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get a short-lived token opening the realm's live usage stream, for clients that cannot send
+    an Authorization header (EventSource): `new EventSource(".../usage/live?token=<token>")`.
+    """
+    expires_in = settings.LIVE_USAGE_TOKEN_EXPIRE_SECONDS
+    token = user_service.create_access_token(
+        {"sub": current_user["id"], "realm_id": realm.id, "scope": LIVE_USAGE_SCOPE},
+        timedelta(seconds=expires_in)
+    )
+    return {"token": token, "expires_in": expires_in}
+
+@router.get("/live")
+async def get_live_usage(
+    request: Request,
+    realm: dict = Depends(check_live_usage_access)
+):
+    """
+    Stream the realm's usage as server-sent events: a `budget` event with the spend of the
+    current month, then a `delta` event per interval with new usage (events, tokens, cost and
+    price per model) and the updated budget.
+    Authenticated with the `token` query parameter (see POST /live/token), only checked when connecting.
+    """
+    realm_id = realm.id
+    subscriber, budget = await live_usage_service.subscribe(realm_id)
+
+    async def stream():
+        try:
+            yield _sse("budget", budget)
+            while not await request.is_disconnected():
+                delta = await subscriber.next_delta(settings.LIVE_USAGE_KEEPALIVE_INTERVAL)
+                # A comment keeps idle connections open through proxies
+                yield _sse("delta", delta) if delta else ": keepalive\n\n"
+        finally:
+            live_usage_service.unsubscribe(realm_id, subscriber)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, Path, Query
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, Response
 from sqlalchemy.orm import Session
 from app.db.database import get_db
 from app.models.llm_cost import LLMCost
@@ -10,26 +10,43 @@ from app.schemas.llm_cost import (
 )
 from datetime import datetime
 from app.services.llm_cost_service import (
-    get_realm_llm_costs,
+    get_llm_cost_catalog,
     get_single_llm_cost,
     create_llm_cost,
     update_llm_cost,
     delete_llm_cost
 )
 from app.api.deps import get_current_user, check_realm_access
-from typing import List
+from typing import List, Optional
 from uuid import UUID
 
 router = APIRouter()
 
 @router.get("/", response_model=List[LLMWithCurrentCostResponse])
-async def get_llm_costs(
+def get_llm_costs(
+    request: Request,
+    page: int = Query(1, gt=0, description="Page number, when limit is given"),
+    limit: Optional[int] = Query(None, gt=0, le=1000, description="LLMs per page, all of them when omitted"),
+    history_limit: Optional[int] = Query(None, gt=0, description="Most recent cost history entries per LLM, all of them when omitted"),
     realm: dict = Depends(check_realm_access),
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get all LLMs for a realm with their current costs if they exist"""
-    return get_realm_llm_costs(db, realm.id)
+    """
+    Get all LLMs for a realm with their current costs if they exist.
+    The total number of LLMs is in the X-Total-Count header; a request whose If-None-Match
+    matches the ETag of an unchanged catalog gets a 304.
+    """
+    catalog = get_llm_cost_catalog(db, realm.id, page if limit else None, limit, history_limit)
+    headers = {
+        "ETag": catalog.etag,
+        "X-Total-Count": str(catalog.total_count),
+        "Cache-Control": "private, no-cache"
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or catalog.etag in [etag.strip() for etag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=catalog.body, media_type="application/json", headers=headers)
 
 @router.get("/{llm_cost_id}", response_model=LLMCostResponse)
 async def get_llm_cost(
@@ -1,46 +1,107 @@
-from app.services import usage_service, api_key_service, api_log_service
-from fastapi import APIRouter, Depends, HTTPException, Request, Response
-from sqlalchemy.orm import Session
-from app.db.database import get_db
-from app.schemas.usage import UsageCreate, UsageResponse
+from app.services import usage_service, api_key_service, api_log_service, usage_ingest_service, tokenization_service, budget_service, usage_quota_service
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.database import get_async_db
+from app.models.account import Account
+from app.schemas.usage import UsageCreate, UsageResponse, UsageBatchCreate, UsageBatchResponse
 from app.api.deps import get_api_key
 from fastapi.encoders import jsonable_encoder
+from app.core.config import settings
+from app.core.batch_writer import QueueFullError
+from datetime import datetime, timezone
+from typing import Optional
+from math import ceil
 
 router = APIRouter()
 
 @router.post("/track")
 async def track_usage(
     request: Request,
+    response: Response,
     usage: UsageCreate,
-    db: Session = Depends(get_db),
-    api_key: str = Depends(get_api_key)
+    db: AsyncSession = Depends(get_async_db),
+    api_key: str = Depends(get_api_key),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255)
 ):
+    # Keep the parsed body for the API log instead of reading the request again
+    request_body = usage.model_dump(mode="json", exclude_unset=True)
     try:
         # Validate API key and get associated realm
-        api_key_data = api_key_service.validate_api_key(db, api_key)
+        api_key_data = await api_key_service.validate_api_key_async(db, api_key)
         if not api_key_data:
             raise HTTPException(status_code=401, detail="Invalid or disabled API key")
 
         # Add realm_id to the usage data
         usage.realm_id = api_key_data.realm_id
 
-        # Track the usage
-        tracked_usage = usage_service.track_llm_usage(db, usage, api_key_data.id)
-        
-        # Convert the tracked_usage to a response model
-        usage_response = UsageResponse.model_validate(tracked_usage)
-        response_data = {
-            "message": "Usage tracked successfully",
-            "usage": jsonable_encoder(usage_response)
-        }
+        # The Idempotency-Key header takes precedence over the body field
+        if idempotency_key:
+            usage.idempotency_key = idempotency_key
+
+        # A retry of a usage tracked recently is answered without tracking it again
+        replayed_usage = usage_service.get_idempotent_usage(usage.realm_id, usage.idempotency_key)
+        if replayed_usage is None:
+            # Count message tokens off the event loop
+            await tokenization_service.tokenize_usages_async([usage])
+
+        if replayed_usage is not None:
+            # Already written, also in async mode: 200 tells "already tracked" from "queued" (202)
+            response_data = {
+                "message": "Usage already tracked",
+                "usage": replayed_usage
+            }
+        elif usage_ingest_service.is_enabled():
+            # Price the usage now, the background flusher writes it later
+            values = await usage_service.price_llm_usage_async(db, usage, api_key_data.id, datetime.now(timezone.utc))
+            try:
+                usage_ingest_service.enqueue_usage(values, usage.external_id)
+            except QueueFullError:
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many usage events queued, retry later",
+                    headers={"Retry-After": str(settings.USAGE_INGEST_RETRY_AFTER)}
+                )
+
+            # Not remembered as a replay: the usage has no id until written. A retry is queued again
+            # and skipped by the idempotency index, the written usage is remembered by the flusher
+            response.status_code = 202
+            response_data = {
+                "message": "Usage accepted",
+                "usage": jsonable_encoder(values)
+            }
+            # Queued usage is counted once written: the status may lag by the queue
+            account_id = values["account_id"] or (
+                usage_service.account_cache.get((usage.realm_id, usage.external_id)) if usage.external_id else None
+            )
+            response_data["budget"] = await budget_service.get_budget_status(usage.realm_id, account_id)
+            response_data["quota"] = await usage_quota_service.get_quota_status(usage.realm_id, account_id)
+        else:
+            # Track the usage
+            tracked_usage = await usage_service.track_llm_usage_async(db, usage, api_key_data.id)
+
+            # Convert the tracked_usage to a response model
+            usage_response = UsageResponse.model_validate(tracked_usage)
+            response_data = {
+                "message": "Usage tracked successfully",
+                "usage": jsonable_encoder(usage_response),
+                "budget": await budget_service.get_budget_status(usage.realm_id, tracked_usage.account_id),
+                "quota": await usage_quota_service.get_quota_status(usage.realm_id, tracked_usage.account_id)
+            }
+
+        if "budget" in response_data:
+            response.headers["X-Budget-Status"] = response_data["budget"]["status"]
+        if "quota" in response_data:
+            # Whether the account's next call fits in its quotas
+            response.headers["X-Quota-Status"] = response_data["quota"]["status"]
 
         # Log the API request
         await api_log_service.log_api_request(
             db=db,
             request=request,
-            response=Response(),
+            request_body=request_body,
             realm_id=api_key_data.realm_id,
-            status_code=200,
+            status_code=response.status_code or 200,
             response_body=response_data
         )
 
@@ -51,7 +112,7 @@ async def track_usage(
             await api_log_service.log_api_request(
                 db=db,
                 request=request,
-                response=Response(),
+                request_body=request_body,
                 realm_id=api_key_data.realm_id,
                 status_code=e.status_code,
                 response_body={"detail": e.detail}
@@ -63,9 +124,149 @@ async def track_usage(
             await api_log_service.log_api_request(
                 db=db,
                 request=request,
-                response=Response(),
+                request_body=request_body,
                 realm_id=api_key_data.realm_id,
                 status_code=500,
                 response_body={"detail": str(e)}
             )
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+
+@router.post("/track/batch")
+async def track_usage_batch(
+    request: Request,
+    batch: UsageBatchCreate,
+    db: AsyncSession = Depends(get_async_db),
+    api_key: str = Depends(get_api_key)
+):
+    """
+    Track many usage events in one request and one transaction.
+    Each event gets its own status, so a single unknown model does not reject the batch.
+    """
+    # Keep the parsed body for the API log instead of reading the request again
+    request_body = batch.model_dump(mode="json", exclude_unset=True)
+    try:
+        # Validate API key and get associated realm
+        api_key_data = await api_key_service.validate_api_key_async(db, api_key)
+        if not api_key_data:
+            raise HTTPException(status_code=401, detail="Invalid or disabled API key")
+
+        if not batch.events:
+            raise HTTPException(status_code=422, detail="The batch must contain at least one event")
+        if len(batch.events) > settings.USAGE_BATCH_MAX_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"The batch exceeds the maximum size of {settings.USAGE_BATCH_MAX_SIZE} events"
+            )
+
+        # Count message tokens off the event loop, batched per model
+        await tokenization_service.tokenize_usages_async(batch.events)
+
+        # Track the usages
+        results = await usage_service.track_llm_usage_batch_async(db, batch.events, api_key_data.id, api_key_data.realm_id)
+
+        tracked = sum(1 for result in results if result["status"] == "tracked")
+        batch_response = UsageBatchResponse(
+            message="Usage batch processed",
+            tracked=tracked,
+            failed=len(results) - tracked,
+            results=[
+                {**result, "usage": UsageResponse.model_validate(result["usage"])}
+                if result["status"] == "tracked" else result
+                for result in results
+            ]
+        )
+        response_data = jsonable_encoder(batch_response)
+        response_data["budget"] = await budget_service.get_budget_status(api_key_data.realm_id)
+
+        # Log the API request
+        await api_log_service.log_api_request(
+            db=db,
+            request=request,
+            request_body=request_body,
+            realm_id=api_key_data.realm_id,
+            status_code=200,
+            response_body={"message": batch_response.message, "tracked": tracked, "failed": batch_response.failed}
+        )
+
+        return response_data
+    except HTTPException as e:
+        # Log failed requests too
+        if 'api_key_data' in locals() and api_key_data:
+            await api_log_service.log_api_request(
+                db=db,
+                request=request,
+                request_body=request_body,
+                realm_id=api_key_data.realm_id,
+                status_code=e.status_code,
+                response_body={"detail": e.detail}
+            )
+        raise e
+    except Exception as e:
+        # Log unexpected errors
+        if 'api_key_data' in locals() and api_key_data:
+            await api_log_service.log_api_request(
+                db=db,
+                request=request,
+                request_body=request_body,
+                realm_id=api_key_data.realm_id,
+                status_code=500,
+                response_body={"detail": str(e)}
+            )
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+@router.get("/budget")
+async def get_budget(
+    external_id: Optional[str] = Query(None, description="Optional external ID of the account to check as well"),
+    db: AsyncSession = Depends(get_async_db),
+    api_key: str = Depends(get_api_key)
+):
+    """
+    Check the budget of the realm (and of an account with its own limit) before making an LLM call.
+    Answered from in-memory spend counters: status is ok, soft_limit, over_limit or unlimited.
+    """
+    api_key_data = await api_key_service.validate_api_key_async(db, api_key)
+    if not api_key_data:
+        raise HTTPException(status_code=401, detail="Invalid or disabled API key")
+
+    account_id = await _find_account_id(db, api_key_data.realm_id, external_id)
+    return await budget_service.get_budget_status(api_key_data.realm_id, account_id)
+
+@router.get("/quota")
+async def check_quota(
+    response: Response,
+    external_id: str = Query(..., description="External ID of the account making the call"),
+    tokens: float = Query(0, ge=0, description="Tokens the call is expected to use"),
+    cost: float = Query(0, ge=0, description="Price the call is expected to cost"),
+    db: AsyncSession = Depends(get_async_db),
+    api_key: str = Depends(get_api_key)
+):
+    """
+    Pre-authorize an LLM call: whether one more request of the given tokens and cost fits in the
+    account's quotas, without tracking anything. Answered from in-memory sliding-window counters;
+    a denied call gets a Retry-After header when its usage will leave the window.
+    """
+    api_key_data = await api_key_service.validate_api_key_async(db, api_key)
+    if not api_key_data:
+        raise HTTPException(status_code=401, detail="Invalid or disabled API key")
+
+    account_id = await _find_account_id(db, api_key_data.realm_id, external_id)
+    status = await usage_quota_service.get_quota_status(api_key_data.realm_id, account_id, tokens, cost)
+    response.headers["X-Quota-Status"] = status["status"]
+    if status["retry_after"] is not None:
+        response.headers["Retry-After"] = str(ceil(status["retry_after"]))
+    return status
+
+async def _find_account_id(db: AsyncSession, realm_id: str, external_id: Optional[str]):
+    """Id of an account from its external ID, None when it is not given or not tracked yet"""
+    if not external_id:
+        return None
+    account_id = usage_service.account_cache.get((realm_id, external_id))
+    if account_id is None:
+        result = await db.execute(
+            select(Account.id).where(Account.realm_id == realm_id, Account.external_id == external_id)
+        )
+        account_id = result.scalar()
+        if account_id:
+            usage_service.remember_accounts(realm_id, {external_id: account_id})
+    return account_id
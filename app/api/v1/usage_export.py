@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from app.services import usage_export_service
+from app.api.deps import get_current_user, check_realm_access
+from datetime import date
+from typing import Literal, Optional
+from uuid import UUID
+
+router = APIRouter()
+
+@router.get("/export")
+def export_usage(
+    realm: dict = Depends(check_realm_access),
+    format: Literal["csv", "ndjson", "parquet", "arrow"] = Query("csv", description="Output format"),
+    start_date: Optional[date] = Query(None, description="First day to export, from the first usage when omitted"),
+    end_date: Optional[date] = Query(None, description="Last day to export, up to now when omitted"),
+    account_id: Optional[UUID] = Query(None, description="Optional account ID to filter results"),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Export the raw usage rows of the realm with their model, account and API key names.
+    The file is streamed (chunked transfer encoding) while the rows are read.
+    """
+    usage_export_service.check_format(format)
+    return StreamingResponse(
+        usage_export_service.export_usage(realm.id, format, start_date, end_date, account_id),
+        media_type=usage_export_service.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="usage-{realm.id}.{format}"'}
+    )
@@ -0,0 +1,75 @@
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Query, UploadFile
+from sqlalchemy.orm import Session
+from app.db.database import get_db
+from app.schemas.usage_import import UsageImportResponse
+from app.services import usage_import_service
+from app.api.deps import get_current_user, check_realm_access
+from app.core.config import settings
+from typing import List, Literal, Optional
+import os
+import shutil
+import uuid
+
+router = APIRouter()
+
+@router.post("/", response_model=UsageImportResponse, status_code=202)
+def create_import(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    format: Optional[Literal["csv", "jsonl"]] = Query(None, description="csv or jsonl, detected from the file name when omitted"),
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Backfill historical usage from a CSV or JSONL file.
+    Rows need created_at, provider_name, llm_model_name, input_tokens and output_tokens,
+    and may have external_id and idempotency_key. The import runs in the background.
+    """
+    format = format or usage_import_service.detect_format(file.filename or "")
+
+    # Keep the file: an interrupted import is resumed from it
+    os.makedirs(settings.USAGE_IMPORT_DIR, exist_ok=True)
+    source = os.path.join(settings.USAGE_IMPORT_DIR, f"{uuid.uuid4()}.{format}")
+    with open(source, "wb") as destination:
+        shutil.copyfileobj(file.file, destination)
+
+    usage_import = usage_import_service.create_import(db, realm.id, source, format)
+    background_tasks.add_task(usage_import_service.run_import_in_background, usage_import.id)
+    return usage_import
+
+@router.get("/", response_model=List[UsageImportResponse])
+def get_imports(
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    return usage_import_service.get_imports(db, realm.id)
+
+@router.get("/{import_id}", response_model=UsageImportResponse)
+def get_import(
+    import_id: uuid.UUID,
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    return usage_import_service.get_import(db, import_id, realm.id)
+
+@router.post("/{import_id}/resume", response_model=UsageImportResponse, status_code=202)
+def resume_import(
+    import_id: uuid.UUID,
+    background_tasks: BackgroundTasks,
+    force: bool = Query(False, description="Resume an import still marked as running, after a crash"),
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Continue an interrupted import from its last checkpoint"""
+    usage_import = usage_import_service.get_import(db, import_id, realm.id)
+    if usage_import.status == "completed":
+        raise HTTPException(status_code=409, detail="Import already completed")
+    if usage_import.status == "running" and not force:
+        raise HTTPException(status_code=409, detail="Import is running")
+
+    background_tasks.add_task(usage_import_service.run_import_in_background, usage_import.id)
+    return usage_import
@@ -0,0 +1,59 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from app.db.database import get_db
+from app.schemas.usage_quota import UsageQuotaCreate, UsageQuotaUpdate, UsageQuotaResponse
+from app.services import usage_quota_service
+from app.api.deps import get_current_user, check_realm_access
+from typing import List, Optional
+import uuid
+
+router = APIRouter()
+
+@router.post("/", response_model=UsageQuotaResponse)
+def create_quota(
+    quota: UsageQuotaCreate,
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Create a quota for an account, for the accounts of a tier, or for every account of the realm"""
+    return usage_quota_service.create_quota(db, quota, realm.id)
+
+@router.get("/", response_model=List[UsageQuotaResponse])
+def get_quotas(
+    tier: Optional[str] = Query(None, description="Only the quotas of this tier"),
+    account_id: Optional[uuid.UUID] = Query(None, description="Only the quotas of this account"),
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    return usage_quota_service.get_quotas(db, realm.id, tier, account_id)
+
+@router.get("/{quota_id}", response_model=UsageQuotaResponse)
+def get_quota(
+    quota_id: uuid.UUID,
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    return usage_quota_service.get_quota(db, quota_id, realm.id)
+
+@router.put("/{quota_id}", response_model=UsageQuotaResponse)
+def update_quota(
+    quota_id: uuid.UUID,
+    quota: UsageQuotaUpdate,
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    return usage_quota_service.update_quota(db, quota_id, quota, realm.id)
+
+@router.delete("/{quota_id}")
+def delete_quota(
+    quota_id: uuid.UUID,
+    realm: dict = Depends(check_realm_access),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    usage_quota_service.delete_quota(db, quota_id, realm.id)
+    return {"message": "Quota deleted successfully"}
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, List, Optional, Tuple, Type
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+# Longest wait between two flush attempts (seconds)
+_MAX_BACKOFF = 5
+
+class QueueFullError(Exception):
+    """Raised when a BatchWriter cannot accept more items"""
+
+class BatchWriter:
+    """
+    Bounded in-process queue drained by a background task.
+    Items are handed to `flush_func` (a blocking function, run in a worker thread)
+    in batches of up to `batch_size`, or whatever is queued after `flush_interval` seconds.
+    A batch still failing after `max_retries` attempts is dropped (handed to `dead_letter_func` when
+    given), but for two cases: errors in `item_errors` are caused by some items (e.g. a constraint
+    violation), the batch is halved until those are isolated and only they are dropped; with
+    `retry_forever` other errors (the destination is down) keep the batch until stop().
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush_func: Callable[[List[Any]], None],
+        max_queue_size: int,
+        batch_size: int,
+        flush_interval: float,
+        max_retries: int = 3,
+        dead_letter_func: Optional[Callable[[List[Any]], None]] = None,
+        item_errors: Tuple[Type[Exception], ...] = (),
+        retry_forever: bool = False
+    ):
+        self.name = name
+        self.flush_func = flush_func
+        self.dead_letter_func = dead_letter_func
+        self.item_errors = item_errors
+        self.retry_forever = retry_forever
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = True
+
+        metrics.register_gauge(f"{name}.queue_depth", lambda: self.depth)
+
+    @property
+    def running(self) -> bool:
+        return not self._closed
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self) -> None:
+        if self._task:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._closed = False
+        self._task = asyncio.create_task(self._run(), name=f"{self.name}-flusher")
+
+    async def stop(self) -> None:
+        """Stop accepting items and wait until everything queued has been flushed"""
+        if not self._task:
+            return
+        self._closed = True
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    def put_nowait(self, item: Any) -> None:
+        if self._closed:
+            raise QueueFullError(f"{self.name} is not accepting items")
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            metrics.increment(f"{self.name}.rejected")
+            raise QueueFullError(f"{self.name} queue is full")
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+        # Drain whatever was queued before stop() closed the writer
+        remaining = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[start:start + self.batch_size])
+
+    async def _flush(self, batch: List[Any]) -> None:
+        while True:
+            error = await self._attempt(batch, self.max_retries)
+            if error is None:
+                return
+            if isinstance(error, self.item_errors):
+                await self._isolate(batch)
+                return
+            if not self.retry_forever or self._closed:
+                await self._drop(batch)
+                return
+            # The destination is down: keep the batch (the queue filling up rejects new items) and wait
+            await asyncio.sleep(_MAX_BACKOFF)
+
+    async def _attempt(self, batch: List[Any], attempts: int) -> Optional[Exception]:
+        """Flush a batch, retrying with backoff; returns the last error, None once flushed"""
+        error = None
+        for attempt in range(1, attempts + 1):
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.flush_func, batch)
+            except Exception as e:
+                logger.exception("%s: flush of %d items failed (attempt %d/%d)", self.name, len(batch), attempt, attempts)
+                metrics.increment(f"{self.name}.flush_errors")
+                error = e
+                if attempt < attempts:
+                    await asyncio.sleep(min(2 ** attempt * 0.1, _MAX_BACKOFF))
+                continue
+
+            metrics.observe(f"{self.name}.flush_seconds", time.perf_counter() - started)
+            metrics.observe(f"{self.name}.batch_size", len(batch))
+            metrics.increment(f"{self.name}.flushed", len(batch))
+            return None
+        return error
+
+    async def _isolate(self, batch: List[Any]) -> None:
+        """Flush the halves of a batch rejected for its items on their own, down to the items that cannot be written"""
+        if len(batch) == 1:
+            await self._drop(batch)
+            return
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            error = await self._attempt(half, 1)
+            if error is None:
+                continue
+            if isinstance(error, self.item_errors):
+                await self._isolate(half)
+            else:
+                await self._flush(half)
+
+    async def _drop(self, batch: List[Any]) -> None:
+        metrics.increment(f"{self.name}.dropped", len(batch))
+        logger.error("%s: dropped %d items after %d failed attempts", self.name, len(batch), self.max_retries)
+        if self.dead_letter_func is not None:
+            try:
+                await asyncio.to_thread(self.dead_letter_func, batch)
+            except Exception:
+                logger.exception("%s: dead letter of %d items failed", self.name, len(batch))
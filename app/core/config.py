@@ -1,5 +1,5 @@
 from pydantic.v1 import BaseSettings
-from typing import List
+from typing import List, Optional
 from app.core.version import __version__
 
 class Settings(BaseSettings):
@@ -19,6 +19,146 @@ class Settings(BaseSettings):
     CORS_ALLOW_METHODS: List[str] = ["*"]
     CORS_ALLOW_HEADERS: List[str] = ["*"]
 
+    # Usage ingestion settings
+    USAGE_BATCH_MAX_SIZE: int = 1000
+    # "sync" writes every event before answering, "async" queues it for a background flusher
+    USAGE_INGEST_MODE: str = "sync"
+    USAGE_INGEST_QUEUE_SIZE: int = 10000
+    USAGE_INGEST_BATCH_SIZE: int = 500
+    USAGE_INGEST_FLUSH_INTERVAL: float = 1.0
+    USAGE_INGEST_RETRY_AFTER: int = 1
+    # Queued events rejected by the database (or still queued at shutdown while it is down) are appended
+    # to this JSON lines file, on a persistent volume (not kept when empty)
+    USAGE_INGEST_DEAD_LETTER_FILE: Optional[str] = "/var/lib/fiorino/usage-dead-letter.jsonl"
+
+    # Pricing resolution cache (seconds)
+    PRICING_CACHE_TTL: int = 300
+    PRICING_CACHE_MAX_SIZE: int = 10000
+
+    # LLM cost catalog responses (the pricing page), cached until a cost changes, starts or ends
+    LLM_COST_CATALOG_CACHE_TTL: int = 3600
+    LLM_COST_CATALOG_CACHE_MAX_SIZE: int = 1000
+
+    # API key validation cache (seconds)
+    API_KEY_CACHE_TTL: int = 60
+    API_KEY_NEGATIVE_CACHE_TTL: int = 10
+    API_KEY_CACHE_MAX_SIZE: int = 10000
+
+    # (realm_id, external_id) -> account id cache (seconds)
+    ACCOUNT_CACHE_TTL: int = 3600
+    ACCOUNT_CACHE_MAX_SIZE: int = 100000
+
+    # Idempotency keys are kept for USAGE_IDEMPOTENCY_RETENTION_HOURS, purged every
+    # USAGE_IDEMPOTENCY_PURGE_INTERVAL seconds; recent ones are cached to answer retries without a query
+    USAGE_IDEMPOTENCY_RETENTION_HOURS: int = 24
+    USAGE_IDEMPOTENCY_PURGE_INTERVAL: int = 600
+    USAGE_IDEMPOTENCY_CACHE_TTL: int = 3600
+    USAGE_IDEMPOTENCY_CACHE_MAX_SIZE: int = 100000
+
+    # Bulk usage imports: rows per COPY chunk (and checkpoint), and where uploaded files are kept
+    USAGE_IMPORT_CHUNK_SIZE: int = 50000
+    USAGE_IMPORT_DIR: str = "/tmp/fiorino-imports"
+
+    # Usage exports: rows fetched per server-side cursor round trip (and per encoded chunk)
+    USAGE_EXPORT_BATCH_SIZE: int = 10000
+
+    # Daily usage rollup read by the KPIs: refreshed every USAGE_ROLLUP_INTERVAL seconds, at most
+    # USAGE_ROLLUP_BATCH_SIZE usage ids per run, once new rows are USAGE_ROLLUP_SETTLE_SECONDS old
+    USAGE_ROLLUP_ENABLED: bool = True
+    USAGE_ROLLUP_INTERVAL: int = 60
+    USAGE_ROLLUP_BATCH_SIZE: int = 500000
+    USAGE_ROLLUP_SETTLE_SECONDS: int = 60
+
+    # Usage sketches (approximate KPIs per realm and day), updated from the tracked usage and
+    # merged into Postgres every USAGE_SKETCH_FLUSH_INTERVAL seconds
+    USAGE_SKETCHES_ENABLED: bool = True
+    USAGE_SKETCH_FLUSH_INTERVAL: int = 10
+    USAGE_SKETCH_MAX_PENDING: int = 1000000
+    # Counters kept by the heavy-hitter sketches, the error bound is total / capacity
+    USAGE_SKETCH_TOP_CAPACITY: int = 1000
+    # Registers of the distinct account counters are 2^precision bytes, error 1.04 / sqrt(2^precision)
+    USAGE_SKETCH_HLL_PRECISION: int = 14
+    # Quantiles of the per-request distributions are within this relative error
+    USAGE_SKETCH_RELATIVE_ACCURACY: float = 0.01
+    USAGE_SKETCH_MAX_BINS: int = 2048
+
+    # KPI response cache (seconds): ranges ending before today (UTC) are kept up to KPI_CACHE_TTL,
+    # ranges including today up to KPI_CACHE_OPEN_TTL and until new usage of the realm is tracked
+    KPI_CACHE_TTL: int = 7 * 24 * 3600
+    KPI_CACHE_OPEN_TTL: int = 300
+    KPI_CACHE_MAX_SIZE: int = 10000
+    # How often the realms with new usage are announced to the other workers
+    KPI_WATERMARK_PUBLISH_INTERVAL: float = 1.0
+    # Most points per series returned by the time-series KPI
+    KPI_TIMESERIES_MAX_POINTS: int = 500
+
+    # Bill limit enforcement: per-realm (and per-account) spend counters answer /usage/track and
+    # /usage/budget from memory; they are shared between workers every BILL_LIMIT_PUBLISH_INTERVAL
+    # seconds and reconciled with the usage every BILL_LIMIT_RECONCILE_INTERVAL seconds.
+    # soft_limit is reported from BILL_LIMIT_SOFT_THRESHOLD of the limit
+    BILL_LIMIT_SOFT_THRESHOLD: float = 0.8
+    BILL_LIMIT_PUBLISH_INTERVAL: float = 1.0
+    BILL_LIMIT_RECONCILE_INTERVAL: int = 30
+    BILL_LIMIT_MAX_COUNTERS: int = 100000
+    BILL_LIMIT_COUNTER_TTL: int = 3600
+
+    # Usage quotas: accounts are matched to tiers by the QUOTA_TIER_ATTRIBUTE key of their data.
+    # Sliding-window counters are held in memory, shared between workers every QUOTA_PUBLISH_INTERVAL
+    # seconds, and the day and month ones checkpointed to Postgres every QUOTA_CHECKPOINT_INTERVAL
+    # seconds with the usage created up to QUOTA_CHECKPOINT_LAG seconds before (queued usage is written late)
+    QUOTA_TIER_ATTRIBUTE: str = "tier"
+    QUOTA_PUBLISH_INTERVAL: float = 1.0
+    QUOTA_CHECKPOINT_INTERVAL: int = 60
+    QUOTA_CHECKPOINT_LAG: int = 120
+    QUOTA_MAX_COUNTERS: int = 100000
+    QUOTA_COUNTER_TTL: int = 3600
+    QUOTA_CACHE_TTL: int = 300
+
+    # Budget alerts: the rules of the realms and accounts with new usage are evaluated every
+    # ALERT_EVALUATION_INTERVAL seconds against the spend counters; a fired rule is re-armed once the
+    # value drops ALERT_HYSTERESIS (a share of the threshold) below it, or at the next budget period.
+    # Notifications are posted to each webhook every ALERT_FLUSH_INTERVAL seconds, up to ALERT_BATCH_SIZE
+    # per request; a failing webhook is retried after ALERT_RETRY_BACKOFF seconds, doubled at every failure
+    # up to ALERT_RETRY_MAX_BACKOFF, and its alerts dropped after ALERT_MAX_RETRIES failures in a row.
+    # They are signed with ALERT_WEBHOOK_SECRET (HMAC-SHA256) when it is set
+    ALERT_EVALUATION_INTERVAL: float = 1.0
+    ALERT_HYSTERESIS: float = 0.05
+    ALERT_RULES_CACHE_TTL: int = 300
+    ALERT_RULES_CACHE_MAX_SIZE: int = 10000
+    ALERT_QUEUE_SIZE: int = 10000
+    ALERT_BATCH_SIZE: int = 100
+    ALERT_FLUSH_INTERVAL: float = 2.0
+    ALERT_MAX_RETRIES: int = 8
+    ALERT_RETRY_BACKOFF: float = 2.0
+    ALERT_RETRY_MAX_BACKOFF: float = 300.0
+    ALERT_WEBHOOK_TIMEOUT: float = 10.0
+    ALERT_WEBHOOK_SECRET: Optional[str] = None
+
+    # Live usage stream (SSE): deltas are pushed every LIVE_USAGE_TICK_INTERVAL seconds, a comment is
+    # sent after LIVE_USAGE_KEEPALIVE_INTERVAL idle seconds, the budget is reloaded every LIVE_USAGE_REFRESH_INTERVAL
+    LIVE_USAGE_TICK_INTERVAL: float = 1.0
+    LIVE_USAGE_KEEPALIVE_INTERVAL: float = 15.0
+    LIVE_USAGE_REFRESH_INTERVAL: int = 60
+    # Realms with subscribers on other workers whose usage is shared with them
+    LIVE_USAGE_MAX_REALMS: int = 10000
+    # Lifetime of the tokens opening a stream (EventSource cannot send an Authorization header)
+    LIVE_USAGE_TOKEN_EXPIRE_SECONDS: int = 60
+
+    # Message tokenization thread pool
+    TOKENIZER_WORKERS: int = 4
+    TOKENIZER_MAX_CONCURRENCY: int = 16
+
+    # Buffered API request logging
+    API_LOG_QUEUE_SIZE: int = 10000
+    API_LOG_BATCH_SIZE: int = 500
+    API_LOG_FLUSH_INTERVAL: float = 2.0
+    API_LOG_CONFIG_CACHE_TTL: int = 300
+    API_LOG_CONFIG_CACHE_MAX_SIZE: int = 10000
+    API_LOG_MAX_BODY_SIZE: int = 16384
+
+    # Propagate cache invalidations to the other workers through Postgres LISTEN/NOTIFY
+    PUBSUB_ENABLED: bool = True
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,20 @@
+import logging
+from typing import Any, Callable, Dict, List
+
+# In-process notifications between services, e.g. "usage_tracked" once new usage is committed.
+# Handlers run synchronously on the emitting thread: they must be fast and thread-safe.
+# A failing handler is logged and never fails the emitter. Use pubsub to reach other workers.
+
+logger = logging.getLogger(__name__)
+
+_handlers: Dict[str, List[Callable[..., None]]] = {}
+
+def subscribe(topic: str, handler: Callable[..., None]) -> None:
+    _handlers.setdefault(topic, []).append(handler)
+
+def emit(topic: str, *args: Any) -> None:
+    for handler in _handlers.get(topic, []):
+        try:
+            handler(*args)
+        except Exception:
+            logger.exception("event handler for %s failed", topic)
@@ -0,0 +1,44 @@
+import threading
+from typing import Callable, Dict
+
+# In-process metrics registry, exposed as JSON on /api/metrics.
+# Every uvicorn worker keeps its own values.
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_summaries: Dict[str, Dict[str, float]] = {}
+_gauges: Dict[str, Callable[[], float]] = {}
+
+def increment(name: str, value: float = 1) -> None:
+    """Add a value to a monotonically increasing counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def observe(name: str, value: float) -> None:
+    """Record a sample (e.g. a latency in seconds) in a count/sum/max summary"""
+    with _lock:
+        summary = _summaries.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0, "last": 0.0})
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["max"] = max(summary["max"], value)
+        summary["last"] = value
+
+def register_gauge(name: str, callback: Callable[[], float]) -> None:
+    """Register a callback read every time metrics are collected"""
+    with _lock:
+        _gauges[name] = callback
+
+def snapshot() -> dict:
+    with _lock:
+        counters = dict(_counters)
+        summaries = {
+            name: {**summary, "avg": summary["sum"] / summary["count"] if summary["count"] else 0.0}
+            for name, summary in _summaries.items()
+        }
+        gauges = dict(_gauges)
+
+    return {
+        "counters": counters,
+        "summaries": summaries,
+        "gauges": {name: callback() for name, callback in gauges.items()}
+    }
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Optional
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+class PeriodicTask:
+    """
+    Background task running `func` (a blocking function, run in a worker thread)
+    every `interval` seconds until stopped. Failures are logged and retried at the next run.
+    """
+
+    def __init__(self, name: str, func: Callable[[], Any], interval: float):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self) -> None:
+        if self._task:
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name=self.name)
+
+    async def stop(self) -> None:
+        """Wait for the current run, if any, then stop"""
+        if not self._task:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    async def run_once(self) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self.func)
+        except Exception:
+            logger.exception("%s: run failed", self.name)
+            metrics.increment(f"{self.name}.errors")
+            return
+        metrics.observe(f"{self.name}.run_seconds", time.perf_counter() - started)
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            await self.run_once()
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
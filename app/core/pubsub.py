@@ -0,0 +1,149 @@
+import json
+import logging
+import select
+import threading
+import uuid
+from typing import Callable, Dict, List, Optional
+import psycopg2
+from sqlalchemy.engine import make_url
+from app.core.config import settings
+
+# Cross-worker messaging over Postgres LISTEN/NOTIFY.
+# publish() always dispatches to the local handlers first; when PUBSUB_ENABLED is set the
+# message is also sent with pg_notify, so every other uvicorn worker dispatches it too.
+# Handlers run on the publisher's thread or on the listener thread and must be thread-safe.
+# After a lost connection every handler is called with None: messages may have been missed.
+# Postgres rejects NOTIFY payloads of 8000 bytes or more: lists are sent with publish_list.
+
+logger = logging.getLogger(__name__)
+
+PG_CHANNEL = "fiorino_pubsub"
+# Largest message sent with pg_notify, under the 8000 bytes limit of Postgres
+MAX_MESSAGE_SIZE = 7900
+
+_sender_id = uuid.uuid4().hex
+_handlers: Dict[str, List[Callable[[Optional[str]], None]]] = {}
+_publish_lock = threading.Lock()
+_publish_connection = None
+_listener: Optional[threading.Thread] = None
+_stopping = threading.Event()
+
+def _connect():
+    url = make_url(settings.DATABASE_URL).set(drivername="postgresql")
+    connection = psycopg2.connect(url.render_as_string(hide_password=False))
+    connection.set_session(autocommit=True)
+    return connection
+
+def subscribe(channel: str, handler: Callable[[Optional[str]], None]) -> None:
+    _handlers.setdefault(channel, []).append(handler)
+
+def _dispatch(channel: str, payload: Optional[str]) -> None:
+    for handler in _handlers.get(channel, []):
+        try:
+            handler(payload)
+        except Exception:
+            logger.exception("pubsub handler for %s failed", channel)
+
+def _dispatch_all(payload: Optional[str]) -> None:
+    for channel in list(_handlers):
+        _dispatch(channel, payload)
+
+def publish(channel: str, payload: Optional[str], local: bool = True) -> bool:
+    """
+    Deliver a message to the handlers of every worker (but this one when local is False).
+    Returns False when it could not be sent to the other workers.
+    """
+    if local:
+        _dispatch(channel, payload)
+
+    if not settings.PUBSUB_ENABLED:
+        return True
+
+    global _publish_connection
+    message = json.dumps({"sender": _sender_id, "channel": channel, "payload": payload})
+    if len(message) > MAX_MESSAGE_SIZE:
+        logger.error("pubsub message on %s too large (%d bytes)", channel, len(message))
+        return False
+    with _publish_lock:
+        try:
+            if _publish_connection is None or _publish_connection.closed:
+                _publish_connection = _connect()
+            with _publish_connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", (PG_CHANNEL, message))
+        except Exception:
+            logger.exception("pubsub publish on %s failed", channel)
+            _publish_connection = None
+            return False
+    return True
+
+def publish_list(channel: str, items: list, local: bool = True) -> bool:
+    """
+    Publish a list as JSON, split into as many messages as needed to stay under MAX_MESSAGE_SIZE.
+    Returns False when some of it could not be sent; the handlers of the other workers should then be reset
+    by publishing None.
+    """
+    # Size of an empty message, and of every item once escaped in the payload string
+    overhead = len(json.dumps({"sender": _sender_id, "channel": channel, "payload": "[]"}))
+    sent = True
+    chunk, size = [], overhead
+    for item in items:
+        item_size = len(json.dumps(json.dumps(item))) - 2 + len(", ")
+        if chunk and size + item_size > MAX_MESSAGE_SIZE:
+            sent = publish(channel, json.dumps(chunk), local) and sent
+            chunk, size = [], overhead
+        chunk.append(item)
+        size += item_size
+    if chunk:
+        sent = publish(channel, json.dumps(chunk), local) and sent
+    return sent
+
+def _listen() -> None:
+    connection = None
+    backoff = 1
+    while not _stopping.is_set():
+        try:
+            if connection is None:
+                connection = _connect()
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {PG_CHANNEL}")
+                backoff = 1
+                # Anything published while disconnected was lost
+                _dispatch_all(None)
+
+            if select.select([connection], [], [], 1.0) == ([], [], []):
+                continue
+            connection.poll()
+            while connection.notifies:
+                notify = connection.notifies.pop(0)
+                message = json.loads(notify.payload)
+                if message["sender"] != _sender_id:
+                    _dispatch(message["channel"], message["payload"])
+        except Exception:
+            logger.exception("pubsub listener failed, reconnecting in %ss", backoff)
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+                connection = None
+            _stopping.wait(backoff)
+            backoff = min(backoff * 2, 30)
+
+    if connection is not None:
+        connection.close()
+
+def start() -> None:
+    global _listener
+    if not settings.PUBSUB_ENABLED or _listener is not None:
+        return
+    _stopping.clear()
+    _listener = threading.Thread(target=_listen, name="pubsub-listener", daemon=True)
+    _listener.start()
+
+def stop() -> None:
+    global _listener
+    if _listener is None:
+        return
+    _stopping.set()
+    _listener.join(timeout=5)
+    _listener = None
@@ -0,0 +1,242 @@
+import hashlib
+import math
+import struct
+import uuid
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+# Mergeable summaries of usage, persisted as bytea by usage_sketch_service.
+# Every sketch has merge() returning a new sketch and to_bytes()/from_bytes() for storage.
+
+class SpaceSaving:
+    """
+    Weighted Space-Saving summary of the heaviest UUID keys (accounts, API keys...).
+    Keeps at most `capacity` counters; a counter overestimates the weight of its key by at most
+    its error, and a key that is not kept weighs at most `missing`.
+    Merging follows the mergeable summaries of Agarwal et al.: a key absent from one side is
+    counted with that side's `missing` bound, both as weight and as error.
+    """
+
+    _HEADER = struct.Struct("<Idd")
+    _COUNTER = struct.Struct("<16sdd")
+
+    def __init__(self, capacity: int, counters: Optional[Dict[uuid.UUID, Tuple[float, float]]] = None, missing: float = 0.0, total: float = 0.0):
+        self.capacity = capacity
+        # key -> (weight, error)
+        self.counters = counters or {}
+        self.missing = missing
+        self.total = total
+
+    @classmethod
+    def from_counts(cls, capacity: int, counts: Dict[uuid.UUID, float], total: Optional[float] = None) -> "SpaceSaving":
+        """Summary of exact weights: the `capacity` heaviest keys are kept without error"""
+        ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+        return cls(
+            capacity,
+            {key: (weight, 0.0) for key, weight in ranked[:capacity]},
+            ranked[capacity][1] if len(ranked) > capacity else 0.0,
+            sum(counts.values()) if total is None else total
+        )
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        merged = {}
+        for key in self.counters.keys() | other.counters.keys():
+            weight, error = self.counters.get(key, (self.missing, self.missing))
+            other_weight, other_error = other.counters.get(key, (other.missing, other.missing))
+            merged[key] = (weight + other_weight, error + other_error)
+
+        ranked = sorted(merged.items(), key=lambda item: item[1][0], reverse=True)
+        capacity = max(self.capacity, other.capacity)
+        missing = self.missing + other.missing
+        if len(ranked) > capacity:
+            missing = max(missing, ranked[capacity][1][0])
+        return SpaceSaving(capacity, dict(ranked[:capacity]), missing, self.total + other.total)
+
+    def top(self, n: int) -> List[Tuple[uuid.UUID, float, float]]:
+        """
+        The n heaviest keys as (key, lower bound, upper bound) of their weight, ranked by the
+        guaranteed lower bound: merged counters inflate the upper one by the `missing` of the sides without the key.
+        """
+        ranked = sorted(
+            ((key, weight - error, min(weight, self.total)) for key, (weight, error) in self.counters.items()),
+            key=lambda item: (item[1], item[2]),
+            reverse=True
+        )
+        return ranked[:n]
+
+    def to_bytes(self) -> bytes:
+        return self._HEADER.pack(self.capacity, self.missing, self.total) + b"".join(
+            self._COUNTER.pack(key.bytes, weight, error)
+            for key, (weight, error) in self.counters.items()
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SpaceSaving":
+        capacity, missing, total = cls._HEADER.unpack_from(data)
+        counters = {
+            uuid.UUID(bytes=key): (weight, error)
+            for key, weight, error in cls._COUNTER.iter_unpack(data[cls._HEADER.size:])
+        }
+        return cls(capacity, counters, missing, total)
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter of UUIDs with 2^precision one-byte registers,
+    relative standard error 1.04 / sqrt(2^precision) (0.8% at precision 14).
+    Stored zlib-compressed: registers of small sets are mostly zeros.
+    """
+
+    _RANKS = [2.0 ** -rank for rank in range(65)]
+
+    def __init__(self, precision: int, registers: Optional[bytearray] = None):
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add(self, key: uuid.UUID) -> None:
+        hashed = int.from_bytes(hashlib.blake2b(key.bytes, digest_size=8).digest(), "big")
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.precision != self.precision:
+            raise ValueError("cannot merge HyperLogLogs of different precisions")
+        return HyperLogLog(self.precision, bytearray(map(max, self.registers, other.registers)))
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(self._RANKS[rank] for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small sets
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        return cls(data[0], bytearray(zlib.decompress(data[1:])))
+
+class DDSketch:
+    """
+    DDSketch quantile summary of non-negative values (tokens, prices): any quantile is returned
+    within `relative_accuracy` of the exact value. Values are counted in logarithmic bins;
+    past `max_bins` the lowest bins are collapsed, losing accuracy on the smallest values only.
+    """
+
+    _HEADER = struct.Struct("<dIQQddd")
+    _BIN = struct.Struct("<iQ")
+
+    def __init__(self, relative_accuracy: float, max_bins: int):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, index: int) -> float:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value: float, count: int = 1) -> None:
+        if value <= 0:
+            self.zero_count += count
+        else:
+            index = self._index(value)
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+        self.sum += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self._collapse()
+
+    def _collapse(self) -> None:
+        if len(self.bins) <= self.max_bins:
+            return
+        indexes = sorted(self.bins)
+        collapsed = indexes[:len(indexes) - self.max_bins + 1]
+        self.bins[collapsed[-1]] = sum(self.bins.pop(index) for index in collapsed[:-1]) + self.bins[collapsed[-1]]
+
+    def merge(self, other: "DDSketch") -> "DDSketch":
+        if other.gamma != self.gamma:
+            raise ValueError("cannot merge DDSketches of different accuracies")
+        merged = DDSketch(self.relative_accuracy, max(self.max_bins, other.max_bins))
+        merged.bins = dict(self.bins)
+        for index, count in other.bins.items():
+            merged.bins[index] = merged.bins.get(index, 0) + count
+        merged.zero_count = self.zero_count + other.zero_count
+        merged.count = self.count + other.count
+        merged.sum = self.sum + other.sum
+        merged.min = min(self.min, other.min)
+        merged.max = max(self.max, other.max)
+        merged._collapse()
+        return merged
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def histogram(self, buckets: int) -> List[Tuple[float, float, int]]:
+        """Counts in `buckets` log-spaced buckets from min to max as (lower, upper, count), zeros first"""
+        if not self.count:
+            return []
+        histogram = [(0.0, 0.0, self.zero_count)] if self.zero_count else []
+        positive = sorted(self.bins)
+        if not positive:
+            return histogram
+
+        low, high = max(self.min, self._value(positive[0])), self.max
+        if low <= 0 or high <= low:
+            return histogram + [(low, high, sum(self.bins.values()))]
+        ratio = (high / low) ** (1 / buckets)
+        edges = [low * ratio ** bucket for bucket in range(buckets)] + [high]
+        counts = [0] * buckets
+        for index in positive:
+            value = min(max(self._value(index), low), high)
+            bucket = min(int(math.log(value / low) / math.log(ratio)), buckets - 1)
+            counts[bucket] += self.bins[index]
+        return histogram + [(edges[bucket], edges[bucket + 1], counts[bucket]) for bucket in range(buckets)]
+
+    def to_bytes(self) -> bytes:
+        header = self._HEADER.pack(
+            self.relative_accuracy, self.max_bins, self.zero_count, self.count,
+            self.sum, self.min if self.count else 0.0, self.max if self.count else 0.0
+        )
+        return header + b"".join(self._BIN.pack(index, count) for index, count in self.bins.items())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DDSketch":
+        relative_accuracy, max_bins, zero_count, count, total, minimum, maximum = cls._HEADER.unpack_from(data)
+        sketch = cls(relative_accuracy, max_bins)
+        sketch.bins = dict(cls._BIN.iter_unpack(data[cls._HEADER.size:]))
+        sketch.zero_count = zero_count
+        sketch.count = count
+        sketch.sum = total
+        if count:
+            sketch.min, sketch.max = minimum, maximum
+        return sketch
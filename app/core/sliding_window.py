@@ -0,0 +1,72 @@
+import struct
+from typing import Dict, List, Optional
+
+class SlidingWindowCounter:
+    """
+    Sums of a few measures (tokens, cost, requests...) over a rolling window, kept in `buckets`
+    fixed-width buckets: a total covers the current bucket and the buckets - 1 before it, so it
+    is exact to within one bucket width at the start of the window.
+    Buckets are indexed by timestamp // width, so counters of the same window can be merged.
+    """
+
+    def __init__(self, window: float, buckets: int, measures: int):
+        self.window = window
+        self.bucket_count = buckets
+        self.width = window / buckets
+        self.measures = measures
+        self.buckets: Dict[int, List[float]] = {}
+
+    def _index(self, timestamp: float) -> int:
+        return int(timestamp // self.width)
+
+    def add(self, timestamp: float, values: List[float]) -> None:
+        bucket = self.buckets.get(self._index(timestamp))
+        if bucket is None:
+            bucket = self.buckets[self._index(timestamp)] = [0.0] * self.measures
+        for measure, value in enumerate(values):
+            bucket[measure] += value
+
+    def prune(self, now: float) -> None:
+        """Drop the buckets that left the window"""
+        oldest = self._index(now) - self.bucket_count
+        for index in [index for index in self.buckets if index <= oldest]:
+            del self.buckets[index]
+
+    def totals(self, now: float) -> List[float]:
+        oldest = self._index(now) - self.bucket_count
+        totals = [0.0] * self.measures
+        for index, bucket in self.buckets.items():
+            if index > oldest:
+                for measure, value in enumerate(bucket):
+                    totals[measure] += value
+        return totals
+
+    def resets_in(self, now: float, measure: int) -> Optional[float]:
+        """Seconds until the oldest bucket with some of `measure` leaves the window"""
+        oldest = self._index(now) - self.bucket_count
+        indexes = [index for index, bucket in self.buckets.items() if index > oldest and bucket[measure]]
+        if not indexes:
+            return None
+        return max((min(indexes) + self.bucket_count) * self.width - now, 0.0)
+
+    def merge(self, other: "SlidingWindowCounter") -> "SlidingWindowCounter":
+        if other.width != self.width or other.measures != self.measures:
+            raise ValueError("cannot merge counters of different windows")
+        merged = SlidingWindowCounter(self.window, self.bucket_count, self.measures)
+        for counter in (self, other):
+            for index, bucket in counter.buckets.items():
+                total = merged.buckets.setdefault(index, [0.0] * self.measures)
+                for measure, value in enumerate(bucket):
+                    total[measure] += value
+        return merged
+
+    def to_bytes(self) -> bytes:
+        values = struct.Struct(f"<q{self.measures}d")
+        return b"".join(values.pack(index, *bucket) for index, bucket in sorted(self.buckets.items()))
+
+    @classmethod
+    def from_bytes(cls, window: float, buckets: int, measures: int, data: bytes) -> "SlidingWindowCounter":
+        counter = cls(window, buckets, measures)
+        for index, *bucket in struct.Struct(f"<q{measures}d").iter_unpack(data):
+            counter.buckets[index] = bucket
+        return counter
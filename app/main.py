@@ -1,10 +1,39 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.core.config import settings
 from app.api.routes import main_router
 from fastapi.middleware.cors import CORSMiddleware
 from app.static import admin
+from app.services import usage_ingest_service, api_log_service, usage_rollup_service, kpi_cache_service, usage_sketch_service, live_usage_service, budget_service, usage_quota_service, alert_service
+from app.core import pubsub
 
-app = FastAPI(title=settings.PROJECT_NAME, version=settings.PROJECT_VERSION, debug=settings.DEBUG)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start background workers
+    pubsub.start()
+    await usage_ingest_service.start()
+    await api_log_service.api_log_writer.start()
+    await usage_rollup_service.start()
+    await kpi_cache_service.start()
+    await usage_sketch_service.start()
+    await live_usage_service.start()
+    await budget_service.start()
+    await usage_quota_service.start()
+    await alert_service.start()
+    yield
+    # Drain queued work before the worker exits
+    await usage_ingest_service.stop()
+    await api_log_service.api_log_writer.stop()
+    await usage_rollup_service.stop()
+    await kpi_cache_service.stop()
+    await usage_sketch_service.stop()
+    await live_usage_service.stop()
+    await budget_service.stop()
+    await usage_quota_service.stop()
+    await alert_service.stop()
+    pubsub.stop()
+
+app = FastAPI(title=settings.PROJECT_NAME, version=settings.PROJECT_VERSION, debug=settings.DEBUG, lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
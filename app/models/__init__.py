@@ -7,4 +7,9 @@ from .bill_limit import BillLimit
 from .overhead import Overhead
 from .account import Account
 from .large_language_model import LargeLanguageModel
-from .api_log import APILog
\ No newline at end of file
+from .api_log import APILog
+from .usage_import import UsageImport
+from .usage_daily_rollup import UsageDailyRollup, UsageRollupState
+from .usage_sketch import UsageSketch
+from .usage_quota import UsageQuota, UsageQuotaCounter
+from .alert_rule import AlertRule
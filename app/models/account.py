@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, String, DateTime, ForeignKey, JSON, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -15,4 +15,9 @@ class Account(Base):
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
     realm = relationship("Realm", back_populates="accounts")
-    usages = relationship("Usage", back_populates="account")
\ No newline at end of file
+    usages = relationship("Usage", back_populates="account")
+
+    __table_args__ = (
+        # One account per external_id in a realm
+        UniqueConstraint('realm_id', 'external_id', name='uix_accounts_realm_external_id'),
+    )
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, String, Float, Boolean, DateTime, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class AlertRule(Base):
+    """Webhook notified when the spend of a realm or account crosses a threshold in a budget period"""
+    __tablename__ = "alert_rules"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, server_default=func.uuid_generate_v4())
+    realm_id = Column(String(24), ForeignKey('realms.id', ondelete='CASCADE'), nullable=False)
+    account_id = Column(UUID(as_uuid=True), ForeignKey('accounts.id', ondelete='CASCADE'), nullable=True)
+    threshold_type = Column(String(20), nullable=False)
+    threshold = Column(Float, nullable=False)
+    webhook_url = Column(String(2048), nullable=False)
+    enabled = Column(Boolean, nullable=False, default=True)
+    armed = Column(Boolean, nullable=False, default=True)
+    period_start = Column(DateTime(timezone=True), nullable=True)
+    last_triggered_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
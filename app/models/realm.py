@@ -1,8 +1,9 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, text, Boolean
+from sqlalchemy import Column, String, DateTime, ForeignKey, text, Boolean, Float, Integer
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import UUID
 from app.db.database import Base
+from app.core.config import settings
 
 class Realm(Base):
     __tablename__ = "realms"
@@ -14,6 +15,10 @@ class Realm(Base):
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
     bill_limit_enabled = Column(Boolean, nullable=False, default=False)
     overhead_enabled = Column(Boolean, nullable=False, default=False)
+    # API log sampling: share of successful / failed requests to log, and largest body stored (bytes)
+    log_sample_rate = Column(Float, nullable=False, default=1.0)
+    log_error_sample_rate = Column(Float, nullable=False, default=1.0)
+    log_max_body_size = Column(Integer, nullable=False, default=settings.API_LOG_MAX_BODY_SIZE)
 
     user = relationship("User", back_populates="realms")
     api_keys = relationship("APIKey", back_populates="realm")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from app.db.database import Base
 from sqlalchemy.dialects.postgresql import UUID
@@ -18,9 +18,33 @@ class Usage(Base):
     total_model_price = Column(Float, nullable=False)
     total_price = Column(Float, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Client supplied key, cleared once older than the retention window
+    idempotency_key = Column(String(255), nullable=True)
     # updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
     llm_cost = relationship("LLMCost", back_populates="usages")
     realm = relationship("Realm", back_populates="usages")
     api_key = relationship("APIKey", back_populates="usages")
     account = relationship("Account", back_populates="usages")
+
+    __table_args__ = (
+        # Realm range scans, covering the columns read by the KPIs
+        Index(
+            'idx_usage_realm_created_at',
+            'realm_id',
+            'created_at',
+            postgresql_include=[
+                'id', 'llm_cost_id', 'account_id', 'api_key_id', 'input_tokens',
+                'output_tokens', 'total_tokens', 'total_model_price', 'total_price'
+            ]
+        ),
+        Index('idx_usage_realm_account_created_at', 'realm_id', 'account_id', 'created_at'),
+        # One usage per idempotency key in a realm
+        Index(
+            'uix_usage_realm_idempotency_key',
+            'realm_id',
+            'idempotency_key',
+            unique=True,
+            postgresql_where=idempotency_key.isnot(None)
+        ),
+    )
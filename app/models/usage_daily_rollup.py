@@ -0,0 +1,30 @@
+from sqlalchemy import Column, String, BigInteger, SmallInteger, Float, Date, DateTime, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class UsageDailyRollup(Base):
+    """Usage aggregated per (realm, day, llm, account, api key), maintained by usage_rollup_service"""
+    __tablename__ = "usage_daily_rollup"
+
+    id = Column(BigInteger, primary_key=True)
+    realm_id = Column(String(24), ForeignKey('realms.id', ondelete='CASCADE'), nullable=False)
+    day = Column(Date, nullable=False)
+    llm_id = Column(UUID(as_uuid=True), ForeignKey('large_language_models.id', ondelete='CASCADE'), nullable=False)
+    account_id = Column(UUID(as_uuid=True), nullable=True)
+    api_key_id = Column(UUID(as_uuid=True), nullable=True)
+    events = Column(BigInteger, nullable=False)
+    input_tokens = Column(BigInteger, nullable=False)
+    output_tokens = Column(BigInteger, nullable=False)
+    total_tokens = Column(BigInteger, nullable=False)
+    total_model_price = Column(Float, nullable=False)
+    total_price = Column(Float, nullable=False)
+
+class UsageRollupState(Base):
+    """Single row (id 1) holding the high-water mark of the rollup on usage.id"""
+    __tablename__ = "usage_rollup_state"
+
+    id = Column(SmallInteger, primary_key=True)
+    last_usage_id = Column(BigInteger, nullable=False, default=0)
+    pending_usage_id = Column(BigInteger, nullable=False, default=0)
+    pending_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
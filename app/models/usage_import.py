@@ -0,0 +1,28 @@
+from sqlalchemy import Column, String, BigInteger, DateTime, ForeignKey, Text
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class UsageImport(Base):
+    __tablename__ = "usage_imports"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, server_default=func.uuid_generate_v4())
+    realm_id = Column(String(24), ForeignKey('realms.id', ondelete='CASCADE'), nullable=False)
+    # Path of the imported file, read again from rows_read when the import is resumed
+    source = Column(String(1024), nullable=False)
+    format = Column(String(10), nullable=False)
+    # pending, running, completed or failed
+    status = Column(String(20), nullable=False, default="pending")
+    # Checkpoint: rows of the source already processed, committed together with their usage
+    rows_read = Column(BigInteger, nullable=False, default=0)
+    rows_imported = Column(BigInteger, nullable=False, default=0)
+    # Rows whose idempotency key was already imported
+    rows_skipped = Column(BigInteger, nullable=False, default=0)
+    # Rows that could not be parsed or priced
+    rows_rejected = Column(BigInteger, nullable=False, default=0)
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    realm = relationship("Realm")
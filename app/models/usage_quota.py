@@ -0,0 +1,29 @@
+from sqlalchemy import Column, String, Float, DateTime, ForeignKey, LargeBinary
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class UsageQuota(Base):
+    """Most tokens, cost or requests of an account over a rolling period"""
+    __tablename__ = "usage_quotas"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, server_default=func.uuid_generate_v4())
+    realm_id = Column(String(24), ForeignKey('realms.id', ondelete='CASCADE'), nullable=False)
+    # One account, the accounts of a tier, or every account of the realm when both are None
+    account_id = Column(UUID(as_uuid=True), ForeignKey('accounts.id', ondelete='CASCADE'), nullable=True)
+    tier = Column(String(255), nullable=True)
+    metric = Column(String(20), nullable=False)
+    period = Column(String(20), nullable=False)
+    amount = Column(Float, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+class UsageQuotaCounter(Base):
+    """Checkpoint of the sliding-window counter (see app.core.sliding_window) of an account and period"""
+    __tablename__ = "usage_quota_counters"
+
+    account_id = Column(UUID(as_uuid=True), ForeignKey('accounts.id', ondelete='CASCADE'), primary_key=True)
+    period = Column(String(20), primary_key=True)
+    realm_id = Column(String(24), ForeignKey('realms.id', ondelete='CASCADE'), nullable=False)
+    checkpointed_at = Column(DateTime(timezone=True), nullable=False)
+    data = Column(LargeBinary, nullable=False)
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, String, BigInteger, Date, DateTime, ForeignKey, LargeBinary
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class UsageSketch(Base):
+    """Serialized sketch (see app.core.sketches) of the usage of a realm, day and optionally llm"""
+    __tablename__ = "usage_sketches"
+
+    id = Column(BigInteger, primary_key=True)
+    realm_id = Column(String(24), ForeignKey('realms.id', ondelete='CASCADE'), nullable=False)
+    day = Column(Date, nullable=False)
+    llm_id = Column(UUID(as_uuid=True), ForeignKey('large_language_models.id', ondelete='CASCADE'), nullable=True)
+    name = Column(String(64), nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
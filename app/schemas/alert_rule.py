@@ -0,0 +1,34 @@
+from pydantic import BaseModel, ConfigDict, Field
+from datetime import datetime
+from typing import Literal, Optional
+from uuid import UUID
+
+# percentage: of the bill limit (the realm's, or the account's {"bill_limit": ...}), amount: of spend
+ThresholdType = Literal["percentage", "amount"]
+
+class AlertRuleBase(BaseModel):
+    # None for the spend of the whole realm
+    account_id: Optional[UUID] = None
+    threshold_type: ThresholdType
+    threshold: float = Field(..., gt=0)
+    webhook_url: str = Field(..., max_length=2048, pattern=r"^https?://")
+    enabled: bool = True
+
+class AlertRuleCreate(AlertRuleBase):
+    pass
+
+class AlertRuleUpdate(BaseModel):
+    threshold_type: Optional[ThresholdType] = None
+    threshold: Optional[float] = Field(None, gt=0)
+    webhook_url: Optional[str] = Field(None, max_length=2048, pattern=r"^https?://")
+    enabled: Optional[bool] = None
+
+class AlertRuleResponse(AlertRuleBase):
+    id: UUID
+    realm_id: str
+    armed: bool
+    period_start: Optional[datetime] = None
+    last_triggered_at: Optional[datetime] = None
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
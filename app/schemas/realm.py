@@ -1,12 +1,16 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
 from typing import Optional
 from uuid import UUID
+from app.core.config import settings
 
 class RealmBase(BaseModel):
     name: str
     bill_limit_enabled: bool = False
     overhead_enabled: bool = False
+    log_sample_rate: float = Field(1.0, ge=0, le=1)
+    log_error_sample_rate: float = Field(1.0, ge=0, le=1)
+    log_max_body_size: int = Field(settings.API_LOG_MAX_BODY_SIZE, ge=0)
 
 class RealmCreate(RealmBase):
     pass
@@ -15,6 +19,9 @@ class RealmUpdate(BaseModel):
     name: Optional[str] = None
     bill_limit_enabled: Optional[bool] = None
     overhead_enabled: Optional[bool] = None
+    log_sample_rate: Optional[float] = Field(None, ge=0, le=1)
+    log_error_sample_rate: Optional[float] = Field(None, ge=0, le=1)
+    log_max_body_size: Optional[int] = Field(None, ge=0)
 
 class RealmInDB(RealmBase):
     id: str
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import List, Optional
 from datetime import datetime
 from uuid import UUID
 
@@ -9,8 +9,15 @@ class UsageCreate(BaseModel):
     input_tokens: Optional[int] = None
     output_tokens: Optional[int] = None
     message: Optional[str] = None
+    output_message: Optional[str] = None
     realm_id: Optional[str] = None
     external_id: Optional[str] = None
+    # Retries with the same key return the original usage instead of tracking it again
+    idempotency_key: Optional[str] = Field(None, max_length=255)
+
+    # Set by the tokenization service once the messages have been counted
+    _tokenized: bool = PrivateAttr(default=False)
+    _tokenize_error: Optional[Exception] = PrivateAttr(default=None)
 
 class UsageResponse(BaseModel):
     model_config = {
@@ -27,4 +34,20 @@ class UsageResponse(BaseModel):
     total_model_price: float
     total_price: float
     created_at: datetime
+    idempotency_key: Optional[str] = None
+
+class UsageBatchCreate(BaseModel):
+    events: List[UsageCreate]
+
+class UsageBatchItemResponse(BaseModel):
+    index: int
+    status: str
+    usage: Optional[UsageResponse] = None
+    status_code: Optional[int] = None
+    detail: Optional[str] = None
 
+class UsageBatchResponse(BaseModel):
+    message: str
+    tracked: int
+    failed: int
+    results: List[UsageBatchItemResponse]
@@ -0,0 +1,19 @@
+from pydantic import BaseModel, ConfigDict
+from typing import Optional
+from datetime import datetime
+from uuid import UUID
+
+class UsageImportResponse(BaseModel):
+    id: UUID
+    realm_id: str
+    format: str
+    status: str
+    rows_read: int
+    rows_imported: int
+    rows_skipped: int
+    rows_rejected: int
+    error: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,28 @@
+from pydantic import BaseModel, ConfigDict, Field
+from datetime import datetime
+from typing import Literal, Optional
+from uuid import UUID
+
+QuotaMetric = Literal["tokens", "cost", "requests"]
+QuotaPeriod = Literal["minute", "hour", "day", "month"]
+
+class UsageQuotaBase(BaseModel):
+    metric: QuotaMetric
+    period: QuotaPeriod
+    amount: float = Field(..., ge=0)
+    # At most one of them: a quota without both applies to every account of the realm
+    account_id: Optional[UUID] = None
+    tier: Optional[str] = Field(None, max_length=255)
+
+class UsageQuotaCreate(UsageQuotaBase):
+    pass
+
+class UsageQuotaUpdate(BaseModel):
+    amount: Optional[float] = Field(None, ge=0)
+
+class UsageQuotaResponse(UsageQuotaBase):
+    id: UUID
+    realm_id: str
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,59 @@
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for an alert webhook: prints the alerts it receives, and can fail some
+# deliveries to exercise the retries. Point an alert rule at http://localhost:<port>/
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Receive and print budget alert notifications")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8787, help="Port to listen on")
+    parser.add_argument("--secret", help="Check the X-Fiorino-Signature header with this ALERT_WEBHOOK_SECRET")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of deliveries answered with a 503")
+    return parser.parse_args()
+
+def make_handler(args):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if args.secret:
+                expected = "sha256=" + hmac.new(args.secret.encode(), body, hashlib.sha256).hexdigest()
+                if not hmac.compare_digest(expected, self.headers.get("X-Fiorino-Signature", "")):
+                    print("rejected: bad signature", file=sys.stderr)
+                    self.send_response(401)
+                    self.end_headers()
+                    return
+            if random.random() < args.fail_rate:
+                print(f"failed on purpose: {len(body)} bytes", file=sys.stderr)
+                self.send_response(503)
+                self.end_headers()
+                return
+
+            for alert in json.loads(body)["alerts"]:
+                print(json.dumps(alert), flush=True)
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format, *log_args):
+            pass
+
+    return Handler
+
+def main():
+    args = parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args))
+    print(f"Listening on http://{args.host}:{args.port}/", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+from typing import Iterator
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure /api/v1/usage/track throughput against a running server")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the Fiorino.AI server")
+    parser.add_argument("--api-key", required=True, help="API key of the realm to track usage in")
+    parser.add_argument("--provider", default="openai", help="Provider name of a model with an active cost")
+    parser.add_argument("--model", default="gpt-4", help="Model name of a model with an active cost")
+    parser.add_argument("--requests", type=int, default=5000, help="Total number of requests")
+    parser.add_argument("--concurrency", type=int, default=50, help="Number of requests in flight")
+    parser.add_argument("--accounts", type=int, default=100, help="Number of distinct external IDs")
+    return parser.parse_args()
+
+async def worker(client: httpx.AsyncClient, args, counter: Iterator[int], latencies: list, errors: list):
+    for i in counter:
+        payload = {
+            "provider_name": args.provider,
+            "llm_model_name": args.model,
+            "input_tokens": 100,
+            "output_tokens": 200,
+            "external_id": f"benchmark_{i % args.accounts}"
+        }
+        started = time.perf_counter()
+        response = await client.post("/api/v1/usage/track", json=payload)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors.append(response.status_code)
+
+async def run(args):
+    counter = iter(range(args.requests))
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, headers={"X-API-Key": args.api_key}, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client, args, counter, latencies, errors) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Requests:     {len(latencies)} ({len(errors)} errors)")
+    print(f"Concurrency:  {args.concurrency}")
+    print(f"Elapsed:      {elapsed:.2f}s")
+    print(f"Throughput:   {len(latencies) / elapsed:.1f} req/s")
+    print(f"Latency p50:  {statistics.median(latencies) * 1000:.1f}ms")
+    print(f"Latency p95:  {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms")
+    print(f"Latency p99:  {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms")
+
+def main():
+    # Run against a single worker (uvicorn --workers 1) to get requests/second per worker
+    asyncio.run(run(parse_args()))
+
+if __name__ == "__main__":
+    main()
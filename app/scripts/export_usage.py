@@ -0,0 +1,37 @@
+import argparse
+import sys
+import time
+from datetime import date
+from uuid import UUID
+from app.services import usage_export_service
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export the raw usage rows of a realm")
+    parser.add_argument("realm_id", help="Realm to export the usage of")
+    parser.add_argument("--format", choices=list(usage_export_service.FORMATS), default="csv", help="Output format")
+    parser.add_argument("--start-date", type=date.fromisoformat, help="First day to export (YYYY-MM-DD)")
+    parser.add_argument("--end-date", type=date.fromisoformat, help="Last day to export (YYYY-MM-DD)")
+    parser.add_argument("--account-id", type=UUID, help="Only export the usage of this account")
+    parser.add_argument("--output", help="File to write, standard output when omitted")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+    written = 0
+
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in usage_export_service.export_usage(
+            args.realm_id, args.format, args.start_date, args.end_date, args.account_id
+        ):
+            output.write(chunk)
+            written += len(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+    print(f"{written} bytes exported in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
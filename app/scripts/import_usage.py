@@ -0,0 +1,53 @@
+import argparse
+import os
+import time
+from app.db.database import SessionLocal
+from app.models.usage_import import UsageImport
+from app.services import usage_import_service
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backfill historical usage of a realm from a CSV or JSONL file")
+    parser.add_argument("realm_id", nargs="?", help="Realm to import the usage into")
+    parser.add_argument("path", nargs="?", help="CSV or JSONL file with created_at, provider_name, llm_model_name, input_tokens, output_tokens and optional external_id, idempotency_key")
+    parser.add_argument("--format", choices=usage_import_service.FORMATS, help="Format of the file, detected from its extension when omitted")
+    parser.add_argument("--resume", metavar="IMPORT_ID", help="Resume an interrupted import from its last checkpoint")
+    parser.add_argument("--chunk-size", type=int, help="Rows per COPY chunk and checkpoint")
+    args = parser.parse_args()
+    if not args.resume and not (args.realm_id and args.path):
+        parser.error("realm_id and path are required unless --resume is given")
+    return args
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+
+    def report(usage_import: UsageImport):
+        elapsed = time.perf_counter() - started
+        print(
+            f"{usage_import.rows_read} rows read, {usage_import.rows_imported} imported, "
+            f"{usage_import.rows_skipped} skipped, {usage_import.rows_rejected} rejected "
+            f"({usage_import.rows_read / elapsed:.0f} rows/s)"
+        )
+
+    db = SessionLocal()
+    try:
+        if args.resume:
+            usage_import = db.get(UsageImport, args.resume)
+            if not usage_import:
+                print(f"Import {args.resume} not found")
+                return
+            print(f"Resuming import {usage_import.id} after row {usage_import.rows_read}")
+        else:
+            format = args.format or usage_import_service.detect_format(args.path)
+            usage_import = usage_import_service.create_import(db, args.realm_id, os.path.abspath(args.path), format)
+            print(f"Started import {usage_import.id}, resume it with --resume {usage_import.id}")
+
+        usage_import_service.run_import(db, usage_import, chunk_size=args.chunk_size, on_progress=report)
+        print(f"\nImport {usage_import.id} completed")
+    except Exception as e:
+        print(f"\nImport failed: {str(e)}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+import argparse
+from datetime import date
+from app.db.database import SessionLocal
+from app.services import usage_sketch_service
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Recompute the usage sketches of a realm from its usage rows")
+    parser.add_argument("realm_id", help="Realm whose sketches are recomputed")
+    parser.add_argument("start_date", type=date.fromisoformat, help="First day to recompute (YYYY-MM-DD)")
+    parser.add_argument("end_date", type=date.fromisoformat, help="Last day to recompute (YYYY-MM-DD)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    db = SessionLocal()
+    try:
+        usage_sketch_service.rebuild_sketches(db, args.realm_id, args.start_date, args.end_date)
+        print(f"Sketches of {args.realm_id} rebuilt from {args.start_date} to {args.end_date}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
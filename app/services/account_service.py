@@ -2,6 +2,10 @@ from sqlalchemy.orm import Session
 from sqlalchemy import or_
 from app.models.account import Account
 from app.schemas.account import AccountUpdate, AccountResponse
+from app.services.usage_service import invalidate_account
+from app.services.kpi_cache_service import invalidate_realm_kpis
+from app.services.budget_service import invalidate_realm_budgets
+from app.services.usage_quota_service import invalidate_realm_quotas
 from fastapi import HTTPException
 from typing import List, Optional, Tuple
 import uuid
@@ -38,6 +42,7 @@ def get_account(db: Session, account_id: uuid.UUID, realm_id: str) -> Account:
 
 def update_account(db: Session, account_id: uuid.UUID, account: AccountUpdate, realm_id: str) -> Account:
     db_account = get_account(db, account_id, realm_id)
+    previous_external_id = db_account.external_id
     
     # Update fields if provided
     if account.external_id is not None:
@@ -47,9 +52,21 @@ def update_account(db: Session, account_id: uuid.UUID, account: AccountUpdate, r
         
     db.commit()
     db.refresh(db_account)
+    if account.data is not None:
+        # The data may hold the account's bill limit and quota tier
+        invalidate_realm_budgets(realm_id)
+        invalidate_realm_quotas(realm_id)
+    if db_account.external_id != previous_external_id:
+        invalidate_account(realm_id, previous_external_id)
+        # Top users are reported by external ID
+        invalidate_realm_kpis(realm_id)
     return db_account
 
 def delete_account(db: Session, account_id: uuid.UUID, realm_id: str) -> None:
     db_account = get_account(db, account_id, realm_id)
     db.delete(db_account)
-    db.commit() 
\ No newline at end of file
+    db.commit()
+    invalidate_account(realm_id, db_account.external_id)
+    invalidate_realm_kpis(realm_id)
+    # Its own quotas were deleted with it
+    invalidate_realm_quotas(realm_id)
@@ -0,0 +1,342 @@
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from app.models.account import Account
+from app.models.alert_rule import AlertRule
+from app.schemas.alert_rule import AlertRuleCreate, AlertRuleUpdate
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core import events, metrics, pubsub
+from app.db.database import SessionLocal
+from app.services import budget_service
+from datetime import datetime, timezone
+from fastapi import HTTPException
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+import asyncio
+import hashlib
+import hmac
+import httpx
+import json
+import logging
+import threading
+import time
+import uuid
+
+# Budget alerts: a rule fires when the spend of a realm or account in the current budget period
+# (see kpi_service.get_budget_period_start) reaches an amount or a percentage of its bill limit.
+# The rules of the realms and accounts with new usage are evaluated against the spend counters of
+# budget_service, so no aggregate runs per event. A rule fires once per period: claiming it
+# in alert_rules dedups the workers, and it is re-armed only once the value drops ALERT_HYSTERESIS
+# below the threshold (a reconciliation or a raised limit). Notifications wait in an outbox per
+# webhook and are posted off the ingest path; a failing webhook backs off on its own.
+
+logger = logging.getLogger(__name__)
+
+class Rule(NamedTuple):
+    id: str
+    account_id: Optional[str]
+    threshold_type: str
+    threshold: float
+    webhook_url: str
+
+# realm_id -> List[Rule], the enabled rules of the realm
+alert_rules = TTLCache(max_size=settings.ALERT_RULES_CACHE_MAX_SIZE, ttl=settings.ALERT_RULES_CACHE_TTL)
+# rule id -> start of the budget period it fired in, while it is not re-armed
+_fired: Dict[str, datetime] = {}
+
+# Realms and accounts (None for the realm) with usage since the last evaluation
+_touched: Set[Tuple[str, Optional[str]]] = set()
+_touched_lock = threading.Lock()
+_evaluation_task: Optional[asyncio.Task] = None
+_delivery_task: Optional[asyncio.Task] = None
+
+def _touch(realm_id: str, account_id: Optional[str] = None) -> None:
+    with _touched_lock:
+        _touched.add((realm_id, account_id))
+
+def _on_usage_tracked(rows: List[dict]) -> None:
+    for row in rows:
+        realm_id = str(row["realm_id"])
+        # Realms known to have no rule are skipped
+        if alert_rules.get(realm_id) == []:
+            continue
+        _touch(realm_id)
+        if row["account_id"] is not None:
+            _touch(realm_id, str(row["account_id"]))
+
+def _on_rules_invalidation(realm_id: Optional[str]) -> None:
+    if realm_id is None:
+        alert_rules.clear()
+        _fired.clear()
+        return
+    for rule in alert_rules.get(realm_id) or []:
+        _fired.pop(rule.id, None)
+    alert_rules.delete(realm_id)
+    _touch(realm_id)
+
+def _on_budget_invalidation(realm_id: Optional[str]) -> None:
+    # A changed limit may cross a percentage without new usage
+    if realm_id is not None:
+        _touch(realm_id)
+
+events.subscribe("usage_tracked", _on_usage_tracked)
+pubsub.subscribe("alert_rules", _on_rules_invalidation)
+pubsub.subscribe("budgets", _on_budget_invalidation)
+
+def invalidate_realm_alerts(realm_id: str) -> None:
+    """Reload the alert rules of a realm in every worker"""
+    pubsub.publish("alert_rules", str(realm_id))
+
+def load_rules(db: Session, realm_id: str) -> List[Rule]:
+    rules = []
+    for rule in db.query(AlertRule).filter(AlertRule.realm_id == realm_id, AlertRule.enabled.is_(True)):
+        rules.append(Rule(
+            str(rule.id), str(rule.account_id) if rule.account_id else None,
+            rule.threshold_type, rule.threshold, rule.webhook_url
+        ))
+        if not rule.armed and rule.period_start is not None:
+            _fired[str(rule.id)] = rule.period_start
+    alert_rules.set(realm_id, rules)
+    return rules
+
+def rule_value(rule: Rule, counter: budget_service.SpendCounter) -> Optional[float]:
+    """What the threshold of a rule is compared to, None when there is no limit to take a percentage of"""
+    if rule.threshold_type == "amount":
+        return counter.spend
+    if not counter.limit:
+        return None
+    return counter.spend / counter.limit * 100
+
+def _claim(db: Session, rule: Rule, period_start: datetime) -> bool:
+    """Mark a rule fired for the period, False when another worker already did"""
+    claimed = db.execute(
+        update(AlertRule).where(
+            AlertRule.id == rule.id,
+            AlertRule.enabled.is_(True),
+            AlertRule.armed.is_(True) | AlertRule.period_start.is_distinct_from(period_start)
+        ).values(
+            armed=False, period_start=period_start, last_triggered_at=datetime.now(timezone.utc)
+        ).returning(AlertRule.id)
+    ).first()
+    db.commit()
+    return claimed is not None
+
+def _rearm(db: Session, rule: Rule) -> None:
+    db.execute(update(AlertRule).where(AlertRule.id == rule.id).values(armed=True))
+    db.commit()
+
+def _notification(db: Session, rule: Rule, realm_id: str, counter: budget_service.SpendCounter, value: float) -> dict:
+    external_id = None
+    if rule.account_id:
+        external_id = db.query(Account.external_id).filter(Account.id == rule.account_id).scalar()
+    return {
+        "webhook_url": rule.webhook_url,
+        "alert": {
+            "rule_id": rule.id,
+            "realm_id": realm_id,
+            "account_id": rule.account_id,
+            "external_id": external_id,
+            "threshold_type": rule.threshold_type,
+            "threshold": rule.threshold,
+            "value": value,
+            "spend": counter.spend,
+            "limit": counter.limit,
+            "period_start": counter.period_start.isoformat(),
+            "triggered_at": datetime.now(timezone.utc).isoformat()
+        }
+    }
+
+def evaluate_alerts(touched: Set[Tuple[str, Optional[str]]]) -> List[dict]:
+    """Evaluate the rules of the given realms and accounts, and return the notifications of those that fired"""
+    notifications = []
+    db = SessionLocal()
+    try:
+        for realm_id, account_id in sorted(touched, key=str):
+            rules = alert_rules.get(realm_id)
+            if rules is None:
+                rules = load_rules(db, realm_id)
+            rules = [rule for rule in rules if rule.account_id == account_id]
+            if not rules:
+                continue
+
+            counter = budget_service.spend_counters.get((realm_id, account_id))
+            if not budget_service.is_current(counter, sum_spend=True):
+                counter = budget_service.load_counter(db, realm_id, account_id, sum_spend=True)
+
+            for rule in rules:
+                value = rule_value(rule, counter)
+                if value is None:
+                    continue
+                fired = _fired.get(rule.id) == counter.period_start
+                if not fired and value >= rule.threshold:
+                    if _claim(db, rule, counter.period_start):
+                        notifications.append(_notification(db, rule, realm_id, counter, value))
+                        metrics.increment("alerts.fired")
+                    _fired[rule.id] = counter.period_start
+                elif fired and value < rule.threshold * (1 - settings.ALERT_HYSTERESIS):
+                    _rearm(db, rule)
+                    _fired.pop(rule.id, None)
+    finally:
+        db.close()
+    return notifications
+
+class Webhook:
+    """Notifications waiting to be posted to a webhook, and its retry state"""
+
+    def __init__(self):
+        self.notifications: List[dict] = []
+        # Failed deliveries in a row, and when the next one may be tried (monotonic clock)
+        self.failures = 0
+        self.next_attempt = 0.0
+
+# webhook_url -> Webhook, only touched from the event loop
+_outbox: Dict[str, Webhook] = {}
+metrics.register_gauge("alerts.queued", lambda: sum(len(webhook.notifications) for webhook in list(_outbox.values())))
+
+def _headers(body: bytes) -> dict:
+    headers = {"Content-Type": "application/json"}
+    if settings.ALERT_WEBHOOK_SECRET:
+        signature = hmac.new(settings.ALERT_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        headers["X-Fiorino-Signature"] = f"sha256={signature}"
+    return headers
+
+def queue_notification(notification: dict) -> None:
+    if sum(len(webhook.notifications) for webhook in _outbox.values()) >= settings.ALERT_QUEUE_SIZE:
+        logger.error("alert notification of rule %s dropped: queue full", notification["alert"]["rule_id"])
+        metrics.increment("alerts.dropped")
+        return
+    _outbox.setdefault(notification["webhook_url"], Webhook()).notifications.append(notification)
+
+async def _deliver(client: httpx.AsyncClient, webhook_url: str, webhook: Webhook) -> None:
+    notifications = webhook.notifications[:settings.ALERT_BATCH_SIZE]
+    body = json.dumps({"alerts": [notification["alert"] for notification in notifications]}).encode()
+    try:
+        (await client.post(webhook_url, content=body, headers=_headers(body))).raise_for_status()
+    except httpx.HTTPError as e:
+        webhook.failures += 1
+        metrics.increment("alerts.delivery_errors")
+        if webhook.failures >= settings.ALERT_MAX_RETRIES:
+            logger.error("alert webhook %s failed %d times: %d alerts dropped", webhook_url, webhook.failures, len(webhook.notifications))
+            metrics.increment("alerts.dropped", len(webhook.notifications))
+            webhook.notifications = []
+            webhook.failures = 0
+            webhook.next_attempt = 0.0
+        else:
+            backoff = min(settings.ALERT_RETRY_BACKOFF * 2 ** (webhook.failures - 1), settings.ALERT_RETRY_MAX_BACKOFF)
+            logger.warning("alert webhook %s failed: %s, retrying in %ss", webhook_url, e, backoff)
+            webhook.next_attempt = time.monotonic() + backoff
+        return
+
+    del webhook.notifications[:len(notifications)]
+    webhook.failures = 0
+    webhook.next_attempt = 0.0
+    metrics.increment("alerts.delivered", len(notifications))
+
+async def deliver() -> None:
+    """Post the alerts of every webhook that is not backing off, one request per webhook, concurrently"""
+    now = time.monotonic()
+    due = [(webhook_url, webhook) for webhook_url, webhook in _outbox.items() if webhook.notifications and webhook.next_attempt <= now]
+    if due:
+        async with httpx.AsyncClient(timeout=settings.ALERT_WEBHOOK_TIMEOUT) as client:
+            await asyncio.gather(*(_deliver(client, webhook_url, webhook) for webhook_url, webhook in due))
+    for webhook_url in [webhook_url for webhook_url, webhook in _outbox.items() if not webhook.notifications]:
+        del _outbox[webhook_url]
+
+async def evaluate() -> None:
+    global _touched
+    with _touched_lock:
+        touched, _touched = _touched, set()
+    if not touched:
+        return
+    try:
+        notifications = await asyncio.to_thread(evaluate_alerts, touched)
+    except Exception:
+        # Evaluated again at the next run
+        with _touched_lock:
+            _touched |= touched
+        raise
+    for notification in notifications:
+        queue_notification(notification)
+
+async def _run() -> None:
+    while True:
+        started = time.perf_counter()
+        try:
+            await evaluate()
+        except Exception:
+            logger.exception("alert evaluation failed")
+            metrics.increment("alerts.errors")
+        metrics.observe("alerts.evaluation_seconds", time.perf_counter() - started)
+        await asyncio.sleep(settings.ALERT_EVALUATION_INTERVAL)
+
+async def _run_delivery() -> None:
+    while True:
+        try:
+            await deliver()
+        except Exception:
+            logger.exception("alert delivery failed")
+            metrics.increment("alerts.errors")
+        await asyncio.sleep(settings.ALERT_FLUSH_INTERVAL)
+
+async def start() -> None:
+    global _evaluation_task, _delivery_task
+    if _evaluation_task is None:
+        _evaluation_task = asyncio.create_task(_run(), name="alerts")
+    if _delivery_task is None:
+        _delivery_task = asyncio.create_task(_run_delivery(), name="alert-delivery")
+
+async def stop() -> None:
+    global _evaluation_task, _delivery_task
+    for task in (_evaluation_task, _delivery_task):
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    _evaluation_task = _delivery_task = None
+    # Deliver what was already queued, once
+    await deliver()
+
+def _validate_account(db: Session, account_id: Optional[uuid.UUID], realm_id: str) -> None:
+    if account_id is not None and not db.query(Account.id).filter(Account.id == account_id, Account.realm_id == realm_id).first():
+        raise HTTPException(status_code=404, detail="Account not found")
+
+def create_alert_rule(db: Session, rule: AlertRuleCreate, realm_id: str) -> AlertRule:
+    _validate_account(db, rule.account_id, realm_id)
+    db_rule = AlertRule(realm_id=realm_id, **rule.model_dump())
+    db.add(db_rule)
+    db.commit()
+    db.refresh(db_rule)
+    invalidate_realm_alerts(realm_id)
+    return db_rule
+
+def get_alert_rules(db: Session, realm_id: str, account_id: Optional[uuid.UUID] = None) -> List[AlertRule]:
+    query = db.query(AlertRule).filter(AlertRule.realm_id == realm_id)
+    if account_id is not None:
+        query = query.filter(AlertRule.account_id == account_id)
+    return query.order_by(AlertRule.created_at).all()
+
+def get_alert_rule(db: Session, rule_id: uuid.UUID, realm_id: str) -> AlertRule:
+    rule = db.query(AlertRule).filter(AlertRule.id == rule_id, AlertRule.realm_id == realm_id).first()
+    if not rule:
+        raise HTTPException(status_code=404, detail="Alert rule not found")
+    return rule
+
+def update_alert_rule(db: Session, rule_id: uuid.UUID, rule: AlertRuleUpdate, realm_id: str) -> AlertRule:
+    db_rule = get_alert_rule(db, rule_id, realm_id)
+    changes = rule.model_dump(exclude_unset=True, exclude_none=True)
+    for field, value in changes.items():
+        setattr(db_rule, field, value)
+    if "threshold" in changes or "threshold_type" in changes:
+        # A new threshold may be crossed again in the current period
+        db_rule.armed = True
+    db.commit()
+    db.refresh(db_rule)
+    invalidate_realm_alerts(realm_id)
+    return db_rule
+
+def delete_alert_rule(db: Session, rule_id: uuid.UUID, realm_id: str) -> None:
+    db_rule = get_alert_rule(db, rule_id, realm_id)
+    db.delete(db_rule)
+    db.commit()
+    invalidate_realm_alerts(realm_id)
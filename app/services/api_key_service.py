@@ -1,15 +1,47 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.models.api_key import APIKey
 from app.models.realm import Realm
 from app.schemas.api_key import APIKeyCreate, APIKeyUpdate
+from app.services.kpi_cache_service import invalidate_realm_kpis
 from fastapi import HTTPException
-from typing import List, Optional, Tuple
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core import metrics, pubsub
+from typing import List, NamedTuple, Optional, Tuple
 import uuid
 import secrets
 import string
 from datetime import datetime, timezone
 import hashlib
 
+class CachedAPIKey(NamedTuple):
+    id: uuid.UUID
+    realm_id: str
+    is_disabled: bool
+
+# Marker for hashes that do not belong to any API key
+_INVALID_KEY = object()
+
+# Hashed key value -> CachedAPIKey or _INVALID_KEY
+api_key_cache = TTLCache(max_size=settings.API_KEY_CACHE_MAX_SIZE, ttl=settings.API_KEY_CACHE_TTL)
+
+metrics.register_gauge("api_key_cache.hits", lambda: api_key_cache.hits)
+metrics.register_gauge("api_key_cache.misses", lambda: api_key_cache.misses)
+
+def _on_api_key_invalidation(hashed_key: Optional[str]) -> None:
+    if hashed_key is None:
+        api_key_cache.clear()
+    else:
+        api_key_cache.delete(hashed_key)
+
+pubsub.subscribe("api_keys", _on_api_key_invalidation)
+
+def invalidate_api_key(hashed_key: str) -> None:
+    """Drop a key from the validation cache of every worker"""
+    pubsub.publish("api_keys", hashed_key)
+
 def generate_api_key() -> Tuple[str, str]:
     plain_key = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(48))
     hashed_key = hashlib.sha256(plain_key.encode()).hexdigest()
@@ -32,6 +64,8 @@ def create_api_key(db: Session, api_key: APIKeyCreate, user_id: str, realm_id: s
     db.add(db_api_key)
     db.commit()
     db.refresh(db_api_key)
+    # The hash may have been cached as invalid
+    invalidate_api_key(hashed_key)
     return db_api_key, plain_key
 
 def get_user_api_keys(db: Session, user_id: str, realm_id: str) -> List[APIKey]:
@@ -63,13 +97,54 @@ def update_api_key(db: Session, api_key_id: str, api_key: APIKeyUpdate, user_id:
         db_api_key.disabled_at = datetime.now(timezone.utc) if api_key.is_disabled else None
     db.commit()
     db.refresh(db_api_key)
+    invalidate_api_key(db_api_key.value)
+    # Top API keys are reported by name
+    invalidate_realm_kpis(realm_id)
     return db_api_key
 
 def delete_api_key(db: Session, api_key_id: str, user_id: str, realm_id: str) -> None:
     db_api_key = get_api_key(db, api_key_id, user_id, realm_id)
     db.delete(db_api_key)
     db.commit()
+    invalidate_api_key(db_api_key.value)
+    invalidate_realm_kpis(realm_id)
+
+def _resolve_cached_api_key(hashed_key: str, api_key: Optional[APIKey]) -> Optional[CachedAPIKey]:
+    """Cache the result of a database lookup and return the key if it is enabled"""
+    if api_key:
+        cached = CachedAPIKey(id=api_key.id, realm_id=api_key.realm_id, is_disabled=api_key.is_disabled)
+        api_key_cache.set(hashed_key, cached)
+    else:
+        cached = _INVALID_KEY
+        api_key_cache.set(hashed_key, cached, ttl=settings.API_KEY_NEGATIVE_CACHE_TTL)
+    return _enabled_api_key(cached)
 
-def validate_api_key(db: Session, plain_api_key: str) -> Optional[APIKey]:
+def _enabled_api_key(cached) -> Optional[CachedAPIKey]:
+    if cached is _INVALID_KEY or cached.is_disabled:
+        return None
+    return cached
+
+def validate_api_key(db: Session, plain_api_key: str) -> Optional[CachedAPIKey]:
+    """
+    Return the enabled API key matching a plain key, or None.
+    Both valid and unknown keys are cached; unknown ones for a shorter time.
+    """
     hashed_key = hashlib.sha256(plain_api_key.encode()).hexdigest()
-    return db.query(APIKey).filter(APIKey.value == hashed_key, APIKey.is_disabled == False).first()
+
+    cached = api_key_cache.get(hashed_key)
+    if cached is not None:
+        return _enabled_api_key(cached)
+
+    api_key = db.query(APIKey).filter(APIKey.value == hashed_key).first()
+    return _resolve_cached_api_key(hashed_key, api_key)
+
+async def validate_api_key_async(db: AsyncSession, plain_api_key: str) -> Optional[CachedAPIKey]:
+    """Same as validate_api_key, on an AsyncSession"""
+    hashed_key = hashlib.sha256(plain_api_key.encode()).hexdigest()
+
+    cached = api_key_cache.get(hashed_key)
+    if cached is not None:
+        return _enabled_api_key(cached)
+
+    result = await db.execute(select(APIKey).where(APIKey.value == hashed_key))
+    return _resolve_cached_api_key(hashed_key, result.scalars().first())
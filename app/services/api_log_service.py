@@ -1,40 +1,127 @@
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.models.api_log import APILog
-from fastapi import Request, Response, HTTPException
-from typing import List, Optional, Tuple
-from datetime import datetime
+from app.models.realm import Realm
+from app.core.batch_writer import BatchWriter, QueueFullError
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core import metrics, pubsub
+from app.db.database import SessionLocal
+from fastapi import Request, HTTPException
+from typing import Any, List, NamedTuple, Optional, Tuple
+from datetime import datetime, timezone
 import json
+import random
+
+class RealmLogConfig(NamedTuple):
+    sample_rate: float
+    error_sample_rate: float
+    max_body_size: int
+
+# realm_id -> RealmLogConfig
+log_config_cache = TTLCache(max_size=settings.API_LOG_CONFIG_CACHE_MAX_SIZE, ttl=settings.API_LOG_CONFIG_CACHE_TTL)
+
+def _on_log_config_invalidation(realm_id: Optional[str]) -> None:
+    if realm_id is None:
+        log_config_cache.clear()
+    else:
+        log_config_cache.delete(realm_id)
+
+pubsub.subscribe("realm_log_config", _on_log_config_invalidation)
+
+def invalidate_realm_log_config(realm_id: str) -> None:
+    """Drop the cached log settings of a realm in every worker"""
+    pubsub.publish("realm_log_config", realm_id)
+
+async def get_realm_log_config(db: AsyncSession, realm_id: str) -> RealmLogConfig:
+    config = log_config_cache.get(realm_id)
+    if config is None:
+        result = await db.execute(
+            select(Realm.log_sample_rate, Realm.log_error_sample_rate, Realm.log_max_body_size)
+            .where(Realm.id == realm_id)
+        )
+        row = result.first()
+        config = RealmLogConfig(*row) if row else RealmLogConfig(1.0, 1.0, settings.API_LOG_MAX_BODY_SIZE)
+        log_config_cache.set(realm_id, config)
+    return config
+
+def _limit_body(body: Optional[Any], max_size: int) -> Optional[Any]:
+    """Replace bodies larger than max_size bytes (once serialized) with a placeholder"""
+    if body is None:
+        return None
+    size = len(json.dumps(body, default=str))
+    if size > max_size:
+        return {"truncated": True, "size": size}
+    return body
+
+def flush_api_logs(logs: List[dict]) -> None:
+    """Write a batch of buffered API logs in one transaction"""
+    db = SessionLocal()
+    try:
+        db.execute(insert(APILog), logs)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+api_log_writer = BatchWriter(
+    name="api_logs",
+    flush_func=flush_api_logs,
+    max_queue_size=settings.API_LOG_QUEUE_SIZE,
+    batch_size=settings.API_LOG_BATCH_SIZE,
+    flush_interval=settings.API_LOG_FLUSH_INTERVAL
+)
 
 async def log_api_request(
-    db: Session,
+    db: AsyncSession,
     request: Request,
-    response: Response,
     realm_id: str,
     status_code: int,
-    response_body: dict
-) -> APILog:
-    # Get request body
-    try:
-        body_bytes = await request.body()
-        request_body = json.loads(body_bytes) if body_bytes else None
-    except:
-        request_body = None
-
-    # Create log entry
-    log = APILog(
-        realm_id=realm_id,
-        path=str(request.url.path),
-        method=request.method,
-        status_code=status_code,
-        origin=request.headers.get('origin'),
-        request_body=request_body,
-        response_body=response_body
-    )
-
-    db.add(log)
-    db.commit()
-    db.refresh(log)
-    return log 
+    response_body: dict,
+    request_body: Optional[Any] = None
+) -> None:
+    """
+    Log an API request according to the sampling settings of its realm.
+    Pass the already parsed request body to avoid reading and parsing it again.
+    Logs are written in batches by a background writer; without one they are inserted directly.
+    """
+    config = await get_realm_log_config(db, realm_id)
+    sample_rate = config.sample_rate if status_code < 400 else config.error_sample_rate
+    if sample_rate < 1 and random.random() >= sample_rate:
+        metrics.increment("api_logs.sampled_out")
+        return
+
+    if request_body is None:
+        try:
+            body_bytes = await request.body()
+            request_body = json.loads(body_bytes) if body_bytes else None
+        except:
+            request_body = None
+
+    log = {
+        "realm_id": realm_id,
+        "path": str(request.url.path),
+        "method": request.method,
+        "status_code": status_code,
+        "origin": request.headers.get('origin'),
+        "request_body": _limit_body(request_body, config.max_body_size),
+        "response_body": _limit_body(response_body, config.max_body_size),
+        "created_at": datetime.now(timezone.utc)
+    }
+
+    if api_log_writer.running:
+        try:
+            api_log_writer.put_nowait(log)
+        except QueueFullError:
+            # Never fail a request because its log could not be buffered
+            metrics.increment("api_logs.dropped")
+        return
+
+    db.add(APILog(**log))
+    await db.commit()
 
 def get_api_logs(
     db: Session,
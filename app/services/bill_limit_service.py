@@ -7,6 +7,8 @@ from app.schemas.bill_limit import (
     BillLimitWithHistoryResponse,
     BillLimitHistoryEntry
 )
+from app.services.kpi_cache_service import invalidate_realm_kpis
+from app.services.budget_service import invalidate_realm_budgets
 from fastapi import HTTPException
 from typing import Optional
 from datetime import datetime, timezone, timedelta
@@ -58,6 +60,8 @@ def create_bill_limit(db: Session, bill_limit: BillLimitCreate, realm_id: str) -
         db.add(db_bill_limit)
         db.commit()
         db.refresh(db_bill_limit)
+        invalidate_realm_kpis(realm_id)
+        invalidate_realm_budgets(realm_id)
         
         return db_bill_limit
 
@@ -157,6 +161,8 @@ def update_bill_limit(db: Session, bill_limit_id: uuid.UUID, bill_limit: BillLim
             db.add(existing_bill_limit)
             db.commit()
             db.refresh(existing_bill_limit)
+            invalidate_realm_kpis(realm_id)
+            invalidate_realm_budgets(realm_id)
             return existing_bill_limit
         
         # If valid_from dates differ, create a new record
@@ -181,6 +187,8 @@ def update_bill_limit(db: Session, bill_limit_id: uuid.UUID, bill_limit: BillLim
             db.add(new_bill_limit)
             db.commit()
             db.refresh(new_bill_limit)
+            invalidate_realm_kpis(realm_id)
+            invalidate_realm_budgets(realm_id)
             return new_bill_limit
 
     except Exception as e:
@@ -218,6 +226,8 @@ def delete_bill_limit(db: Session, bill_limit_id: uuid.UUID, realm_id: str, reop
         # Delete the current limit
         db.delete(bill_limit)
         db.commit()
+        invalidate_realm_kpis(realm_id)
+        invalidate_realm_budgets(realm_id)
         return True
     except Exception as e:
         db.rollback()
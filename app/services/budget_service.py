@@ -0,0 +1,215 @@
+from sqlalchemy.orm import Session
+from app.models.realm import Realm
+from app.models.account import Account
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.periodic import PeriodicTask
+from app.core import events, metrics, pubsub
+from app.db.database import SessionLocal
+from app.services import kpi_service
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import json
+import threading
+
+# Spend of the current budget period (see kpi_service.get_budget_period_start) per realm, and per
+# account for accounts with their own limit, held in memory so tracking can answer whether a realm
+# is over budget without an aggregate query. Counters are loaded from the usage on first use,
+# moved by the usage_tracked event of every worker (shared over pubsub each
+# BILL_LIMIT_PUBLISH_INTERVAL) and reconciled with the usage every BILL_LIMIT_RECONCILE_INTERVAL.
+
+class SpendCounter:
+    def __init__(self, period_start: datetime, spend: float, limit: Optional[float], summed: bool = True):
+        self.period_start = period_start
+        self.spend = spend
+        self.limit = limit
+        # Whether the spend was loaded from the usage, it is only needed with a limit or an alert rule
+        self.summed = summed
+        # Moved since the last reconciliation
+        self.dirty = False
+
+    def status(self) -> dict:
+        if self.limit is None:
+            state = "unlimited"
+        elif self.spend >= self.limit:
+            state = "over_limit"
+        elif self.spend >= self.limit * settings.BILL_LIMIT_SOFT_THRESHOLD:
+            state = "soft_limit"
+        else:
+            state = "ok"
+        return {
+            "status": state,
+            "spend": self.spend,
+            "limit": self.limit,
+            "remaining": max(self.limit - self.spend, 0.0) if self.limit is not None else None
+        }
+
+# Worst first
+STATUSES = ("over_limit", "soft_limit", "ok", "unlimited")
+
+# (realm_id, account_id or None) -> SpendCounter
+spend_counters = TTLCache(max_size=settings.BILL_LIMIT_MAX_COUNTERS, ttl=settings.BILL_LIMIT_COUNTER_TTL)
+_counters_lock = threading.Lock()
+
+# Spend tracked by this worker and not yet announced to the others
+_unpublished: Dict[Tuple[str, Optional[str]], float] = {}
+
+def _add_spend(key: Tuple[str, Optional[str]], amount: float) -> None:
+    counter = spend_counters.get(key)
+    if counter is not None:
+        counter.spend += amount
+        counter.dirty = True
+
+def _on_usage_tracked(rows: List[dict]) -> None:
+    with _counters_lock:
+        for row in rows:
+            amount = float(row["total_model_price"] or 0)
+            realm_key = (str(row["realm_id"]), None)
+            keys = [realm_key]
+            if row["account_id"] is not None:
+                keys.append((realm_key[0], str(row["account_id"])))
+            for key in keys:
+                _add_spend(key, amount)
+                if settings.PUBSUB_ENABLED:
+                    _unpublished[key] = _unpublished.get(key, 0.0) + amount
+
+def _on_remote_spend(payload: Optional[str]) -> None:
+    if payload is None:
+        # Spend may have been missed: reload everything
+        spend_counters.clear()
+        return
+    with _counters_lock:
+        for realm_id, account_id, amount in json.loads(payload):
+            _add_spend((realm_id, account_id), amount)
+
+def _on_budget_invalidation(realm_id: Optional[str]) -> None:
+    if realm_id is None:
+        spend_counters.clear()
+    else:
+        spend_counters.delete_where(lambda key: key[0] == realm_id)
+
+def invalidate_realm_budgets(realm_id: str) -> None:
+    """Reload the limits and spend of a realm and its accounts in every worker"""
+    pubsub.publish("budgets", str(realm_id))
+
+def _on_usage_imported(realm_id: str) -> None:
+    # Imported usage may fall in the current period: reload the spend from the usage
+    invalidate_realm_budgets(realm_id)
+
+events.subscribe("usage_tracked", _on_usage_tracked)
+events.subscribe("usage_imported", _on_usage_imported)
+pubsub.subscribe("spend", _on_remote_spend)
+pubsub.subscribe("budgets", _on_budget_invalidation)
+
+def _account_limit(data: Optional[dict]) -> Optional[float]:
+    # Accounts get their own monthly limit with {"bill_limit": <amount>} in their data
+    if not isinstance(data, dict):
+        return None
+    try:
+        return float(data["bill_limit"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _load_limit(db: Session, realm_id: str, account_id: Optional[str], current_time: datetime) -> Optional[float]:
+    if not db.query(Realm.bill_limit_enabled).filter(Realm.id == realm_id).scalar():
+        return None
+    if account_id is None:
+        return kpi_service.get_current_bill_limit(db, realm_id, current_time)
+    return _account_limit(
+        db.query(Account.data).filter(Account.id == account_id, Account.realm_id == realm_id).scalar()
+    )
+
+def load_counter(db: Session, realm_id: str, account_id: Optional[str] = None, sum_spend: bool = False) -> SpendCounter:
+    """
+    Load a counter from the database, the spend is only summed when there is a limit
+    to compare it to or sum_spend is set
+    """
+    current_time = datetime.now(timezone.utc)
+    limit = _load_limit(db, realm_id, account_id, current_time)
+    summed = limit is not None or sum_spend
+    spend = kpi_service.get_period_spend(db, realm_id, current_time, account_id) if summed else 0.0
+    counter = SpendCounter(kpi_service.get_budget_period_start(current_time), spend, limit, summed)
+    spend_counters.set((realm_id, account_id), counter)
+    metrics.increment("budgets.loads")
+    return counter
+
+def _load_counter(realm_id: str, account_id: Optional[str]) -> SpendCounter:
+    db = SessionLocal()
+    try:
+        return load_counter(db, realm_id, account_id)
+    finally:
+        db.close()
+
+def is_current(counter: Optional[SpendCounter], sum_spend: bool = False) -> bool:
+    """Whether a cached counter can be used as is"""
+    return (
+        counter is not None
+        and counter.period_start == kpi_service.get_budget_period_start(datetime.now(timezone.utc))
+        and (counter.summed or not sum_spend)
+    )
+
+async def get_counter(realm_id: str, account_id: Optional[str] = None) -> SpendCounter:
+    counter = spend_counters.get((realm_id, account_id))
+    if not is_current(counter):
+        counter = await asyncio.to_thread(_load_counter, realm_id, account_id)
+    return counter
+
+async def get_budget_status(realm_id: str, account_id=None) -> dict:
+    """
+    Budget status of a realm, and of the account when it has its own limit: ok, soft_limit
+    (past BILL_LIMIT_SOFT_THRESHOLD of the limit), over_limit or unlimited. The overall status
+    is the worst of the two. Answered from memory once the counters are loaded.
+    """
+    realm = (await get_counter(str(realm_id))).status()
+    account = (await get_counter(str(realm_id), str(account_id))).status() if account_id else None
+    statuses = [realm["status"]] + ([account["status"]] if account else [])
+    return {
+        "status": min(statuses, key=STATUSES.index),
+        "realm": realm,
+        "account": account
+    }
+
+def _publish_spend() -> None:
+    with _counters_lock:
+        unpublished = [[realm_id, account_id, amount] for (realm_id, account_id), amount in _unpublished.items()]
+        _unpublished.clear()
+    if unpublished and not pubsub.publish_list("spend", unpublished, local=False):
+        # Some spend did not reach the other workers: they reload their counters
+        pubsub.publish("spend", None, local=False)
+
+def reconcile_counters() -> None:
+    """Replace the spend of the counters moved since the last run with the one of the usage table"""
+    for key in spend_counters.keys():
+        counter = spend_counters.get(key)
+        if counter is None or not counter.dirty or not counter.summed:
+            continue
+        with _counters_lock:
+            tracked_before = counter.spend
+            counter.dirty = False
+
+        db = SessionLocal()
+        try:
+            current_time = datetime.now(timezone.utc)
+            if counter.period_start != kpi_service.get_budget_period_start(current_time):
+                spend_counters.delete(key)
+                continue
+            spend = kpi_service.get_period_spend(db, key[0], current_time, key[1])
+        finally:
+            db.close()
+
+        with _counters_lock:
+            # Keep what was tracked while the usage was summed
+            counter.spend = spend + (counter.spend - tracked_before)
+        metrics.increment("budgets.reconciliations")
+
+publish_task = PeriodicTask(name="budget_spend", func=_publish_spend, interval=settings.BILL_LIMIT_PUBLISH_INTERVAL)
+reconcile_task = PeriodicTask(name="budget_reconcile", func=reconcile_counters, interval=settings.BILL_LIMIT_RECONCILE_INTERVAL)
+
+async def start() -> None:
+    await publish_task.start()
+    await reconcile_task.start()
+
+async def stop() -> None:
+    await publish_task.stop()
+    await reconcile_task.stop()
@@ -0,0 +1,150 @@
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.periodic import PeriodicTask
+from app.core import events, metrics, pubsub
+from fastapi.encoders import jsonable_encoder
+from datetime import date, datetime, timezone
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import threading
+
+class CachedKPI(NamedTuple):
+    body: bytes
+    etag: str
+    last_modified: datetime
+    # Ingest watermark of the realm when the payload was computed, None for closed ranges
+    watermark: Optional[int]
+
+# (realm_id, endpoint, start_date, end_date, account_id) -> CachedKPI
+kpi_cache = TTLCache(max_size=settings.KPI_CACHE_MAX_SIZE, ttl=settings.KPI_CACHE_TTL)
+
+# Per-realm counters bumped whenever new usage of the realm is tracked, by any worker.
+# Cached payloads of ranges including today are only served while their watermark is current.
+_watermarks: Dict[str, int] = {}
+_pending_realms: set = set()
+_watermark_lock = threading.Lock()
+
+# Computations in progress, shared by the identical requests arriving meanwhile
+_inflight: Dict[tuple, asyncio.Future] = {}
+
+def get_watermark(realm_id: str) -> int:
+    with _watermark_lock:
+        return _watermarks.get(realm_id, 0)
+
+def _bump_watermarks(realm_ids, pending: bool) -> None:
+    with _watermark_lock:
+        for realm_id in realm_ids:
+            _watermarks[realm_id] = _watermarks.get(realm_id, 0) + 1
+        if pending:
+            _pending_realms.update(realm_ids)
+
+def _on_usage_tracked(rows: List[dict]) -> None:
+    _bump_watermarks({str(row["realm_id"]) for row in rows}, pending=True)
+
+def _on_usage_ingested(payload: Optional[str]) -> None:
+    if payload is None:
+        # Announcements may have been missed: nothing cached can be trusted
+        kpi_cache.clear()
+        return
+    _bump_watermarks(json.loads(payload), pending=False)
+
+events.subscribe("usage_tracked", _on_usage_tracked)
+pubsub.subscribe("usage_ingested", _on_usage_ingested)
+
+def _publish_watermarks() -> None:
+    """Announce the realms with new usage to the other workers, at most once per interval"""
+    with _watermark_lock:
+        realm_ids = sorted(_pending_realms)
+        _pending_realms.clear()
+    if realm_ids:
+        pubsub.publish("usage_ingested", json.dumps(realm_ids), local=False)
+
+watermark_task = PeriodicTask(
+    name="kpi_watermarks",
+    func=_publish_watermarks,
+    interval=settings.KPI_WATERMARK_PUBLISH_INTERVAL
+)
+
+async def start() -> None:
+    await watermark_task.start()
+
+async def stop() -> None:
+    await watermark_task.stop()
+    _publish_watermarks()
+
+def _on_kpi_invalidation(realm_id: Optional[str]) -> None:
+    if realm_id is None:
+        kpi_cache.clear()
+    else:
+        kpi_cache.delete_where(lambda key: key[0] == realm_id)
+
+pubsub.subscribe("kpi", _on_kpi_invalidation)
+
+def invalidate_realm_kpis(realm_id: str) -> None:
+    """Drop every cached KPI of a realm in every worker, after a change of past data (deletes, imports, names, budgets)"""
+    pubsub.publish("kpi", str(realm_id))
+
+events.subscribe("usage_imported", invalidate_realm_kpis)
+
+def _is_open(end_date: date) -> bool:
+    # Sessions are pinned to UTC, so KPI days are UTC days: only a range including today can still change
+    return end_date >= datetime.now(timezone.utc).date()
+
+def _is_valid(cached: Optional[CachedKPI], watermark: Optional[int]) -> bool:
+    return cached is not None and cached.watermark == watermark
+
+async def _compute(
+    key: tuple,
+    watermark: Optional[int],
+    compute: Callable[[], Awaitable[Tuple[dict, Optional[datetime]]]]
+) -> CachedKPI:
+    # Read before computing: usage tracked during the computation makes the entry stale right away
+    payload, expires_at = await compute()
+    body = json.dumps(jsonable_encoder(payload), separators=(",", ":")).encode()
+    cached = CachedKPI(
+        body=body,
+        etag=f'"{hashlib.sha1(body).hexdigest()}"',
+        last_modified=datetime.now(timezone.utc).replace(microsecond=0),
+        watermark=watermark
+    )
+
+    ttl = settings.KPI_CACHE_OPEN_TTL if watermark is not None else settings.KPI_CACHE_TTL
+    if expires_at is not None:
+        ttl = min(ttl, (expires_at - datetime.now(timezone.utc)).total_seconds())
+    kpi_cache.set(key, cached, ttl=ttl)
+    return cached
+
+async def get_cached_kpi(
+    realm_id: str,
+    endpoint: str,
+    start_date: date,
+    end_date: date,
+    account_id,
+    compute: Callable[[], Awaitable[Tuple[dict, Optional[datetime]]]]
+) -> CachedKPI:
+    """
+    Serialized KPI payload of a range, computed by `compute` (returning the payload and the time
+    it stops being valid, if any) only when no valid entry is cached and no identical computation
+    is already running.
+    """
+    key = (str(realm_id), endpoint, start_date, end_date, str(account_id) if account_id else None)
+    watermark = get_watermark(key[0]) if _is_open(end_date) else None
+
+    cached = kpi_cache.get(key)
+    if _is_valid(cached, watermark):
+        metrics.increment("kpi_cache.hits")
+        return cached
+    metrics.increment("kpi_cache.misses")
+
+    inflight_key = key + (watermark,)
+    future = _inflight.get(inflight_key)
+    if future is None:
+        future = asyncio.ensure_future(_compute(key, watermark, compute))
+        _inflight[inflight_key] = future
+        future.add_done_callback(lambda _: _inflight.pop(inflight_key, None))
+    else:
+        metrics.increment("kpi_cache.coalesced")
+    # Shielded: a client going away must not cancel the computation the others are waiting for
+    return await asyncio.shield(future)
@@ -1,315 +1,289 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from datetime import date, datetime, timezone
+from sqlalchemy import Date, DateTime, cast, func, literal
+import asyncio
+from datetime import date, datetime, time, timedelta, timezone
 from app.models.usage import Usage
 from app.models.llm_cost import LLMCost
 from app.models.api_key import APIKey
 from app.models.account import Account
 from app.models.large_language_model import LargeLanguageModel
 from app.models.bill_limit import BillLimit
-from typing import Optional, List, Dict
+from app.models.usage_daily_rollup import UsageDailyRollup
+from app.services import usage_rollup_service, usage_sketch_service
+from app.db.database import AsyncSessionLocal
+from app.core.config import settings
+from typing import Optional, List, Dict, Tuple
 from uuid import UUID
 
 def apply_filters(query, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None):
+    # Half-open range on the raw column so the (realm_id, created_at) indexes can be used.
+    # The bounds are bound as dates: they are compared in the session time zone (UTC), like date(created_at) is.
     query = query.filter(
         Usage.realm_id == realm_id,
-        func.date(Usage.created_at) >= start_date,
-        func.date(Usage.created_at) <= end_date
+        Usage.created_at >= literal(start_date, Date),
+        Usage.created_at < literal(end_date + timedelta(days=1), Date)
     )
     if account_id:
         query = query.filter(Usage.account_id == account_id)
     return query
 
-def get_daily_costs(db: Session, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None) -> List[Dict]:
-    query = db.query(
-        func.date(Usage.created_at).label('date'),
-        LargeLanguageModel.provider_name,
-        LargeLanguageModel.model_name,
-        func.sum(Usage.total_price).label('total_cost')
+def usage_source(db: Session, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None):
+    """
+    Usage of a realm aggregated per (day, llm, account, api key), as a subquery.
+    Reads the daily rollup up to its high-water mark plus the raw usage rows written since,
+    so the rows scanned depend on the number of days rather than on the number of events.
+    """
+    high_water_mark = usage_rollup_service.get_high_water_mark(db)
+
+    recent = db.query(
+        func.date(Usage.created_at).label('day'),
+        LLMCost.llm_id.label('llm_id'),
+        Usage.account_id.label('account_id'),
+        Usage.api_key_id.label('api_key_id'),
+        func.count(Usage.id).label('events'),
+        func.sum(Usage.input_tokens).label('input_tokens'),
+        func.sum(Usage.output_tokens).label('output_tokens'),
+        func.sum(Usage.total_tokens).label('total_tokens'),
+        func.sum(Usage.total_model_price).label('total_model_price'),
+        func.sum(Usage.total_price).label('total_price')
     ).join(
         LLMCost, Usage.llm_cost_id == LLMCost.id
-    ).join(
-        LargeLanguageModel, LLMCost.llm_id == LargeLanguageModel.id
     )
-    
-    query = apply_filters(query, realm_id, start_date, end_date, account_id)
-    
-    query = query.group_by(
+    recent = apply_filters(recent, realm_id, start_date, end_date, account_id).filter(
+        Usage.id > high_water_mark
+    ).group_by(
         func.date(Usage.created_at),
-        LargeLanguageModel.provider_name,
-        LargeLanguageModel.model_name
-    ).order_by(func.date(Usage.created_at))
-    
-    results = query.all()
-    
-    return [
-        {
-            'date': result.date,
-            'provider_name': result.provider_name,
-            'model_name': result.model_name,
-            'total_cost': float(result.total_cost)
-        }
-        for result in results
-    ]
+        LLMCost.llm_id,
+        Usage.account_id,
+        Usage.api_key_id
+    )
 
-def get_total_cost(db: Session, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None) -> float:
-    query = db.query(func.sum(Usage.total_model_price).label('total_cost'))
-    query = apply_filters(query, realm_id, start_date, end_date, account_id)
-    result = query.scalar()
-    return float(result) if result else 0.0
+    if not high_water_mark:
+        return recent.subquery()
 
-def get_total_usage_fees(db: Session, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None) -> float:
-    query = db.query(
-        (func.sum(Usage.total_price) - func.sum(Usage.total_model_price)).label('total_usage_fees')
+    rolled_up = db.query(
+        UsageDailyRollup.day.label('day'),
+        UsageDailyRollup.llm_id.label('llm_id'),
+        UsageDailyRollup.account_id.label('account_id'),
+        UsageDailyRollup.api_key_id.label('api_key_id'),
+        UsageDailyRollup.events.label('events'),
+        UsageDailyRollup.input_tokens.label('input_tokens'),
+        UsageDailyRollup.output_tokens.label('output_tokens'),
+        UsageDailyRollup.total_tokens.label('total_tokens'),
+        UsageDailyRollup.total_model_price.label('total_model_price'),
+        UsageDailyRollup.total_price.label('total_price')
+    ).filter(
+        UsageDailyRollup.realm_id == realm_id,
+        UsageDailyRollup.day >= start_date,
+        UsageDailyRollup.day <= end_date
     )
-    query = apply_filters(query, realm_id, start_date, end_date, account_id)
-    result = query.scalar()
-    return float(result) if result else 0.0
+    if account_id:
+        rolled_up = rolled_up.filter(UsageDailyRollup.account_id == account_id)
 
-def get_most_used_models(db: Session, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None) -> List[Dict]:
-    query = db.query(
+    return rolled_up.union_all(recent).subquery()
+
+def get_model_day_costs(db: Session, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None) -> List:
+    """
+    Cost and tokens of every (day, model) of the range, in a single scan.
+    Every figure of the cost KPI is derived from these rows.
+    """
+    source = usage_source(db, realm_id, start_date, end_date, account_id)
+    return db.query(
+        source.c.day.label('date'),
         LargeLanguageModel.provider_name,
         LargeLanguageModel.model_name,
-        func.sum(Usage.total_tokens).label('total_tokens'),
-        func.sum(Usage.total_model_price).label('total_model_price')
+        func.sum(source.c.total_tokens).label('total_tokens'),
+        func.sum(source.c.total_model_price).label('total_model_price'),
+        func.sum(source.c.total_price).label('total_price')
     ).join(
-        LLMCost, Usage.llm_cost_id == LLMCost.id
-    ).join(
-        LargeLanguageModel, LLMCost.llm_id == LargeLanguageModel.id
-    )
-    
-    query = apply_filters(query, realm_id, start_date, end_date, account_id)
-    
-    query = query.group_by(
+        LargeLanguageModel, source.c.llm_id == LargeLanguageModel.id
+    ).group_by(
+        source.c.day,
         LargeLanguageModel.provider_name,
         LargeLanguageModel.model_name
-    ).order_by(func.sum(Usage.total_tokens).desc())
-    
-    results = query.all()
-    
+    ).order_by(
+        source.c.day,
+        LargeLanguageModel.provider_name,
+        LargeLanguageModel.model_name
+    ).all()
+
+def _daily_costs(rows: List) -> List[Dict]:
     return [
         {
-            'provider_name': result.provider_name,
-            'model_name': result.model_name,
-            'total_tokens': int(result.total_tokens),
-            'total_model_price': float(result.total_model_price)
+            'date': row.date,
+            'provider_name': row.provider_name,
+            'model_name': row.model_name,
+            'total_cost': float(row.total_price)
         }
-        for result in results
+        for row in rows
     ]
 
-def get_model_costs(db: Session, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None) -> List[Dict]:
-    query = db.query(
-        LargeLanguageModel.provider_name,
-        LargeLanguageModel.model_name,
-        func.date(Usage.created_at).label('date'),
-        func.sum(Usage.total_model_price).label('daily_cost')
-    ).join(
-        LLMCost, Usage.llm_cost_id == LLMCost.id
-    ).join(
-        LargeLanguageModel, LLMCost.llm_id == LargeLanguageModel.id
-    )
-    
-    query = apply_filters(query, realm_id, start_date, end_date, account_id)
-    
-    query = query.group_by(
-        LargeLanguageModel.provider_name,
-        LargeLanguageModel.model_name,
-        func.date(Usage.created_at)
-    ).order_by(
-        LargeLanguageModel.provider_name,
-        LargeLanguageModel.model_name,
-        func.date(Usage.created_at)
-    )
-    
-    results = query.all()
-    
-    model_costs = {}
-    for result in results:
-        model_key = f"{result.provider_name}:{result.model_name}"
-        if model_key not in model_costs:
-            model_costs[model_key] = {
-                'provider_name': result.provider_name,
-                'model_name': result.model_name,
-                'daily_costs': []
-            }
-        model_costs[model_key]['daily_costs'].append({
-            'date': result.date,
-            'cost': float(result.daily_cost)
+def _models(rows: List) -> Dict[tuple, Dict]:
+    """Group the (day, model) rows per model, sorted by provider and model name"""
+    models = {}
+    for row in sorted(rows, key=lambda row: (row.provider_name, row.model_name, row.date)):
+        model = models.setdefault((row.provider_name, row.model_name), {
+            'provider_name': row.provider_name,
+            'model_name': row.model_name,
+            'total_tokens': 0,
+            'total_model_price': 0.0,
+            'daily_costs': []
         })
-    
-    return list(model_costs.values())
-
-def get_daily_tokens(db: Session, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None):
-    query = db.query(
-        func.date(Usage.created_at).label('date'),
-        func.sum(Usage.input_tokens).label('total_input_tokens'),
-        func.sum(Usage.output_tokens).label('total_output_tokens')
-    )
-
-    query = apply_filters(query, realm_id, start_date, end_date, account_id)
-    
-    query = query.group_by(func.date(Usage.created_at)).order_by(func.date(Usage.created_at))
+        model['total_tokens'] += int(row.total_tokens)
+        model['total_model_price'] += float(row.total_model_price)
+        model['daily_costs'].append({
+            'date': row.date,
+            'cost': float(row.total_model_price)
+        })
+    return models
 
-    results = query.all()
+def _most_used_models(models: Dict[tuple, Dict]) -> List[Dict]:
+    return [
+        {
+            'provider_name': model['provider_name'],
+            'model_name': model['model_name'],
+            'total_tokens': model['total_tokens'],
+            'total_model_price': model['total_model_price']
+        }
+        for model in sorted(models.values(), key=lambda model: model['total_tokens'], reverse=True)
+    ]
 
+def _model_costs(models: Dict[tuple, Dict]) -> List[Dict]:
     return [
         {
-            "date": str(result.date),
-            "total_input_tokens": result.total_input_tokens,
-            "total_output_tokens": result.total_output_tokens
+            'provider_name': model['provider_name'],
+            'model_name': model['model_name'],
+            'daily_costs': model['daily_costs']
         }
-        for result in results
+        for model in models.values()
     ]
 
-def get_model_daily_tokens(db: Session, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None):
-    query = db.query(
-        func.date(Usage.created_at).label('date'),
+def get_model_day_tokens(db: Session, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None) -> List:
+    """Input and output tokens of every (day, model name) of the range, the daily totals are derived from them"""
+    source = usage_source(db, realm_id, start_date, end_date, account_id)
+    return db.query(
+        source.c.day.label('date'),
         LargeLanguageModel.model_name,
-        func.sum(Usage.input_tokens).label('total_input_tokens'),
-        func.sum(Usage.output_tokens).label('total_output_tokens')
+        func.sum(source.c.input_tokens).label('total_input_tokens'),
+        func.sum(source.c.output_tokens).label('total_output_tokens')
     ).join(
-        LLMCost, Usage.llm_cost_id == LLMCost.id
-    ).join(
-        LargeLanguageModel, LLMCost.llm_id == LargeLanguageModel.id
-    )
-    
-    query = apply_filters(query, realm_id, start_date, end_date, account_id)
-    
-    query = query.group_by(func.date(Usage.created_at), LargeLanguageModel.model_name).order_by(LargeLanguageModel.model_name, func.date(Usage.created_at))
+        LargeLanguageModel, source.c.llm_id == LargeLanguageModel.id
+    ).group_by(
+        source.c.day,
+        LargeLanguageModel.model_name
+    ).order_by(
+        LargeLanguageModel.model_name,
+        source.c.day
+    ).all()
 
-    results = query.all()
+def _daily_tokens(rows: List) -> List[Dict]:
+    days = {}
+    for row in rows:
+        day = days.setdefault(row.date, {
+            "date": str(row.date),
+            "total_input_tokens": 0,
+            "total_output_tokens": 0
+        })
+        day["total_input_tokens"] += int(row.total_input_tokens)
+        day["total_output_tokens"] += int(row.total_output_tokens)
+    return [days[day] for day in sorted(days)]
 
+def _model_daily_tokens(rows: List) -> List[Dict]:
     model_data = {}
-    for result in results:
-        if result.model_name not in model_data:
-            model_data[result.model_name] = {
-                "model_name": result.model_name,
+    for row in rows:
+        if row.model_name not in model_data:
+            model_data[row.model_name] = {
+                "model_name": row.model_name,
                 "data": []
             }
         
-        model_data[result.model_name]["data"].append({
-            "date": str(result.date),
-            "total_input_tokens": result.total_input_tokens,
-            "total_output_tokens": result.total_output_tokens
+        model_data[row.model_name]["data"].append({
+            "date": str(row.date),
+            "total_input_tokens": int(row.total_input_tokens),
+            "total_output_tokens": int(row.total_output_tokens)
         })
 
     return list(model_data.values())
 
-def get_top_users(db: Session, realm_id: str, start_date: date, end_date: date, limit: int = 10):
-    # Get the total number of events for the given period and realm
-    total_events = db.query(func.count(Usage.id)).filter(
-        Usage.realm_id == realm_id,
-        func.date(Usage.created_at) >= start_date,
-        func.date(Usage.created_at) <= end_date,
-        Usage.account_id.isnot(None)  # Only count events with account_id
-    ).scalar()
-
-    # Get the top accounts with their activity counts for the specific realm
-    results = db.query(
-        Usage.account_id,
-        Account.external_id.label('account_name'),
-        func.count(Usage.id).label('total_activity_records')
-    ).join(
-        Account, Usage.account_id == Account.id
-    ).filter(
-        Usage.realm_id == realm_id,
-        func.date(Usage.created_at) >= start_date,
-        func.date(Usage.created_at) <= end_date,
-        Usage.account_id.isnot(None)
+def _top_activity(db: Session, source, key_column, name_column, limit: int) -> List:
+    """
+    Top `limit` groups by number of events, each row carrying the number of events of all
+    the groups (a window over the grouped rows, computed before the LIMIT)
+    """
+    events = func.sum(source.c.events)
+    return db.query(
+        key_column.label('key'),
+        name_column.label('name'),
+        events.label('total_activity_records'),
+        func.sum(events).over().label('total_events')
+    ).select_from(source).join(
+        name_column.class_, key_column == name_column.class_.id
     ).group_by(
-        Usage.account_id,
-        Account.external_id
+        key_column,
+        name_column
     ).order_by(
-        func.count(Usage.id).desc()
+        events.desc()
     ).limit(limit).all()
 
+def get_top_users(db: Session, realm_id: str, start_date: date, end_date: date, limit: int = 10):
+    # Only events of existing accounts: the rollup keeps the ids of deleted ones
+    source = usage_source(db, realm_id, start_date, end_date)
+    results = _top_activity(db, source, source.c.account_id, Account.external_id, limit)
+    total_events = int(results[0].total_events) if results else 0
+
     return {
         "total_events": total_events,
         "users": [
             {
-                "account_id": str(result.account_id),
-                "account_name": result.account_name,
-                "total_activity_records": result.total_activity_records,
-                "percentage": (result.total_activity_records / total_events) * 100 if total_events > 0 else 0
+                "account_id": str(result.key),
+                "account_name": result.name,
+                "total_activity_records": int(result.total_activity_records),
+                "percentage": float(result.total_activity_records / result.total_events) * 100 if total_events > 0 else 0
             }
             for result in results
         ]
     }
 
 def get_top_api_keys(db: Session, realm_id: str, start_date: date, end_date: date, limit: int = 10):
-    # Get the total number of events for the given period and realm
-    total_events = db.query(func.count(Usage.id)).filter(
-        Usage.realm_id == realm_id,
-        func.date(Usage.created_at) >= start_date,
-        func.date(Usage.created_at) <= end_date,
-        Usage.api_key_id.isnot(None)  # Only count events with api_key_id
-    ).scalar()
-
-    # Get the top API keys with their activity counts for the specific realm
-    results = db.query(
-        Usage.api_key_id,
-        APIKey.name.label('api_key_name'),
-        func.count(Usage.id).label('total_activity_records')
-    ).join(
-        APIKey, Usage.api_key_id == APIKey.id
-    ).filter(
-        Usage.realm_id == realm_id,
-        func.date(Usage.created_at) >= start_date,
-        func.date(Usage.created_at) <= end_date,
-        Usage.api_key_id.isnot(None)
-    ).group_by(
-        Usage.api_key_id,
-        APIKey.name
-    ).order_by(
-        func.count(Usage.id).desc()
-    ).limit(limit).all()
+    # Only events of existing API keys: the rollup keeps the ids of deleted ones
+    source = usage_source(db, realm_id, start_date, end_date)
+    results = _top_activity(db, source, source.c.api_key_id, APIKey.name, limit)
+    total_events = int(results[0].total_events) if results else 0
 
     return {
         "total_events": total_events,
         "api_keys": [
             {
-                "api_key_name": result.api_key_name,
-                "total_activity_records": result.total_activity_records,
-                "percentage": (result.total_activity_records / total_events) * 100 if total_events > 0 else 0
+                "api_key_name": result.name,
+                "total_activity_records": int(result.total_activity_records),
+                "percentage": float(result.total_activity_records / result.total_events) * 100 if total_events > 0 else 0
             }
             for result in results
         ]
     }
 
-def get_used_llms(db: Session, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None) -> Dict:
-    query = db.query(
-        LargeLanguageModel.provider_name,
-        LargeLanguageModel.model_name
-    ).join(
-        LLMCost, LLMCost.llm_id == LargeLanguageModel.id
-    ).join(
-        Usage, Usage.llm_cost_id == LLMCost.id
-    ).filter(
-        Usage.realm_id == realm_id,
-        func.date(Usage.created_at) >= start_date,
-        func.date(Usage.created_at) <= end_date
-    )
+async def _run_query(query_func, *args):
+    # Each query gets its own session, so its own pooled connection
+    async with AsyncSessionLocal() as session:
+        return await session.run_sync(query_func, *args)
 
-    if account_id:
-        query = query.filter(Usage.account_id == account_id)
-
-    query = query.group_by(
-        LargeLanguageModel.provider_name,
-        LargeLanguageModel.model_name
-    ).order_by(
-        LargeLanguageModel.provider_name,
-        LargeLanguageModel.model_name
+async def get_kpi_activity(realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None) -> dict:
+    """
+    Get activity KPIs. The three independent queries run concurrently,
+    so the latency is the one of the slowest query.
+    """
+    model_day_tokens, top_users, top_api_keys = await asyncio.gather(
+        _run_query(get_model_day_tokens, realm_id, start_date, end_date, account_id),
+        _run_query(get_top_users, realm_id, start_date, end_date),
+        _run_query(get_top_api_keys, realm_id, start_date, end_date)
     )
 
-    results = query.all()
-
-    return [
-        {
-            "provider_name": result.provider_name,
-            "model_name": result.model_name
-        }
-        for result in results
-    ]
+    return {
+        "daily_tokens": _daily_tokens(model_day_tokens),
+        "model_daily_tokens": _model_daily_tokens(model_day_tokens),
+        "top_users": top_users,
+        "top_api_keys": top_api_keys
+    }
 
 def get_current_bill_limit(db: Session, realm_id: str, current_time: datetime) -> Optional[float]:
     """Get the current bill limit amount for a realm"""
@@ -326,14 +300,32 @@ def get_current_bill_limit(db: Session, realm_id: str, current_time: datetime) -
     
     return current_limit.amount if current_limit else None
 
+def get_budget_period_start(current_time: datetime) -> datetime:
+    """Bill limits are monthly budgets: the spend compared to them starts on the first day of the month (UTC)"""
+    return current_time.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def get_period_spend(db: Session, realm_id: str, current_time: datetime, account_id: Optional[UUID] = None) -> float:
+    """Cost of the current budget period, as the total cost of get_kpi_cost"""
+    source = usage_source(db, realm_id, get_budget_period_start(current_time).date(), current_time.date(), account_id)
+    return float(db.query(func.coalesce(func.sum(source.c.total_model_price), 0)).scalar())
+
+def get_next_bill_limit_change(db: Session, realm_id: str, current_time: datetime) -> Optional[datetime]:
+    """When the current bill limit ends or the next one starts, whichever comes first"""
+    valid_to, valid_from = db.query(
+        func.min(BillLimit.valid_to).filter(BillLimit.valid_to > current_time),
+        func.min(BillLimit.valid_from).filter(BillLimit.valid_from > current_time)
+    ).filter(
+        BillLimit.realm_id == realm_id
+    ).one()
+    return min((change for change in (valid_to, valid_from) if change), default=None)
+
 def get_kpi_cost(db: Session, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None) -> dict:
     """Get cost KPIs including budget information"""
-    daily_costs = get_daily_costs(db, realm_id, start_date, end_date, account_id)
-    total_cost = get_total_cost(db, realm_id, start_date, end_date, account_id)
-    total_usage_fees = get_total_usage_fees(db, realm_id, start_date, end_date, account_id)
-    most_used_models = get_most_used_models(db, realm_id, start_date, end_date, account_id)
-    model_costs = get_model_costs(db, realm_id, start_date, end_date, account_id)
-    llms = get_used_llms(db, realm_id, start_date, end_date, account_id)
+    rows = get_model_day_costs(db, realm_id, start_date, end_date, account_id)
+    models = _models(rows)
+
+    total_cost = sum(float(row.total_model_price) for row in rows)
+    total_usage_fees = sum(float(row.total_price) for row in rows) - total_cost
     
     # Get current bill limit
     current_time = datetime.now(timezone.utc)
@@ -347,14 +339,355 @@ def get_kpi_cost(db: Session, realm_id: str, start_date: date, end_date: date, a
     )
 
     return {
-        "daily_costs": daily_costs,
+        "daily_costs": _daily_costs(rows),
         "total_cost": total_cost,
         "total_usage_fees": total_usage_fees,
-        "most_used_models": most_used_models,
-        "model_costs": model_costs,
-        "llms": llms,
+        "most_used_models": _most_used_models(models),
+        "model_costs": _model_costs(models),
+        "llms": [
+            {"provider_name": model["provider_name"], "model_name": model["model_name"]}
+            for model in models.values()
+        ],
         "budget": {
             "current_budget": current_budget,
             "budget_usage_percentage": round(budget_usage_percentage, 2)
         }
     }
+
+def _get_kpi_cost_with_expiry(db: Session, realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None) -> Tuple[dict, Optional[datetime]]:
+    current_time = datetime.now(timezone.utc)
+    return (
+        get_kpi_cost(db, realm_id, start_date, end_date, account_id),
+        get_next_bill_limit_change(db, realm_id, current_time)
+    )
+
+async def get_kpi_cost_with_expiry(realm_id: str, start_date: date, end_date: date, account_id: Optional[UUID] = None) -> Tuple[dict, Optional[datetime]]:
+    """Cost KPIs and the time their budget figures stop being valid, for the KPI cache"""
+    return await _run_query(_get_kpi_cost_with_expiry, realm_id, start_date, end_date, account_id)
+
+GRANULARITIES = ("hour", "day", "week", "month")
+TIMESERIES_METRICS = ("cost", "tokens", "events")
+
+def _bucket_count(start_date: date, end_date: date, granularity: str) -> int:
+    days = (end_date - start_date).days + 1
+    if granularity == "hour":
+        return days * 24
+    if granularity == "day":
+        return days
+    if granularity == "week":
+        return ((end_date - timedelta(days=end_date.weekday())) - (start_date - timedelta(days=start_date.weekday()))).days // 7 + 1
+    return (end_date.year - start_date.year) * 12 + end_date.month - start_date.month + 1
+
+def pick_granularity(start_date: date, end_date: date, max_points: int) -> str:
+    """The finest granularity whose number of buckets fits the point budget, month otherwise"""
+    for granularity in GRANULARITIES:
+        if _bucket_count(start_date, end_date, granularity) <= max_points:
+            return granularity
+    return "month"
+
+def _buckets(start_date: date, end_date: date, granularity: str) -> List:
+    """Start of every bucket of the range: naive datetimes for hours, dates otherwise"""
+    if granularity == "hour":
+        first = datetime.combine(start_date, time())
+        return [first + timedelta(hours=hour) for hour in range(_bucket_count(start_date, end_date, "hour"))]
+    if granularity == "day":
+        return [start_date + timedelta(days=day) for day in range(_bucket_count(start_date, end_date, "day"))]
+    if granularity == "week":
+        first = start_date - timedelta(days=start_date.weekday())
+        return [first + timedelta(weeks=week) for week in range(_bucket_count(start_date, end_date, "week"))]
+    buckets = []
+    for month in range(_bucket_count(start_date, end_date, "month")):
+        year, month = divmod(start_date.month - 1 + month, 12)
+        buckets.append(date(start_date.year + year, month + 1, 1))
+    return buckets
+
+def get_model_bucket_values(
+    db: Session,
+    realm_id: str,
+    start_date: date,
+    end_date: date,
+    granularity: str,
+    metric: str,
+    account_id: Optional[UUID] = None
+) -> List:
+    """
+    Value of the metric per (bucket, model). Hourly buckets are read from the usage rows,
+    coarser ones from the daily rollup (see usage_source).
+    """
+    if granularity == "hour":
+        # Truncated in the session time zone, like the days of the rollup
+        bucket = cast(func.date_trunc("hour", Usage.created_at), DateTime)
+        value = {
+            "cost": func.sum(Usage.total_price),
+            "tokens": func.sum(Usage.total_tokens),
+            "events": func.count(Usage.id)
+        }[metric]
+        query = db.query(
+            bucket.label("bucket"),
+            LargeLanguageModel.provider_name,
+            LargeLanguageModel.model_name,
+            value.label("value")
+        ).join(
+            LLMCost, Usage.llm_cost_id == LLMCost.id
+        ).join(
+            LargeLanguageModel, LLMCost.llm_id == LargeLanguageModel.id
+        )
+        query = apply_filters(query, realm_id, start_date, end_date, account_id)
+    else:
+        source = usage_source(db, realm_id, start_date, end_date, account_id)
+        if granularity == "day":
+            bucket = source.c.day
+        else:
+            bucket = cast(func.date_trunc(granularity, cast(source.c.day, DateTime)), Date)
+        value = {
+            "cost": source.c.total_price,
+            "tokens": source.c.total_tokens,
+            "events": source.c.events
+        }[metric]
+        query = db.query(
+            bucket.label("bucket"),
+            LargeLanguageModel.provider_name,
+            LargeLanguageModel.model_name,
+            func.sum(value).label("value")
+        ).join(
+            LargeLanguageModel, source.c.llm_id == LargeLanguageModel.id
+        )
+
+    return query.group_by(
+        bucket,
+        LargeLanguageModel.provider_name,
+        LargeLanguageModel.model_name
+    ).all()
+
+def lttb(values: List[float], threshold: int) -> List[int]:
+    """
+    Indexes of the points kept by Largest-Triangle-Three-Buckets downsampling of an evenly
+    spaced series: the first and last points plus, in each of threshold - 2 buckets, the point
+    forming the largest triangle with the previously kept point and the next bucket's average.
+    """
+    count = len(values)
+    if threshold >= count:
+        return list(range(count))
+    if threshold < 3:
+        # No bucket between the first and last points: keep the last one first
+        return [0, count - 1][2 - max(threshold, 0):]
+
+    kept = [0]
+    every = (count - 2) / (threshold - 2)
+    previous = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_start, next_end = end, min(int((bucket + 2) * every) + 1, count)
+        average_x = (next_start + next_end - 1) / 2
+        average_y = sum(values[next_start:next_end]) / (next_end - next_start)
+
+        best, best_area = start, -1.0
+        for index in range(start, end):
+            area = abs(
+                (previous - average_x) * (values[index] - values[previous])
+                - (previous - index) * (average_y - values[previous])
+            )
+            if area > best_area:
+                best, best_area = index, area
+        kept.append(best)
+        previous = best
+    kept.append(count - 1)
+    return kept
+
+def _points(buckets: List, values: Dict, indexes: List[int]) -> List[Dict]:
+    return [
+        {"timestamp": buckets[index].isoformat(), "value": values.get(buckets[index], 0)}
+        for index in indexes
+    ]
+
+def get_kpi_timeseries(
+    db: Session,
+    realm_id: str,
+    start_date: date,
+    end_date: date,
+    metric: str = "cost",
+    granularity: Optional[str] = None,
+    max_points: Optional[int] = None,
+    account_id: Optional[UUID] = None
+) -> dict:
+    """
+    Time series of a metric, in total and per model, with at most max_points points per series.
+    The granularity is the finest one fitting the budget unless given; empty buckets are filled
+    with zeros and series still longer than the budget are downsampled with LTTB.
+    """
+    max_points = max_points or settings.KPI_TIMESERIES_MAX_POINTS
+    granularity = granularity or pick_granularity(start_date, end_date, max_points)
+    buckets = _buckets(start_date, end_date, granularity)
+    cast_value = float if metric == "cost" else int
+
+    totals: Dict = {}
+    models: Dict[tuple, Dict] = {}
+    for row in get_model_bucket_values(db, realm_id, start_date, end_date, granularity, metric, account_id):
+        value = cast_value(row.value)
+        totals[row.bucket] = totals.get(row.bucket, 0) + value
+        model = models.setdefault((row.provider_name, row.model_name), {})
+        model[row.bucket] = value
+
+    # The points kept are picked on the total series, so every series shares the same timestamps
+    indexes = lttb([totals.get(bucket, 0) for bucket in buckets], max_points)
+
+    return {
+        "granularity": granularity,
+        "metric": metric,
+        "downsampled": len(indexes) < len(buckets),
+        "total": _points(buckets, totals, indexes),
+        "series": [
+            {
+                "provider_name": provider_name,
+                "model_name": model_name,
+                "points": _points(buckets, values, indexes)
+            }
+            for (provider_name, model_name), values in sorted(models.items())
+        ]
+    }
+
+async def get_kpi_timeseries_async(*args) -> Tuple[dict, None]:
+    """get_kpi_timeseries on its own connection, for the KPI cache"""
+    return await _run_query(get_kpi_timeseries, *args), None
+
+def get_kpi_top(
+    db: Session,
+    realm_id: str,
+    dimension: str,
+    measure: str,
+    start_date: date,
+    end_date: date,
+    limit: int = 10
+) -> dict:
+    """
+    Approximate top accounts or API keys by events, tokens or cost, merged from the daily
+    heavy-hitter sketches. Every value is a lower bound of the exact one, which is at most
+    `upper_bound`; keys outside the list weigh at most `max_error`.
+    """
+    sketch = usage_sketch_service.get_merged_sketch(db, realm_id, f"top_{dimension}:{measure}", start_date, end_date)
+    top = sketch.top(limit) if sketch else []
+
+    model = Account if dimension == "accounts" else APIKey
+    name_column = Account.external_id if dimension == "accounts" else APIKey.name
+    names = dict(
+        db.query(model.id, name_column).filter(model.id.in_([key for key, _, _ in top])).all()
+    ) if top else {}
+
+    total = sketch.total if sketch else 0.0
+    return {
+        "dimension": dimension,
+        "measure": measure,
+        "total": total,
+        "max_error": sketch.missing if sketch else 0.0,
+        "items": [
+            {
+                "id": str(key),
+                "name": names.get(key),
+                "value": value,
+                "upper_bound": upper_bound,
+                "error": upper_bound - value,
+                "percentage": value / total * 100 if total > 0 else 0
+            }
+            for key, value, upper_bound in top
+        ]
+    }
+
+def _period_start(day: date, period: str) -> date:
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+def get_kpi_active_accounts(db: Session, realm_id: str, start_date: date, end_date: date, period: str = "day") -> dict:
+    """
+    Approximate distinct accounts with usage over the range, per day, week or month (DAU/WAU/MAU)
+    and per model, merged from the daily HyperLogLog sketches without reading usage.
+    """
+    merged = None
+    periods: Dict[date, object] = {}
+    for day, _, sketch in usage_sketch_service.get_sketches(db, realm_id, "active_accounts", start_date, end_date):
+        merged = sketch if merged is None else merged.merge(sketch)
+        start = _period_start(day, period)
+        periods[start] = sketch if start not in periods else periods[start].merge(sketch)
+
+    llms: Dict[UUID, object] = {}
+    for _, llm_id, sketch in usage_sketch_service.get_sketches(db, realm_id, "active_accounts:llm", start_date, end_date):
+        llms[llm_id] = sketch if llm_id not in llms else llms[llm_id].merge(sketch)
+    names = {
+        llm.id: llm for llm in db.query(LargeLanguageModel).filter(LargeLanguageModel.id.in_(list(llms)))
+    } if llms else {}
+
+    return {
+        "period": period,
+        "active_accounts": merged.count() if merged else 0,
+        "relative_error": merged.relative_error if merged else 0.0,
+        "periods": [
+            {
+                "date": bucket,
+                "active_accounts": periods[bucket].count() if bucket in periods else 0
+            }
+            for bucket in _buckets(start_date, end_date, period)
+        ],
+        "models": sorted(
+            (
+                {
+                    "provider_name": names[llm_id].provider_name,
+                    "model_name": names[llm_id].model_name,
+                    "active_accounts": sketch.count()
+                }
+                for llm_id, sketch in llms.items() if llm_id in names
+            ),
+            key=lambda model: model["active_accounts"],
+            reverse=True
+        )
+    }
+
+def get_kpi_distribution(
+    db: Session,
+    realm_id: str,
+    metric: str,
+    start_date: date,
+    end_date: date,
+    percentiles: List[float],
+    buckets: int = 20,
+    provider_name: Optional[str] = None,
+    model_name: Optional[str] = None
+) -> dict:
+    """
+    Per-request distribution of input tokens, output tokens or cost over the range, for one
+    model or all of them, merged from the daily DDSketches without reading usage.
+    """
+    llm_ids = None
+    if provider_name or model_name:
+        models = db.query(LargeLanguageModel.id).filter(LargeLanguageModel.realm_id == realm_id)
+        if provider_name:
+            models = models.filter(LargeLanguageModel.provider_name == provider_name)
+        if model_name:
+            models = models.filter(LargeLanguageModel.model_name == model_name)
+        llm_ids = [llm_id for (llm_id,) in models]
+
+    sketch = None
+    if llm_ids is None or llm_ids:
+        sketch = usage_sketch_service.get_merged_sketch(
+            db, realm_id, f"distribution:{metric}:llm", start_date, end_date, llm_ids
+        )
+    count = sketch.count if sketch else 0
+
+    return {
+        "metric": metric,
+        "count": count,
+        "mean": sketch.sum / count if count else None,
+        "min": sketch.min if count else None,
+        "max": sketch.max if count else None,
+        "relative_accuracy": sketch.relative_accuracy if sketch else None,
+        "percentiles": [
+            {"percentile": percentile, "value": sketch.quantile(percentile / 100) if sketch else None}
+            for percentile in percentiles
+        ],
+        "histogram": [
+            {"lower": lower, "upper": upper, "count": bucket_count}
+            for lower, upper, bucket_count in (sketch.histogram(buckets) if sketch else [])
+        ]
+    }
@@ -0,0 +1,245 @@
+from app.models.llm_cost import LLMCost
+from app.models.large_language_model import LargeLanguageModel
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core import events, metrics, pubsub
+from app.db.database import SessionLocal
+from app.services import kpi_service
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID
+import asyncio
+import json
+import logging
+import threading
+import time
+
+# Live usage of the realms with subscribers (the SSE stream of /usage/live).
+# Tracked usage is summed per (realm, llm cost) as it is committed; once per tick the sums are
+# turned into one delta per realm and merged into the pending delta of each of its subscribers,
+# so a tick costs the same whatever the number of subscribers and slow clients get coalesced
+# deltas instead of a growing backlog. Workers announce the realms they have subscribers for,
+# and share the sums of those realms only over pubsub.
+
+logger = logging.getLogger(__name__)
+
+# Sum of (events, tokens, cost, price) per realm and llm cost, since the last tick
+_local_sums: Dict[str, Dict[str, List[float]]] = {}
+_remote_sums: Dict[str, Dict[str, List[float]]] = {}
+_sums_lock = threading.Lock()
+
+# realm_id -> True, the realms with subscribers on other workers, announced again every LIVE_USAGE_REFRESH_INTERVAL
+watched_realms = TTLCache(max_size=settings.LIVE_USAGE_MAX_REALMS, ttl=3 * settings.LIVE_USAGE_REFRESH_INTERVAL)
+
+# llm_cost_id -> (provider_name, model_name), a cost never changes of model
+_model_names: Dict[str, Tuple[str, str]] = {}
+
+class Subscriber:
+    """A client of the stream: deltas pushed while it is not reading are merged together"""
+
+    def __init__(self):
+        self.models: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self.budget: Optional[dict] = None
+        self.wakeup = asyncio.Event()
+
+    def push(self, models: Dict[Tuple[str, str], List[float]], budget: dict) -> None:
+        for model, (events_count, tokens, cost, price) in models.items():
+            delta = self.models.setdefault(model, {"events": 0, "tokens": 0, "cost": 0.0, "price": 0.0})
+            delta["events"] += int(events_count)
+            delta["tokens"] += int(tokens)
+            delta["cost"] += cost
+            delta["price"] += price
+        self.budget = budget
+        self.wakeup.set()
+
+    async def next_delta(self, timeout: float) -> Optional[dict]:
+        """The deltas pushed since the last call, None when nothing was pushed within timeout"""
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.wakeup.clear()
+        models, self.models = self.models, {}
+        return {
+            "models": [
+                {"provider_name": provider_name, "model_name": model_name, **delta}
+                for (provider_name, model_name), delta in sorted(models.items())
+            ],
+            "budget": self.budget
+        }
+
+class RealmHub:
+    def __init__(self):
+        self.subscribers: Set[Subscriber] = set()
+        # Cost of the current budget period, loaded from the database and then moved by the deltas
+        self.spend = 0.0
+        self.current_budget: Optional[float] = None
+        self.loaded_at = 0.0
+        self.period_start: Optional[datetime] = None
+
+    def budget(self) -> dict:
+        return {
+            "period_start": self.period_start.isoformat() if self.period_start else None,
+            "spend": self.spend,
+            "current_budget": self.current_budget,
+            "budget_usage_percentage": round(self.spend / self.current_budget * 100, 2) if self.current_budget else 0
+        }
+
+_hubs: Dict[str, RealmHub] = {}
+metrics.register_gauge("live_usage.subscribers", lambda: sum(len(hub.subscribers) for hub in list(_hubs.values())))
+_tick_task: Optional[asyncio.Task] = None
+
+def _add(sums: Dict[str, Dict[str, List[float]]], realm_id: str, llm_cost_id: str, values: List[float]) -> None:
+    total = sums.setdefault(realm_id, {}).setdefault(llm_cost_id, [0, 0, 0.0, 0.0])
+    for index, value in enumerate(values):
+        total[index] += value
+
+def _on_usage_tracked(rows: List[dict]) -> None:
+    with _sums_lock:
+        for row in rows:
+            realm_id = str(row["realm_id"])
+            if realm_id not in _hubs and not watched_realms.get(realm_id):
+                continue
+            _add(_local_sums, realm_id, str(row["llm_cost_id"]), [
+                1, row["total_tokens"] or 0, float(row["total_model_price"] or 0), float(row["total_price"] or 0)
+            ])
+
+def _on_remote_sums(payload: Optional[str]) -> None:
+    if payload is None:
+        return
+    with _sums_lock:
+        for realm_id, costs in json.loads(payload):
+            if realm_id in _hubs:
+                for llm_cost_id, values in costs.items():
+                    _add(_remote_sums, realm_id, llm_cost_id, values)
+
+def _on_remote_watch(payload: Optional[str]) -> None:
+    # Realms are announced again within LIVE_USAGE_REFRESH_INTERVAL: nothing to do after a lost connection
+    if payload is not None:
+        for realm_id in json.loads(payload):
+            watched_realms.set(realm_id, True)
+
+events.subscribe("usage_tracked", _on_usage_tracked)
+pubsub.subscribe("live_usage", _on_remote_sums)
+pubsub.subscribe("live_realms", _on_remote_watch)
+
+def _announce(realm_ids: List[str]) -> None:
+    if settings.PUBSUB_ENABLED and realm_ids:
+        pubsub.publish_list("live_realms", realm_ids, local=False)
+
+def _load_model_names(llm_cost_ids: List[str]) -> None:
+    db = SessionLocal()
+    try:
+        rows = db.query(LLMCost.id, LargeLanguageModel.provider_name, LargeLanguageModel.model_name).join(
+            LargeLanguageModel, LLMCost.llm_id == LargeLanguageModel.id
+        ).filter(LLMCost.id.in_([UUID(llm_cost_id) for llm_cost_id in llm_cost_ids])).all()
+        for llm_cost_id, provider_name, model_name in rows:
+            _model_names[str(llm_cost_id)] = (provider_name, model_name)
+    finally:
+        db.close()
+
+def _load_budget(realm_id: str, hub: RealmHub) -> None:
+    """(Re)load the spend of the current period and the current bill limit from the database"""
+    db = SessionLocal()
+    try:
+        current_time = datetime.now(timezone.utc)
+        hub.period_start = kpi_service.get_budget_period_start(current_time)
+        hub.spend = kpi_service.get_period_spend(db, realm_id, current_time)
+        hub.current_budget = kpi_service.get_current_bill_limit(db, realm_id, current_time)
+        hub.loaded_at = time.monotonic()
+    finally:
+        db.close()
+
+async def subscribe(realm_id: str) -> Tuple[Subscriber, dict]:
+    """Register a subscriber of the realm's live usage and return it with the current budget"""
+    hub = _hubs.get(realm_id)
+    if hub is None:
+        hub = _hubs[realm_id] = RealmHub()
+        await asyncio.to_thread(_load_budget, realm_id, hub)
+        await asyncio.to_thread(_announce, [realm_id])
+    subscriber = Subscriber()
+    hub.subscribers.add(subscriber)
+    metrics.increment("live_usage.subscriptions")
+    return subscriber, hub.budget()
+
+def unsubscribe(realm_id: str, subscriber: Subscriber) -> None:
+    hub = _hubs.get(realm_id)
+    if hub is None:
+        return
+    hub.subscribers.discard(subscriber)
+    if not hub.subscribers:
+        del _hubs[realm_id]
+
+async def tick() -> None:
+    """Turn the sums of the last interval into one delta per realm and push it to its subscribers"""
+    global _local_sums, _remote_sums
+    with _sums_lock:
+        local_sums, _local_sums = _local_sums, {}
+        remote_sums, _remote_sums = _remote_sums, {}
+
+    # Only the realms watched by other workers; lost sums are corrected by the next budget reload
+    shared = [[realm_id, costs] for realm_id, costs in local_sums.items() if watched_realms.get(realm_id)]
+    if shared and settings.PUBSUB_ENABLED:
+        await asyncio.to_thread(pubsub.publish_list, "live_usage", shared, False)
+
+    unknown = {
+        llm_cost_id
+        for sums in (local_sums, remote_sums)
+        for realm_id, costs in sums.items() if realm_id in _hubs
+        for llm_cost_id in costs if llm_cost_id not in _model_names
+    }
+    if unknown:
+        await asyncio.to_thread(_load_model_names, list(unknown))
+
+    reloaded = []
+    for realm_id, hub in list(_hubs.items()):
+        if time.monotonic() - hub.loaded_at > settings.LIVE_USAGE_REFRESH_INTERVAL:
+            # Corrects the drift of the deltas, and follows bill limit and period changes
+            await asyncio.to_thread(_load_budget, realm_id, hub)
+            reloaded.append(realm_id)
+
+        models: Dict[Tuple[str, str], List[float]] = {}
+        for sums in (local_sums, remote_sums):
+            for llm_cost_id, values in sums.get(realm_id, {}).items():
+                model = _model_names.get(llm_cost_id)
+                if model:
+                    total = models.setdefault(model, [0, 0, 0.0, 0.0])
+                    for index, value in enumerate(values):
+                        total[index] += value
+        if not models:
+            continue
+
+        hub.spend += sum(values[2] for values in models.values())
+        budget = hub.budget()
+        for subscriber in hub.subscribers:
+            subscriber.push(models, budget)
+
+    if reloaded:
+        await asyncio.to_thread(_announce, reloaded)
+
+async def _run() -> None:
+    while True:
+        started = time.perf_counter()
+        try:
+            await tick()
+        except Exception:
+            logger.exception("live usage tick failed")
+            metrics.increment("live_usage.errors")
+        metrics.observe("live_usage.tick_seconds", time.perf_counter() - started)
+        await asyncio.sleep(settings.LIVE_USAGE_TICK_INTERVAL)
+
+async def start() -> None:
+    global _tick_task
+    if _tick_task is None:
+        _tick_task = asyncio.create_task(_run(), name="live_usage")
+
+async def stop() -> None:
+    global _tick_task
+    if _tick_task is None:
+        return
+    _tick_task.cancel()
+    try:
+        await _tick_task
+    except asyncio.CancelledError:
+        pass
+    _tick_task = None
@@ -1,23 +1,50 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import outerjoin
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import func, outerjoin, select
 from app.models.llm_cost import LLMCost
+from app.models.usage import Usage
 from app.models.large_language_model import LargeLanguageModel
-from app.schemas.llm_cost import LLMCostCreate, LLMCostUpdate
+from app.schemas.llm_cost import LLMCostCreate, LLMCostUpdate, LLMWithCurrentCostResponse
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core import pubsub
+from app.services.pricing_service import invalidate_realm_pricing
+from app.services import usage_rollup_service, usage_sketch_service
+from app.services.kpi_cache_service import invalidate_realm_kpis
+from app.services.budget_service import invalidate_realm_budgets
 from datetime import datetime, timezone, timedelta
 from fastapi import HTTPException
-from typing import List
+from fastapi.encoders import jsonable_encoder
+from typing import Dict, List, NamedTuple, Optional, Tuple
 from uuid import UUID
+import hashlib
+import json
 
 
-def get_realm_llm_costs(db: Session, realm_id: str) -> List[dict]:
+def _cost_fields(cost: LLMCost) -> dict:
+    return {
+        "price_per_unit": cost.price_per_unit,
+        "unit_type": cost.unit_type,
+        "overhead": cost.overhead,
+        "valid_from": cost.valid_from,
+        "valid_to": cost.valid_to
+    }
+
+def get_realm_llm_costs(
+    db: Session,
+    realm_id: str,
+    page: Optional[int] = None,
+    limit: Optional[int] = None,
+    history_limit: Optional[int] = None
+) -> Tuple[List[dict], int]:
     """
-    Get all LLMs for a realm with their current costs and cost history.
-    Returns a list of LLMs with their associated cost information and history.
+    Get the LLMs of a realm (one page of them when limit is given) with their current costs
+    and cost history, most recent first and at most history_limit entries per LLM.
+    Returns the LLMs and the total number of LLMs of the realm.
     """
     current_time = datetime.now(timezone.utc)
     
     # Query LLMs and their current costs (if they exist)
-    results = (
+    query = (
         db.query(
             LargeLanguageModel,
             LLMCost
@@ -33,23 +60,31 @@ def get_realm_llm_costs(db: Session, realm_id: str) -> List[dict]:
             LargeLanguageModel.provider_name,
             LargeLanguageModel.model_name
         )
-        .all()
     )
+    total_count = db.query(LargeLanguageModel).filter(LargeLanguageModel.realm_id == realm_id).count()
+    if limit is not None:
+        query = query.offset(((page or 1) - 1) * limit).limit(limit)
+    results = query.all()
+
+    # The history of every listed LLM in one query, grouped below
+    history: Dict[UUID, List[dict]] = {llm.id: [] for llm, _ in results}
+    if history:
+        costs = select(
+            LLMCost,
+            func.row_number().over(partition_by=LLMCost.llm_id, order_by=LLMCost.valid_from.desc()).label("depth")
+        ).where(
+            LLMCost.realm_id == realm_id,
+            LLMCost.llm_id.in_(list(history))
+        ).subquery()
+        history_query = db.query(aliased(LLMCost, costs))
+        if history_limit is not None:
+            history_query = history_query.filter(costs.c.depth <= history_limit)
+        for cost in history_query.order_by(costs.c.llm_id, costs.c.depth):
+            history[cost.llm_id].append({"id": cost.id, **_cost_fields(cost)})
 
     # Format the results
     formatted_results = []
     for llm, current_cost in results:
-        # Get all historical costs for this LLM
-        historical_costs = (
-            db.query(LLMCost)
-            .filter(
-                LLMCost.llm_id == llm.id,
-                LLMCost.realm_id == realm_id
-            )
-            .order_by(LLMCost.valid_from.desc())
-            .all()
-        )
-
         result = {
             "id": llm.id,
             "provider_name": llm.provider_name,
@@ -60,36 +95,69 @@ def get_realm_llm_costs(db: Session, realm_id: str) -> List[dict]:
             "valid_from": None,
             "valid_to": None,
             "cost_id": None,
-            "history": []
+            "history": history[llm.id]
         }
         
         # Add current cost if it exists
         if current_cost:
-            result.update({
-                "price_per_unit": current_cost.price_per_unit,
-                "unit_type": current_cost.unit_type,
-                "overhead": current_cost.overhead,
-                "valid_from": current_cost.valid_from,
-                "valid_to": current_cost.valid_to,
-                "cost_id": current_cost.id
-            })
-
-        # Add historical costs
-        result["history"] = [
-            {
-                "id": cost.id,
-                "price_per_unit": cost.price_per_unit,
-                "unit_type": cost.unit_type,
-                "overhead": cost.overhead,
-                "valid_from": cost.valid_from,
-                "valid_to": cost.valid_to
-            }
-            for cost in historical_costs
-        ]
-        
+            result.update({**_cost_fields(current_cost), "cost_id": current_cost.id})
+
         formatted_results.append(result)
 
-    return formatted_results
+    return formatted_results, total_count
+
+class CachedCatalog(NamedTuple):
+    body: bytes
+    etag: str
+    total_count: int
+
+# (realm_id, page, limit, history_limit) -> CachedCatalog, the JSON of get_realm_llm_costs
+catalog_cache = TTLCache(max_size=settings.LLM_COST_CATALOG_CACHE_MAX_SIZE, ttl=settings.LLM_COST_CATALOG_CACHE_TTL)
+
+def _on_pricing_invalidation(realm_id: Optional[str]) -> None:
+    if realm_id is None:
+        catalog_cache.clear()
+    else:
+        catalog_cache.delete_where(lambda key: key[0] == realm_id)
+
+# Published by invalidate_realm_pricing after every change to the costs of a realm
+pubsub.subscribe("pricing", _on_pricing_invalidation)
+
+def _next_cost_change(db: Session, realm_id: str, current_time: datetime) -> Optional[datetime]:
+    """When a cost of the realm starts or ends next, changing the current costs"""
+    valid_from, valid_to = db.query(
+        func.min(LLMCost.valid_from).filter(LLMCost.valid_from > current_time),
+        func.min(LLMCost.valid_to).filter(LLMCost.valid_to > current_time)
+    ).filter(
+        LLMCost.realm_id == realm_id
+    ).one()
+    return min((change for change in (valid_from, valid_to) if change), default=None)
+
+def get_llm_cost_catalog(
+    db: Session,
+    realm_id: str,
+    page: Optional[int] = None,
+    limit: Optional[int] = None,
+    history_limit: Optional[int] = None
+) -> CachedCatalog:
+    """
+    get_realm_llm_costs as a JSON body with its ETag, cached until a cost of the realm
+    is changed or the next price starts or ends
+    """
+    key = (realm_id, page, limit, history_limit)
+    cached = catalog_cache.get(key)
+    if cached is not None:
+        return cached
+
+    current_time = datetime.now(timezone.utc)
+    results, total_count = get_realm_llm_costs(db, realm_id, page, limit, history_limit)
+    body = json.dumps(jsonable_encoder([LLMWithCurrentCostResponse.model_validate(result) for result in results])).encode()
+    cached = CachedCatalog(body, f'"{hashlib.sha1(body).hexdigest()}"', total_count)
+
+    next_change = _next_cost_change(db, realm_id, current_time)
+    ttl = (next_change - current_time).total_seconds() if next_change else None
+    catalog_cache.set(key, cached, ttl)
+    return cached
 
 def get_single_llm_cost(db: Session, llm_cost_id: UUID, realm_id: str) -> LLMCost:
     """Get a specific LLM cost by ID"""
@@ -172,6 +240,7 @@ def create_llm_cost(db: Session, llm_cost: LLMCostCreate, realm_id: str) -> LLMC
         db.add(db_llm_cost)
         db.commit()
         db.refresh(db_llm_cost)
+        invalidate_realm_pricing(realm_id)
         return db_llm_cost
 
     except Exception as e:
@@ -211,6 +280,7 @@ def update_llm_cost(db: Session, llm_cost_id: UUID, llm_cost: LLMCostUpdate, rea
             db.add(existing_cost)
             db.commit()
             db.refresh(existing_cost)
+            invalidate_realm_pricing(realm_id)
             return existing_cost
         
         # If valid_from dates differ, create a new record
@@ -237,6 +307,7 @@ def update_llm_cost(db: Session, llm_cost_id: UUID, llm_cost: LLMCostUpdate, rea
             db.add(new_cost)
             db.commit()
             db.refresh(new_cost)
+            invalidate_realm_pricing(realm_id)
             return new_cost
 
     except Exception as e:
@@ -271,10 +342,14 @@ def delete_llm_cost(db: Session, llm_cost_id: UUID, realm_id: str, reopen_previo
                 previous_cost.valid_to = None
                 db.add(previous_cost)
 
-        # Delete the current cost
+        # Delete the current cost (and its usage)
+        llm_id = llm_cost.llm_id
+        first_day, last_day = db.query(
+            func.min(func.date(Usage.created_at)), func.max(func.date(Usage.created_at))
+        ).filter(Usage.llm_cost_id == llm_cost.id).one()
         db.delete(llm_cost)
         db.commit()
-        return True
+        invalidate_realm_pricing(realm_id)
     except Exception as e:
         print(e)
         db.rollback()
@@ -282,3 +357,11 @@ def delete_llm_cost(db: Session, llm_cost_id: UUID, realm_id: str, reopen_previo
             status_code=500, 
             detail=f"An error occurred while deleting the cost record: {str(e)}"
         )
+
+    # The usage of the deleted cost is gone, its daily totals have to be recomputed
+    usage_rollup_service.rebuild_rollup(db, realm_id, llm_id)
+    if first_day is not None and settings.USAGE_SKETCHES_ENABLED:
+        usage_sketch_service.rebuild_sketches(db, realm_id, first_day, last_day)
+    invalidate_realm_kpis(realm_id)
+    invalidate_realm_budgets(realm_id)
+    return True
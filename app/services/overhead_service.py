@@ -7,6 +7,7 @@ from app.schemas.overhead import (
     OverheadWithHistoryResponse,
     OverheadHistoryEntry
 )
+from app.services.pricing_service import invalidate_realm_pricing
 from fastapi import HTTPException
 from typing import Optional
 from datetime import datetime, timezone, timedelta
@@ -100,6 +101,7 @@ def create_overhead(db: Session, overhead: OverheadCreate, realm_id: str) -> Ove
         db.add(db_overhead)
         db.commit()
         db.refresh(db_overhead)
+        invalidate_realm_pricing(realm_id)
         
         return db_overhead
 
@@ -150,6 +152,7 @@ def update_overhead(db: Session, overhead_id: uuid.UUID, overhead: OverheadUpdat
             db.add(existing_overhead)
             db.commit()
             db.refresh(existing_overhead)
+            invalidate_realm_pricing(realm_id)
             return existing_overhead
         
         # If valid_from dates differ, create a new record
@@ -174,6 +177,7 @@ def update_overhead(db: Session, overhead_id: uuid.UUID, overhead: OverheadUpdat
             db.add(new_overhead)
             db.commit()
             db.refresh(new_overhead)
+            invalidate_realm_pricing(realm_id)
             return new_overhead
 
     except Exception as e:
@@ -205,6 +209,7 @@ def delete_overhead(db: Session, overhead_id: uuid.UUID, realm_id: str, reopen_p
             overhead.valid_to = end_of_day
             db.add(overhead)
             db.commit()
+            invalidate_realm_pricing(realm_id)
             return True
         else:
             # Future overhead: can be deleted
@@ -229,6 +234,7 @@ def delete_overhead(db: Session, overhead_id: uuid.UUID, realm_id: str, reopen_p
             # Delete the future overhead
             db.delete(overhead)
             db.commit()
+            invalidate_realm_pricing(realm_id)
             return True
 
     except Exception as e:
@@ -0,0 +1,144 @@
+from sqlalchemy.orm import Session
+from app.models.llm_cost import LLMCost
+from app.models.large_language_model import LargeLanguageModel
+from app.models.realm import Realm
+from app.models.overhead import Overhead
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core import metrics, pubsub
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from typing import NamedTuple, Optional
+from uuid import UUID
+
+class PricingSnapshot(NamedTuple):
+    """Everything needed to price a usage event of a model, valid in [valid_from, valid_to)"""
+    llm_id: UUID
+    llm_cost_id: UUID
+    price_per_token: float
+    overhead_percentage: float
+    valid_from: datetime
+    valid_to: datetime
+
+# (realm_id, provider_name, model_name) -> PricingSnapshot
+pricing_cache = TTLCache(max_size=settings.PRICING_CACHE_MAX_SIZE, ttl=settings.PRICING_CACHE_TTL)
+
+metrics.register_gauge("pricing_cache.hits", lambda: pricing_cache.hits)
+metrics.register_gauge("pricing_cache.misses", lambda: pricing_cache.misses)
+
+def _current_overhead(db: Session, realm_id: str, current_time: datetime) -> Optional[Overhead]:
+    return db.query(Overhead).filter(
+        Overhead.realm_id == realm_id,
+        Overhead.valid_from <= current_time,
+        (Overhead.valid_to.is_(None) | (Overhead.valid_to > current_time))
+    ).order_by(Overhead.valid_from.desc()).first()
+
+def _next_valid_from(db: Session, model, current_time: datetime, *filters) -> Optional[datetime]:
+    """Start of the next scheduled record, i.e. when the current one stops being the latest"""
+    return db.query(model.valid_from).filter(
+        *filters,
+        model.valid_from > current_time
+    ).order_by(model.valid_from).limit(1).scalar()
+
+def load_pricing_snapshot(
+    db: Session,
+    realm_id: str,
+    provider_name: str,
+    model_name: str,
+    current_time: datetime
+) -> PricingSnapshot:
+    """Resolve the pricing of a model from the database"""
+    llm = db.query(LargeLanguageModel).filter(
+        LargeLanguageModel.provider_name == provider_name,
+        LargeLanguageModel.model_name == model_name,
+        LargeLanguageModel.realm_id == realm_id
+    ).first()
+
+    if not llm:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Model {model_name} from provider {provider_name} not found for this realm"
+        )
+
+    # Get the current LLM cost for this model
+    llm_cost = db.query(LLMCost).filter(
+        LLMCost.llm_id == llm.id,
+        LLMCost.realm_id == realm_id,
+        LLMCost.valid_from <= current_time,
+        (LLMCost.valid_to.is_(None) | (LLMCost.valid_to > current_time))
+    ).order_by(LLMCost.valid_from.desc()).first()
+
+    if not llm_cost:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No active cost configuration found for {model_name} from {provider_name}"
+        )
+
+    # Get realm configuration
+    realm = db.query(Realm).filter(Realm.id == realm_id).first()
+    if not realm:
+        raise HTTPException(status_code=404, detail="Realm not found")
+
+    valid_from = llm_cost.valid_from
+    boundaries = [
+        llm_cost.valid_to,
+        _next_valid_from(db, LLMCost, current_time, LLMCost.llm_id == llm.id, LLMCost.realm_id == realm_id)
+    ]
+
+    # LLMCost overhead takes precedence over the realm overhead (when enabled)
+    overhead_percentage = 0
+    if llm_cost.overhead:
+        overhead_percentage = llm_cost.overhead
+    elif realm.overhead_enabled:
+        overhead = _current_overhead(db, realm_id, current_time)
+        if overhead:
+            overhead_percentage = overhead.percentage
+            valid_from = max(valid_from, overhead.valid_from)
+            boundaries.append(overhead.valid_to)
+        boundaries.append(_next_valid_from(db, Overhead, current_time, Overhead.realm_id == realm_id))
+
+    price_per_token = llm_cost.price_per_unit / 1000 if llm_cost.unit_type == "1K" else llm_cost.price_per_unit
+
+    return PricingSnapshot(
+        llm_id=llm.id,
+        llm_cost_id=llm_cost.id,
+        price_per_token=price_per_token,
+        overhead_percentage=overhead_percentage,
+        valid_from=valid_from,
+        valid_to=min(
+            [boundary for boundary in boundaries if boundary is not None],
+            default=current_time + timedelta(seconds=settings.PRICING_CACHE_TTL)
+        )
+    )
+
+def get_pricing_snapshot(
+    db: Session,
+    realm_id: str,
+    provider_name: str,
+    model_name: str,
+    current_time: datetime
+) -> PricingSnapshot:
+    """
+    Get the pricing of a model, from the cache when a snapshot valid at current_time exists.
+    Entries expire at the first price or overhead boundary and are invalidated by pricing writes.
+    """
+    key = (realm_id, provider_name, model_name)
+    snapshot = pricing_cache.get(key)
+    if snapshot and snapshot.valid_from <= current_time < snapshot.valid_to:
+        return snapshot
+
+    snapshot = load_pricing_snapshot(db, realm_id, provider_name, model_name, current_time)
+    pricing_cache.set(key, snapshot, ttl=(snapshot.valid_to - current_time).total_seconds())
+    return snapshot
+
+def _on_pricing_invalidation(realm_id: Optional[str]) -> None:
+    if realm_id is None:
+        pricing_cache.clear()
+    else:
+        pricing_cache.delete_where(lambda key: key[0] == realm_id)
+
+pubsub.subscribe("pricing", _on_pricing_invalidation)
+
+def invalidate_realm_pricing(realm_id: str) -> None:
+    """Drop the cached pricing of a realm in every worker, after any change to its costs, overheads or settings"""
+    pubsub.publish("pricing", realm_id)
@@ -1,13 +1,20 @@
 from sqlalchemy.orm import Session
 from app.models.realm import Realm
+from app.models.api_key import APIKey
 from app.schemas.realm import RealmCreate, RealmUpdate, RealmResponse
+from app.services.pricing_service import invalidate_realm_pricing
+from app.services.usage_service import invalidate_account
+from app.services.api_log_service import invalidate_realm_log_config
+from app.services.kpi_cache_service import invalidate_realm_kpis
+from app.services.budget_service import invalidate_realm_budgets
+from app.services.api_key_service import invalidate_api_key
 from fastapi import HTTPException
 from typing import List
 import uuid
 
 def get_user_realms(db: Session, user_id: str) -> List[RealmResponse]:
     realms = db.query(Realm).filter(Realm.created_by == uuid.UUID(user_id)).order_by(Realm.name).all()
-    return [RealmResponse(id=realm.id, name=realm.name, bill_limit_enabled=realm.bill_limit_enabled, overhead_enabled=realm.overhead_enabled, created_at=realm.created_at) for realm in realms]
+    return [RealmResponse.model_validate(realm) for realm in realms]
 
 def get_realm(db: Session, realm_id: str, user_id: str) -> Realm:
     realm = db.query(Realm).filter(Realm.id == realm_id, Realm.created_by == uuid.UUID(user_id)).first()
@@ -24,11 +31,11 @@ def create_realm(db: Session, realm: RealmCreate, user_id: str) -> RealmResponse
     if existing_realm:
         raise HTTPException(status_code=400, detail="A realm with this name already exists")
 
-    db_realm = Realm(name=realm.name, created_by=uuid.UUID(user_id), bill_limit_enabled=realm.bill_limit_enabled, overhead_enabled=realm.overhead_enabled)
+    db_realm = Realm(created_by=uuid.UUID(user_id), **realm.model_dump())
     db.add(db_realm)
     db.commit()
     db.refresh(db_realm)
-    return RealmResponse(id=db_realm.id, name=db_realm.name, bill_limit_enabled=db_realm.bill_limit_enabled, overhead_enabled=db_realm.overhead_enabled, created_at=db_realm.created_at)
+    return RealmResponse.model_validate(db_realm)
 
 def update_realm(db: Session, realm_id: str, realm: RealmUpdate, user_id: str) -> RealmResponse:
     db_realm = get_realm(db, realm_id, user_id)
@@ -50,12 +57,29 @@ def update_realm(db: Session, realm_id: str, realm: RealmUpdate, user_id: str) -
         db_realm.bill_limit_enabled = realm.bill_limit_enabled
     if realm.overhead_enabled is not None:
         db_realm.overhead_enabled = realm.overhead_enabled
+    if realm.log_sample_rate is not None:
+        db_realm.log_sample_rate = realm.log_sample_rate
+    if realm.log_error_sample_rate is not None:
+        db_realm.log_error_sample_rate = realm.log_error_sample_rate
+    if realm.log_max_body_size is not None:
+        db_realm.log_max_body_size = realm.log_max_body_size
 
     db.commit()
     db.refresh(db_realm)
-    return RealmResponse(id=db_realm.id, name=db_realm.name, bill_limit_enabled=db_realm.bill_limit_enabled, overhead_enabled=db_realm.overhead_enabled, created_at=db_realm.created_at)
+    invalidate_realm_pricing(realm_id)
+    invalidate_realm_log_config(realm_id)
+    invalidate_realm_budgets(realm_id)
+    return RealmResponse.model_validate(db_realm)
 
 def delete_realm(db: Session, realm_id: str, user_id: str) -> None:
     db_realm = get_realm(db, realm_id, user_id)
+    # Deleted with the realm: they must stop validating from the caches
+    hashed_keys = [value for (value,) in db.query(APIKey.value).filter(APIKey.realm_id == realm_id)]
     db.delete(db_realm)
     db.commit()
+    for hashed_key in hashed_keys:
+        invalidate_api_key(hashed_key)
+    invalidate_realm_pricing(realm_id)
+    invalidate_account(realm_id)
+    invalidate_realm_kpis(realm_id)
+    invalidate_realm_budgets(realm_id)
@@ -0,0 +1,103 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional
+import tiktoken
+from fastapi import HTTPException
+from app.core.config import settings
+from app.core import metrics
+from app.schemas.usage import UsageCreate
+
+# BPE encoding is CPU bound: it runs on a dedicated thread pool (tiktoken releases
+# the GIL while encoding) so long prompts never stall the event loop.
+_executor = ThreadPoolExecutor(max_workers=settings.TOKENIZER_WORKERS, thread_name_prefix="tokenizer")
+_semaphore: Optional[asyncio.Semaphore] = None
+
+@lru_cache(maxsize=256)
+def get_encoding(model_name: str) -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model(model_name)
+
+def count_tokens(model_name: str, texts: List[str]) -> List[int]:
+    """Count the tokens of many texts of the same model"""
+    encoding = get_encoding(model_name)
+
+    # Encoded on the calling thread: the parallelism is the tokenizer pool, a thread pool of
+    # encode_batch per call would multiply the workers. thread_time is the CPU time of this
+    # thread alone, without the time spent waiting for the pool or the GIL.
+    started = time.thread_time()
+    counts = [len(encoding.encode(text)) for text in texts]
+
+    metrics.observe("tokenizer.encode_seconds", time.thread_time() - started)
+    metrics.increment("tokenizer.texts", len(texts))
+    metrics.increment("tokenizer.tokens", sum(counts))
+    return counts
+
+def _tokenize_error(e: Exception) -> HTTPException:
+    return HTTPException(status_code=400, detail=f"Error tokenizing message: {str(e)}")
+
+def _count_usage_tokens(model_name: str, usages: List[UsageCreate]) -> None:
+    """Count the message and output message tokens of usages of the same model"""
+    texts = []
+    for usage in usages:
+        texts.append(usage.message)
+        if usage.output_message:
+            texts.append(usage.output_message)
+
+    try:
+        counts = iter(count_tokens(model_name, texts))
+    except Exception as e:
+        if len(usages) == 1:
+            usages[0]._tokenize_error = _tokenize_error(e)
+            return
+        # Retry one by one, so a bad message only fails its own usage
+        for usage in usages:
+            _count_usage_tokens(model_name, [usage])
+        return
+
+    for usage in usages:
+        usage.input_tokens = next(counts)
+        if usage.output_message:
+            usage.output_tokens = next(counts)
+        elif usage.output_tokens is None:
+            usage.output_tokens = 0
+        usage._tokenized = True
+
+def _count_usages_tokens(usages: List[UsageCreate]) -> None:
+    by_model: Dict[str, List[UsageCreate]] = {}
+    for usage in usages:
+        if usage.message and not usage._tokenized:
+            by_model.setdefault(usage.llm_model_name, []).append(usage)
+
+    for model_name, model_usages in by_model.items():
+        try:
+            get_encoding(model_name)
+        except Exception as e:
+            for usage in model_usages:
+                usage._tokenize_error = _tokenize_error(e)
+            continue
+        _count_usage_tokens(model_name, model_usages)
+
+def tokenize_usage(usage: UsageCreate) -> None:
+    """
+    Replace the token counts of a usage with the token counts of its messages.
+    No-op when the usage was already tokenized by tokenize_usages_async.
+    """
+    if usage.message and not usage._tokenized and usage._tokenize_error is None:
+        _count_usages_tokens([usage])
+    if usage._tokenize_error is not None:
+        raise usage._tokenize_error
+
+async def tokenize_usages_async(usages: List[UsageCreate]) -> None:
+    """
+    Tokenize the messages of many usages on the tokenizer pool.
+    Errors are recorded on each usage and raised by tokenize_usage.
+    """
+    global _semaphore
+    if not any(usage.message for usage in usages):
+        return
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(settings.TOKENIZER_MAX_CONCURRENCY)
+
+    async with _semaphore:
+        await asyncio.get_running_loop().run_in_executor(_executor, _count_usages_tokens, usages)
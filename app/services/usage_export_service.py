@@ -0,0 +1,220 @@
+from sqlalchemy import Date, literal, select
+from app.models.usage import Usage
+from app.models.llm_cost import LLMCost
+from app.models.large_language_model import LargeLanguageModel
+from app.models.account import Account
+from app.models.api_key import APIKey
+from app.core.config import settings
+from app.core import metrics
+from app.db.database import SessionLocal
+from datetime import date, timedelta
+from fastapi import HTTPException
+from typing import Iterator, List, Optional
+from uuid import UUID
+import csv
+import io
+import json
+import time
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream"
+}
+
+COLUMNS = (
+    "id",
+    "created_at",
+    "provider_name",
+    "llm_model_name",
+    "external_id",
+    "api_key_name",
+    "input_tokens",
+    "output_tokens",
+    "total_tokens",
+    "total_model_price",
+    "total_price",
+    "idempotency_key"
+)
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise HTTPException(status_code=422, detail="Parquet and Arrow exports require pyarrow, install it with pip install pyarrow")
+    return pyarrow
+
+def check_format(format: str) -> None:
+    """Fail before streaming starts when the format cannot be produced"""
+    if format not in FORMATS:
+        raise HTTPException(status_code=422, detail=f"Unknown export format {format}, use {', '.join(FORMATS)}")
+    if format in ("parquet", "arrow"):
+        _require_pyarrow()
+
+def _export_statement(realm_id: str, start_date: Optional[date], end_date: Optional[date], account_id: Optional[UUID]):
+    statement = select(
+        Usage.id,
+        Usage.created_at,
+        LargeLanguageModel.provider_name,
+        LargeLanguageModel.model_name,
+        Account.external_id,
+        APIKey.name,
+        Usage.input_tokens,
+        Usage.output_tokens,
+        Usage.total_tokens,
+        Usage.total_model_price,
+        Usage.total_price,
+        Usage.idempotency_key
+    ).join(
+        LLMCost, Usage.llm_cost_id == LLMCost.id
+    ).join(
+        LargeLanguageModel, LLMCost.llm_id == LargeLanguageModel.id
+    ).outerjoin(
+        Account, Usage.account_id == Account.id
+    ).outerjoin(
+        APIKey, Usage.api_key_id == APIKey.id
+    ).where(
+        Usage.realm_id == realm_id
+    )
+    # Same half-open date bounds as the KPIs, so the (realm_id, created_at) index is used
+    if start_date:
+        statement = statement.where(Usage.created_at >= literal(start_date, Date))
+    if end_date:
+        statement = statement.where(Usage.created_at < literal(end_date + timedelta(days=1), Date))
+    if account_id:
+        statement = statement.where(Usage.account_id == account_id)
+    return statement.order_by(Usage.created_at, Usage.id)
+
+def _partitions(realm_id: str, start_date: Optional[date], end_date: Optional[date], account_id: Optional[UUID]) -> Iterator[List[tuple]]:
+    """Usage rows in lists of USAGE_EXPORT_BATCH_SIZE, read through a server-side cursor"""
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            _export_statement(realm_id, start_date, end_date, account_id),
+            execution_options={"yield_per": settings.USAGE_EXPORT_BATCH_SIZE}
+        )
+        for partition in result.partitions():
+            yield partition
+    finally:
+        db.close()
+
+def _csv_chunks(partitions: Iterator[List[tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for partition in partitions:
+        writer.writerows(partition)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+# Created once: json.dumps builds a new encoder per call when given options
+_json_encoder = json.JSONEncoder(default=str, separators=(",", ":"))
+
+def _ndjson_chunks(partitions: Iterator[List[tuple]]) -> Iterator[bytes]:
+    encode = _json_encoder.encode
+    for partition in partitions:
+        yield "".join(
+            encode(dict(zip(COLUMNS, row))) + "\n"
+            for row in partition
+        ).encode()
+
+class _ChunkSink:
+    """Write-only file collecting what pyarrow writes, emptied after every batch"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+def _arrow_chunks(partitions: Iterator[List[tuple]], format: str) -> Iterator[bytes]:
+    pa = _require_pyarrow()
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        ("provider_name", pa.string()),
+        ("llm_model_name", pa.string()),
+        ("external_id", pa.string()),
+        ("api_key_name", pa.string()),
+        ("input_tokens", pa.int64()),
+        ("output_tokens", pa.int64()),
+        ("total_tokens", pa.int64()),
+        ("total_model_price", pa.float64()),
+        ("total_price", pa.float64()),
+        ("idempotency_key", pa.string())
+    ])
+    sink = _ChunkSink()
+    if format == "parquet":
+        writer = pa.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+
+    for partition in partitions:
+        # One row group (or record batch) per partition
+        columns = [list(column) for column in zip(*partition)]
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema
+        ))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+def export_usage(
+    realm_id: str,
+    format: str,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    account_id: Optional[UUID] = None
+) -> Iterator[bytes]:
+    """
+    Stream the usage rows of a realm, with their model, account and API key names, in the given
+    format. Rows are read and encoded one batch at a time, so memory does not grow with the range.
+    """
+    check_format(format)
+    started = time.perf_counter()
+    rows = 0
+
+    def counted(partitions: Iterator[List[tuple]]) -> Iterator[List[tuple]]:
+        nonlocal rows
+        for partition in partitions:
+            rows += len(partition)
+            yield partition
+
+    partitions = counted(_partitions(realm_id, start_date, end_date, account_id))
+    if format == "csv":
+        chunks = _csv_chunks(partitions)
+    elif format == "ndjson":
+        chunks = _ndjson_chunks(partitions)
+    else:
+        chunks = _arrow_chunks(partitions, format)
+
+    for chunk in chunks:
+        if chunk:
+            yield chunk
+
+    metrics.increment("usage_export.rows", rows)
+    metrics.observe("usage_export.seconds", time.perf_counter() - started)
@@ -0,0 +1,310 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.models.usage_import import UsageImport
+from app.core.config import settings
+from app.core import events, metrics
+from app.db.database import SessionLocal
+from app.services import usage_sketch_service
+from datetime import datetime, timezone
+from fastapi import HTTPException
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, TextIO, Tuple
+from uuid import UUID
+import csv
+import io
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+
+# Columns of an import row, by the names used by /usage/track plus the historical timestamp
+STAGING_COLUMNS = (
+    "created_at",
+    "provider_name",
+    "llm_model_name",
+    "input_tokens",
+    "output_tokens",
+    "external_id",
+    "idempotency_key"
+)
+
+_CREATE_STAGING_TABLE = text("""
+    CREATE TEMP TABLE IF NOT EXISTS usage_import_staging (
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        provider_name VARCHAR(255) NOT NULL,
+        llm_model_name VARCHAR(255) NOT NULL,
+        input_tokens INTEGER NOT NULL,
+        output_tokens INTEGER NOT NULL,
+        external_id VARCHAR(255),
+        idempotency_key VARCHAR(255)
+    ) ON COMMIT DELETE ROWS
+""")
+
+_UPSERT_ACCOUNTS = text("""
+    INSERT INTO accounts (realm_id, external_id)
+    SELECT DISTINCT :realm_id, external_id
+    FROM usage_import_staging
+    WHERE external_id IS NOT NULL
+    ON CONFLICT (realm_id, external_id) DO NOTHING
+""")
+
+# Prices every staged row with the cost (and overhead) valid at its own timestamp, the same
+# way pricing_service does for live events, and inserts the priced rows in one statement.
+_PRICE_AND_INSERT_USAGE = text("""
+    WITH priced AS (
+        SELECT
+            s.created_at,
+            s.input_tokens,
+            s.output_tokens,
+            s.idempotency_key,
+            a.id AS account_id,
+            c.id AS llm_cost_id,
+            CASE WHEN c.unit_type = '1K' THEN c.price_per_unit / 1000 ELSE c.price_per_unit END AS price_per_token,
+            CASE
+                WHEN COALESCE(c.overhead, 0) <> 0 THEN c.overhead
+                WHEN r.overhead_enabled THEN COALESCE(o.percentage, 0)
+                ELSE 0
+            END AS overhead_percentage
+        FROM usage_import_staging s
+        JOIN realms r ON r.id = :realm_id
+        LEFT JOIN large_language_models l
+            ON l.realm_id = :realm_id
+            AND l.provider_name = s.provider_name
+            AND l.model_name = s.llm_model_name
+        LEFT JOIN LATERAL (
+            SELECT id, price_per_unit, unit_type, overhead
+            FROM llm_costs
+            WHERE llm_id = l.id
+            AND realm_id = :realm_id
+            AND valid_from <= s.created_at
+            AND (valid_to IS NULL OR valid_to > s.created_at)
+            ORDER BY valid_from DESC
+            LIMIT 1
+        ) c ON true
+        LEFT JOIN LATERAL (
+            SELECT percentage
+            FROM overheads
+            WHERE realm_id = :realm_id
+            AND valid_from <= s.created_at
+            AND (valid_to IS NULL OR valid_to > s.created_at)
+            ORDER BY valid_from DESC
+            LIMIT 1
+        ) o ON true
+        LEFT JOIN accounts a ON a.realm_id = :realm_id AND a.external_id = s.external_id
+    ),
+    inserted AS (
+        INSERT INTO usage (
+            account_id, realm_id, llm_cost_id, input_tokens, output_tokens, total_tokens,
+            total_model_price, total_price, created_at, idempotency_key
+        )
+        SELECT
+            account_id,
+            :realm_id,
+            llm_cost_id,
+            input_tokens,
+            output_tokens,
+            input_tokens + output_tokens,
+            (input_tokens + output_tokens) * price_per_token,
+            (input_tokens + output_tokens) * price_per_token * (1 + overhead_percentage),
+            created_at,
+            idempotency_key
+        FROM priced
+        WHERE llm_cost_id IS NOT NULL
+        ON CONFLICT (realm_id, idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+        RETURNING id
+    )
+    SELECT
+        (SELECT count(*) FROM priced WHERE llm_cost_id IS NOT NULL) AS priced,
+        (SELECT count(*) FROM priced WHERE llm_cost_id IS NULL) AS unpriced,
+        (SELECT count(*) FROM inserted) AS imported,
+        (SELECT array_agg(id) FROM inserted) AS usage_ids
+""")
+
+_SELECT_USAGE = text("SELECT * FROM usage WHERE id = ANY(:usage_ids)")
+
+def detect_format(filename: str) -> str:
+    if filename.endswith(".csv"):
+        return "csv"
+    if filename.endswith(".jsonl") or filename.endswith(".ndjson"):
+        return "jsonl"
+    raise HTTPException(status_code=422, detail="Unknown import format, use csv or jsonl")
+
+def _read_records(stream: TextIO, format: str) -> Iterator[Optional[dict]]:
+    """Yield one dict per record of the source, or None for a JSONL line that is not valid JSON"""
+    if format == "csv":
+        yield from csv.DictReader(stream)
+        return
+
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+def _optional(value) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    value = str(value)
+    if len(value) > 255:
+        raise ValueError("value too long")
+    return value
+
+def _normalize_record(record: Optional[dict]) -> Optional[Tuple]:
+    """Validate a record and return its staging row, or None when it has to be rejected"""
+    if not isinstance(record, dict):
+        return None
+    try:
+        created_at = datetime.fromisoformat(str(record["created_at"]))
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        input_tokens = int(record["input_tokens"])
+        output_tokens = int(record["output_tokens"])
+        provider_name = _optional(record["provider_name"])
+        model_name = _optional(record["llm_model_name"])
+        if input_tokens < 0 or output_tokens < 0 or not provider_name or not model_name:
+            return None
+        return (
+            created_at.isoformat(),
+            provider_name,
+            model_name,
+            input_tokens,
+            output_tokens,
+            _optional(record.get("external_id")),
+            _optional(record.get("idempotency_key"))
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _chunks(records: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(records)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _import_chunk(db: Session, usage_import: UsageImport, records: List[Optional[dict]]) -> None:
+    """
+    COPY a chunk into the staging table, price and insert it, and move the checkpoint,
+    all in one transaction: a chunk is either fully imported and checkpointed or not at all.
+    """
+    started = time.perf_counter()
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    rejected = 0
+    for record in records:
+        row = _normalize_record(record)
+        if row is None:
+            rejected += 1
+        else:
+            writer.writerow(row)
+    buffer.seek(0)
+
+    priced = unpriced = imported = 0
+    usage_ids = None
+    if buffer.getvalue():
+        db.execute(_CREATE_STAGING_TABLE)
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY usage_import_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+        finally:
+            cursor.close()
+
+        params = {"realm_id": usage_import.realm_id}
+        db.execute(_UPSERT_ACCOUNTS, params)
+        priced, unpriced, imported, usage_ids = db.execute(_PRICE_AND_INSERT_USAGE, params).one()
+
+    if usage_ids and settings.USAGE_SKETCHES_ENABLED:
+        # Merged with the chunk, so a resumed import neither misses nor repeats its rows in the sketches
+        rows = [dict(row._mapping) for row in db.execute(_SELECT_USAGE, {"usage_ids": usage_ids})]
+        usage_sketch_service.merge_into_db(db, usage_sketch_service.build_sketches(db, rows))
+
+    usage_import.rows_read += len(records)
+    usage_import.rows_imported += imported
+    usage_import.rows_skipped += priced - imported
+    usage_import.rows_rejected += rejected + unpriced
+    db.commit()
+    if imported:
+        # Past days changed: their cached KPIs are stale
+        events.emit("usage_imported", str(usage_import.realm_id))
+
+    metrics.observe("usage_import.chunk_seconds", time.perf_counter() - started)
+    metrics.increment("usage_import.rows", len(records))
+
+def create_import(db: Session, realm_id: str, source: str, format: str) -> UsageImport:
+    if format not in FORMATS:
+        raise HTTPException(status_code=422, detail=f"Unknown import format {format}, use csv or jsonl")
+    usage_import = UsageImport(realm_id=realm_id, source=source, format=format, status="pending")
+    db.add(usage_import)
+    db.commit()
+    db.refresh(usage_import)
+    return usage_import
+
+def get_import(db: Session, import_id: UUID, realm_id: str) -> UsageImport:
+    usage_import = db.query(UsageImport).filter(
+        UsageImport.id == import_id,
+        UsageImport.realm_id == realm_id
+    ).first()
+    if not usage_import:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return usage_import
+
+def get_imports(db: Session, realm_id: str) -> List[UsageImport]:
+    return db.query(UsageImport).filter(
+        UsageImport.realm_id == realm_id
+    ).order_by(UsageImport.created_at.desc()).all()
+
+def run_import(
+    db: Session,
+    usage_import: UsageImport,
+    chunk_size: Optional[int] = None,
+    on_progress: Optional[Callable[[UsageImport], None]] = None
+) -> UsageImport:
+    """
+    Import the source file of an import, starting after its checkpoint (rows_read).
+    Running it again after an interruption resumes where the last committed chunk stopped.
+    """
+    if usage_import.status == "completed":
+        return usage_import
+
+    usage_import.status = "running"
+    usage_import.error = None
+    db.commit()
+
+    try:
+        with open(usage_import.source, newline="", encoding="utf-8") as stream:
+            records = islice(_read_records(stream, usage_import.format), usage_import.rows_read, None)
+            for chunk in _chunks(records, chunk_size or settings.USAGE_IMPORT_CHUNK_SIZE):
+                _import_chunk(db, usage_import, chunk)
+                if on_progress:
+                    on_progress(usage_import)
+    except Exception as e:
+        db.rollback()
+        usage_import.status = "failed"
+        usage_import.error = str(e)
+        db.commit()
+        raise
+
+    usage_import.status = "completed"
+    db.commit()
+    return usage_import
+
+def run_import_in_background(import_id: UUID) -> None:
+    """Run an import with its own session, for FastAPI background tasks"""
+    db = SessionLocal()
+    try:
+        usage_import = db.get(UsageImport, import_id)
+        run_import(db, usage_import)
+    except Exception:
+        logger.exception("usage import %s failed", import_id)
+    finally:
+        db.close()
@@ -0,0 +1,71 @@
+from app.core.batch_writer import BatchWriter
+from app.core.periodic import PeriodicTask
+from app.core.config import settings
+from app.db.database import SessionLocal
+from app.services import usage_service
+from sqlalchemy.exc import DataError, IntegrityError
+from typing import List
+import json
+import os
+
+def flush_usage_events(events: List[dict]) -> None:
+    """Write a batch of queued usage events in one transaction"""
+    db = SessionLocal()
+    try:
+        usage_service.insert_usage_events(db, events)
+    finally:
+        db.close()
+
+def dead_letter_usage_events(events: List[dict]) -> None:
+    """Keep the queued usage events that could not be written, to replay them by hand"""
+    if not settings.USAGE_INGEST_DEAD_LETTER_FILE:
+        return
+    os.makedirs(os.path.dirname(settings.USAGE_INGEST_DEAD_LETTER_FILE), exist_ok=True)
+    with open(settings.USAGE_INGEST_DEAD_LETTER_FILE, "a") as f:
+        for event in events:
+            f.write(json.dumps(event, default=str) + "\n")
+
+usage_writer = BatchWriter(
+    name="usage_ingest",
+    flush_func=flush_usage_events,
+    max_queue_size=settings.USAGE_INGEST_QUEUE_SIZE,
+    batch_size=settings.USAGE_INGEST_BATCH_SIZE,
+    flush_interval=settings.USAGE_INGEST_FLUSH_INTERVAL,
+    dead_letter_func=dead_letter_usage_events,
+    # Rows rejected by the database are isolated, the batch is kept while it is unreachable
+    item_errors=(DataError, IntegrityError),
+    retry_forever=True
+)
+
+def purge_idempotency_keys() -> None:
+    """Release expired idempotency keys, so the unique index only covers the retention window"""
+    db = SessionLocal()
+    try:
+        usage_service.purge_expired_idempotency_keys(db)
+    finally:
+        db.close()
+
+idempotency_purge = PeriodicTask(
+    name="idempotency_purge",
+    func=purge_idempotency_keys,
+    interval=settings.USAGE_IDEMPOTENCY_PURGE_INTERVAL
+)
+
+def is_enabled() -> bool:
+    return settings.USAGE_INGEST_MODE == "async"
+
+def enqueue_usage(values: dict, external_id: str = None) -> None:
+    """
+    Queue a priced usage event for the background flusher.
+    Raises QueueFullError when the queue is full.
+    """
+    usage_writer.put_nowait({**values, "external_id": external_id})
+
+async def start() -> None:
+    if is_enabled():
+        await usage_writer.start()
+    await idempotency_purge.start()
+
+async def stop() -> None:
+    await usage_writer.stop()
+    await idempotency_purge.stop()
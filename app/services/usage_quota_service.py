@@ -0,0 +1,447 @@
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from app.models.usage import Usage
+from app.models.account import Account
+from app.models.usage_quota import UsageQuota, UsageQuotaCounter
+from app.schemas.usage_quota import UsageQuotaCreate, UsageQuotaUpdate
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.periodic import PeriodicTask
+from app.core.sliding_window import SlidingWindowCounter
+from app.core import events, metrics, pubsub
+from app.db.database import SessionLocal
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+# Per-account quotas on tokens, cost (total_price, overhead included) or requests over rolling periods.
+# The usage of each account and period is summed in a sliding-window counter held in memory: loaded
+# from the last checkpoint plus the usage created since, moved by the usage_tracked event of every
+# worker (shared over pubsub each QUOTA_PUBLISH_INTERVAL) and reloaded after QUOTA_COUNTER_TTL.
+# Checking an account against its quotas is then a few dict lookups and sums.
+
+class Period(NamedTuple):
+    seconds: int
+    buckets: int
+    # Long periods are checkpointed, so loading a counter reads the usage since the last checkpoint only
+    checkpointed: bool
+
+PERIODS: Dict[str, Period] = {
+    "minute": Period(60, 60, False),
+    "hour": Period(3600, 60, False),
+    "day": Period(86400, 96, True),
+    # Rolling 30 days
+    "month": Period(2592000, 60, True)
+}
+
+# Measures of the counters, in order
+METRICS = ("tokens", "cost", "requests")
+
+class QuotaRule(NamedTuple):
+    id: str
+    account_id: Optional[str]
+    tier: Optional[str]
+    metric: str
+    period: str
+    amount: float
+
+    @property
+    def scope(self) -> str:
+        return "account" if self.account_id else "tier" if self.tier else "realm"
+
+# realm_id -> List[QuotaRule]
+quota_rules = TTLCache(max_size=settings.QUOTA_MAX_COUNTERS, ttl=settings.QUOTA_CACHE_TTL)
+# (realm_id, account_id) -> tier, "" for accounts without one
+account_tiers = TTLCache(max_size=settings.QUOTA_MAX_COUNTERS, ttl=settings.QUOTA_CACHE_TTL)
+# (realm_id, account_id, period) -> SlidingWindowCounter
+quota_counters = TTLCache(max_size=settings.QUOTA_MAX_COUNTERS, ttl=settings.QUOTA_COUNTER_TTL)
+_counters_lock = threading.Lock()
+
+# Usage tracked by this worker and not yet announced to the others, per (realm_id, account_id)
+_unpublished: Dict[Tuple[str, str], List[float]] = {}
+# Accounts whose counters moved since the last checkpoint
+_moved: Set[Tuple[str, str]] = set()
+
+def _values(row: dict) -> List[float]:
+    return [float(row["total_tokens"] or 0), float(row["total_price"] or 0), 1.0]
+
+def _add_usage(key: Tuple[str, str], timestamp: float, values: List[float]) -> None:
+    for period in PERIODS:
+        counter = quota_counters.get(key + (period,))
+        if counter is not None:
+            counter.add(timestamp, values)
+            _moved.add(key)
+
+def _on_usage_tracked(rows: List[dict]) -> None:
+    with _counters_lock:
+        for row in rows:
+            if row["account_id"] is None:
+                continue
+            key = (str(row["realm_id"]), str(row["account_id"]))
+            values = _values(row)
+            _add_usage(key, row["created_at"].timestamp(), values)
+            # Realms known to have no quota are not announced
+            if settings.PUBSUB_ENABLED and quota_rules.get(key[0]) != []:
+                pending = _unpublished.setdefault(key, [0.0] * len(METRICS))
+                for measure, value in enumerate(values):
+                    pending[measure] += value
+
+def _on_remote_usage(payload: Optional[str]) -> None:
+    if payload is None:
+        # Usage may have been missed: reload the counters
+        quota_counters.clear()
+        return
+    now = time.time()
+    with _counters_lock:
+        for realm_id, account_id, values in json.loads(payload):
+            _add_usage((realm_id, account_id), now, values)
+
+def _on_quota_invalidation(realm_id: Optional[str]) -> None:
+    if realm_id is None:
+        quota_rules.clear()
+        account_tiers.clear()
+    else:
+        quota_rules.delete(realm_id)
+        account_tiers.delete_where(lambda key: key[0] == realm_id)
+
+def _on_counter_invalidation(realm_id: Optional[str]) -> None:
+    if realm_id is None:
+        quota_counters.clear()
+    else:
+        quota_counters.delete_where(lambda key: key[0] == realm_id)
+
+def _on_usage_imported(realm_id: str) -> None:
+    # Imported usage is older than the checkpoints: count it again from the usage table
+    db = SessionLocal()
+    try:
+        db.query(UsageQuotaCounter).filter(UsageQuotaCounter.realm_id == realm_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    pubsub.publish("quota_counters", realm_id)
+
+events.subscribe("usage_tracked", _on_usage_tracked)
+events.subscribe("usage_imported", _on_usage_imported)
+pubsub.subscribe("quota_usage", _on_remote_usage)
+pubsub.subscribe("quotas", _on_quota_invalidation)
+pubsub.subscribe("quota_counters", _on_counter_invalidation)
+
+def invalidate_realm_quotas(realm_id: str) -> None:
+    """Reload the quotas of a realm and the tiers of its accounts in every worker"""
+    pubsub.publish("quotas", str(realm_id))
+
+def _tier(data: Optional[dict]) -> str:
+    # Accounts are matched to a tier with {"tier": "<name>"} (QUOTA_TIER_ATTRIBUTE) in their data
+    if not isinstance(data, dict) or data.get(settings.QUOTA_TIER_ATTRIBUTE) is None:
+        return ""
+    return str(data[settings.QUOTA_TIER_ATTRIBUTE])
+
+def account_rules(rules: List[QuotaRule], account_id: Optional[str], tier: str) -> List[QuotaRule]:
+    """
+    Quotas applying to an account: for each metric and period the most specific one wins,
+    the account's own quota, then its tier's, then the realm-wide one (the lowest amount on ties)
+    """
+    selected: Dict[Tuple[str, str], Tuple[int, float, QuotaRule]] = {}
+    for rule in rules:
+        if rule.account_id is not None:
+            if rule.account_id != account_id:
+                continue
+            rank = 0
+        elif rule.tier is not None:
+            if rule.tier != tier:
+                continue
+            rank = 1
+        else:
+            rank = 2
+        key = (rule.metric, rule.period)
+        if key not in selected or (rank, rule.amount) < selected[key][:2]:
+            selected[key] = (rank, rule.amount, rule)
+    return [rule for _, _, rule in selected.values()]
+
+def load_rules(db: Session, realm_id: str) -> List[QuotaRule]:
+    rules = [
+        QuotaRule(
+            str(quota.id), str(quota.account_id) if quota.account_id else None,
+            quota.tier, quota.metric, quota.period, quota.amount
+        )
+        for quota in db.query(UsageQuota).filter(UsageQuota.realm_id == realm_id)
+    ]
+    quota_rules.set(realm_id, rules)
+    return rules
+
+def load_tier(db: Session, realm_id: str, account_id: str) -> str:
+    tier = _tier(db.query(Account.data).filter(Account.id == account_id, Account.realm_id == realm_id).scalar())
+    account_tiers.set((realm_id, account_id), tier)
+    return tier
+
+def _empty_counter(period: str) -> SlidingWindowCounter:
+    spec = PERIODS[period]
+    return SlidingWindowCounter(spec.seconds, spec.buckets, len(METRICS))
+
+def _window_start(period: str, now: datetime) -> datetime:
+    """Just before the oldest bucket still in the window (timestamps are stored to the microsecond)"""
+    counter = _empty_counter(period)
+    oldest = int(now.timestamp() // counter.width) - counter.bucket_count + 1
+    return datetime.fromtimestamp(oldest * counter.width, timezone.utc) - timedelta(microseconds=1)
+
+def _usage_counter(
+    db: Session,
+    realm_id: str,
+    account_id: str,
+    period: str,
+    after: datetime,
+    until: Optional[datetime] = None
+) -> SlidingWindowCounter:
+    """Counter of the account's usage created after `after` (and up to until), one row per bucket"""
+    counter = _empty_counter(period)
+    bucket = func.floor(func.extract("epoch", Usage.created_at) / counter.width)
+    query = db.query(
+        bucket, func.sum(Usage.total_tokens), func.sum(Usage.total_price), func.count()
+    ).filter(
+        Usage.realm_id == realm_id,
+        Usage.account_id == account_id,
+        Usage.created_at > after
+    )
+    if until is not None:
+        query = query.filter(Usage.created_at <= until)
+    for index, tokens, cost, requests in query.group_by(bucket):
+        counter.buckets[int(index)] = [float(tokens or 0), float(cost or 0), float(requests)]
+    return counter
+
+def load_counters(db: Session, realm_id: str, account_id: str, periods: List[str]) -> Dict[str, SlidingWindowCounter]:
+    """
+    Load the counters of an account from their checkpoint and the usage created since.
+    Usage committed while they load may be counted once too many or too few, until the next load.
+    """
+    now = datetime.now(timezone.utc)
+    checkpoints = {
+        checkpoint.period: checkpoint
+        for checkpoint in db.query(UsageQuotaCounter).filter(
+            UsageQuotaCounter.account_id == account_id,
+            UsageQuotaCounter.period.in_(periods)
+        )
+    }
+    counters = {}
+    for period in periods:
+        window_start = _window_start(period, now)
+        checkpoint = checkpoints.get(period)
+        if checkpoint is not None and checkpoint.checkpointed_at >= window_start:
+            spec = PERIODS[period]
+            counter = SlidingWindowCounter.from_bytes(spec.seconds, spec.buckets, len(METRICS), checkpoint.data).merge(
+                _usage_counter(db, realm_id, account_id, period, checkpoint.checkpointed_at)
+            )
+        else:
+            counter = _usage_counter(db, realm_id, account_id, period, window_start)
+        counter.prune(now.timestamp())
+        quota_counters.set((realm_id, account_id, period), counter)
+        counters[period] = counter
+    metrics.increment("quotas.loads")
+    return counters
+
+def _load_account(realm_id: str, account_id: Optional[str], load_tier_first: bool, periods: List[str]) -> Tuple[str, List[QuotaRule]]:
+    db = SessionLocal()
+    try:
+        rules = quota_rules.get(realm_id)
+        if rules is None:
+            rules = load_rules(db, realm_id)
+        tier = ""
+        if account_id is not None:
+            tier = load_tier(db, realm_id, account_id) if load_tier_first else account_tiers.get((realm_id, account_id), "")
+            missing = [period for period in periods if quota_counters.get((realm_id, account_id, period)) is None]
+            if missing:
+                load_counters(db, realm_id, account_id, missing)
+        return tier, rules
+    finally:
+        db.close()
+
+def check_quotas(
+    rules: List[QuotaRule],
+    counters: Dict[str, SlidingWindowCounter],
+    requested: List[float],
+    now: float
+) -> dict:
+    """
+    Whether a call consuming `requested` (tokens, cost, requests) fits in every quota,
+    with the usage, remaining amount and time until usage starts leaving the window of each
+    """
+    quotas = []
+    retry_after = None
+    for rule in sorted(rules, key=lambda rule: (METRICS.index(rule.metric), PERIODS[rule.period].seconds)):
+        measure = METRICS.index(rule.metric)
+        counter = counters.get(rule.period)
+        used = counter.totals(now)[measure] if counter is not None else 0.0
+        allowed = used + requested[measure] <= rule.amount
+        resets_in = counter.resets_in(now, measure) if counter is not None else None
+        if not allowed and resets_in is not None:
+            retry_after = max(retry_after or 0.0, resets_in)
+        quotas.append({
+            "id": rule.id,
+            "scope": rule.scope,
+            "metric": rule.metric,
+            "period": rule.period,
+            "amount": rule.amount,
+            "used": used,
+            "remaining": max(rule.amount - used, 0.0),
+            "resets_in": resets_in,
+            "allowed": allowed
+        })
+    allowed = all(quota["allowed"] for quota in quotas)
+    return {
+        "status": "ok" if allowed else "exceeded",
+        "allowed": allowed,
+        "retry_after": retry_after,
+        "quotas": quotas
+    }
+
+async def get_quota_status(realm_id: str, account_id=None, tokens: float = 0, cost: float = 0.0) -> dict:
+    """
+    Check an account (None for an account not tracked yet) against its quotas for one more call
+    of the given tokens and cost. Answered from memory once the quotas and counters are loaded.
+    """
+    started = time.perf_counter()
+    realm_id = str(realm_id)
+    account_id = str(account_id) if account_id else None
+
+    rules = quota_rules.get(realm_id)
+    tier = account_tiers.get((realm_id, account_id)) if account_id else ""
+    if rules is None or tier is None:
+        tier, rules = await asyncio.to_thread(_load_account, realm_id, account_id, tier is None, [])
+
+    rules = account_rules(rules, account_id, tier)
+    counters = {}
+    if account_id is not None and rules:
+        periods = sorted({rule.period for rule in rules})
+        counters = {period: quota_counters.get((realm_id, account_id, period)) for period in periods}
+        if None in counters.values():
+            await asyncio.to_thread(_load_account, realm_id, account_id, False, periods)
+            counters = {period: quota_counters.get((realm_id, account_id, period)) for period in periods}
+
+    status = check_quotas(rules, counters, [tokens, cost, 1.0], time.time())
+    if not status["allowed"]:
+        metrics.increment("quotas.exceeded")
+    metrics.observe("quotas.check_seconds", time.perf_counter() - started)
+    return status
+
+def _publish_usage() -> None:
+    with _counters_lock:
+        unpublished = [[realm_id, account_id, values] for (realm_id, account_id), values in _unpublished.items()]
+        _unpublished.clear()
+    if unpublished and not pubsub.publish_list("quota_usage", unpublished, local=False):
+        # Some usage did not reach the other workers: they reload their counters
+        pubsub.publish("quota_usage", None, local=False)
+
+def _checkpoint(db: Session, realm_id: str, account_id: str, period: str, now: datetime) -> None:
+    until = now - timedelta(seconds=settings.QUOTA_CHECKPOINT_LAG)
+    window_start = _window_start(period, now)
+    db.execute(
+        pg_insert(UsageQuotaCounter).values(
+            account_id=account_id, period=period, realm_id=realm_id, checkpointed_at=window_start, data=b""
+        ).on_conflict_do_nothing()
+    )
+    stored = db.query(UsageQuotaCounter).filter(
+        UsageQuotaCounter.account_id == account_id,
+        UsageQuotaCounter.period == period
+    ).with_for_update().one()
+    if stored.checkpointed_at >= until:
+        return
+
+    spec = PERIODS[period]
+    if stored.checkpointed_at >= window_start:
+        since = stored.checkpointed_at
+        counter = SlidingWindowCounter.from_bytes(spec.seconds, spec.buckets, len(METRICS), stored.data)
+    else:
+        since = window_start
+        counter = _empty_counter(period)
+    counter = counter.merge(_usage_counter(db, realm_id, account_id, period, since, until))
+    counter.prune(now.timestamp())
+    stored.data = counter.to_bytes()
+    stored.checkpointed_at = until
+
+def checkpoint_counters() -> None:
+    """Add the usage created since their last checkpoint to the stored counters of the accounts that moved"""
+    with _counters_lock:
+        moved = sorted(_moved)
+        _moved.clear()
+    periods = [period for period, spec in PERIODS.items() if spec.checkpointed]
+
+    now = datetime.now(timezone.utc)
+    db = SessionLocal()
+    try:
+        for index, (realm_id, account_id) in enumerate(moved):
+            try:
+                for period in periods:
+                    if quota_counters.get((realm_id, account_id, period)) is not None:
+                        _checkpoint(db, realm_id, account_id, period, now)
+                db.commit()
+            except Exception:
+                db.rollback()
+                # Retried at the next run
+                with _counters_lock:
+                    _moved.update(moved[index:])
+                raise
+            metrics.increment("quotas.checkpoints")
+    finally:
+        db.close()
+
+publish_task = PeriodicTask(name="quota_usage", func=_publish_usage, interval=settings.QUOTA_PUBLISH_INTERVAL)
+checkpoint_task = PeriodicTask(name="quota_checkpoints", func=checkpoint_counters, interval=settings.QUOTA_CHECKPOINT_INTERVAL)
+
+async def start() -> None:
+    await publish_task.start()
+    await checkpoint_task.start()
+
+async def stop() -> None:
+    await publish_task.stop()
+    await checkpoint_task.stop()
+
+def _validate_account(db: Session, account_id: Optional[uuid.UUID], realm_id: str) -> None:
+    if account_id is not None and not db.query(Account.id).filter(Account.id == account_id, Account.realm_id == realm_id).first():
+        raise HTTPException(status_code=404, detail="Account not found")
+
+def create_quota(db: Session, quota: UsageQuotaCreate, realm_id: str) -> UsageQuota:
+    """Create a quota for an account, a tier, or every account of the realm"""
+    if quota.account_id is not None and quota.tier is not None:
+        raise HTTPException(status_code=422, detail="A quota applies to an account or to a tier, not both")
+    _validate_account(db, quota.account_id, realm_id)
+
+    db_quota = UsageQuota(realm_id=realm_id, **quota.model_dump())
+    db.add(db_quota)
+    db.commit()
+    db.refresh(db_quota)
+    invalidate_realm_quotas(realm_id)
+    return db_quota
+
+def get_quotas(db: Session, realm_id: str, tier: Optional[str] = None, account_id: Optional[uuid.UUID] = None) -> List[UsageQuota]:
+    query = db.query(UsageQuota).filter(UsageQuota.realm_id == realm_id)
+    if tier is not None:
+        query = query.filter(UsageQuota.tier == tier)
+    if account_id is not None:
+        query = query.filter(UsageQuota.account_id == account_id)
+    return query.order_by(UsageQuota.created_at).all()
+
+def get_quota(db: Session, quota_id: uuid.UUID, realm_id: str) -> UsageQuota:
+    quota = db.query(UsageQuota).filter(UsageQuota.id == quota_id, UsageQuota.realm_id == realm_id).first()
+    if not quota:
+        raise HTTPException(status_code=404, detail="Quota not found")
+    return quota
+
+def update_quota(db: Session, quota_id: uuid.UUID, quota: UsageQuotaUpdate, realm_id: str) -> UsageQuota:
+    db_quota = get_quota(db, quota_id, realm_id)
+    if quota.amount is not None:
+        db_quota.amount = quota.amount
+    db.commit()
+    db.refresh(db_quota)
+    invalidate_realm_quotas(realm_id)
+    return db_quota
+
+def delete_quota(db: Session, quota_id: uuid.UUID, realm_id: str) -> None:
+    db_quota = get_quota(db, quota_id, realm_id)
+    db.delete(db_quota)
+    db.commit()
+    invalidate_realm_quotas(realm_id)
@@ -0,0 +1,120 @@
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+from app.models.usage import Usage
+from app.models.usage_daily_rollup import UsageDailyRollup, UsageRollupState
+from app.core.config import settings
+from app.core.periodic import PeriodicTask
+from app.core import metrics
+from app.db.database import SessionLocal
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from uuid import UUID
+
+# Adds the usage rows in (from_id, to_id] to their daily rollup rows
+_ROLLUP_USAGE = """
+    INSERT INTO usage_daily_rollup AS r (
+        realm_id, day, llm_id, account_id, api_key_id,
+        events, input_tokens, output_tokens, total_tokens, total_model_price, total_price
+    )
+    SELECT
+        u.realm_id,
+        date(u.created_at),
+        c.llm_id,
+        u.account_id,
+        u.api_key_id,
+        count(*),
+        sum(u.input_tokens),
+        sum(u.output_tokens),
+        sum(u.total_tokens),
+        sum(u.total_model_price),
+        sum(u.total_price)
+    FROM usage u
+    JOIN llm_costs c ON c.id = u.llm_cost_id
+    WHERE u.id > :from_id AND u.id <= :to_id {filters}
+    GROUP BY 1, 2, 3, 4, 5
+    ON CONFLICT (
+        realm_id,
+        day,
+        llm_id,
+        COALESCE(account_id, '00000000-0000-0000-0000-000000000000'::uuid),
+        COALESCE(api_key_id, '00000000-0000-0000-0000-000000000000'::uuid)
+    ) DO UPDATE SET
+        events = r.events + EXCLUDED.events,
+        input_tokens = r.input_tokens + EXCLUDED.input_tokens,
+        output_tokens = r.output_tokens + EXCLUDED.output_tokens,
+        total_tokens = r.total_tokens + EXCLUDED.total_tokens,
+        total_model_price = r.total_model_price + EXCLUDED.total_model_price,
+        total_price = r.total_price + EXCLUDED.total_price
+"""
+
+def get_high_water_mark(db: Session) -> int:
+    """Usage rows with an id up to the returned one are in the rollup, 0 when it is not used"""
+    if not settings.USAGE_ROLLUP_ENABLED:
+        return 0
+    return db.query(UsageRollupState.last_usage_id).filter(UsageRollupState.id == 1).scalar() or 0
+
+def _lock_state(db: Session) -> UsageRollupState:
+    # Serializes the refresh of every worker
+    return db.query(UsageRollupState).filter(UsageRollupState.id == 1).with_for_update().one()
+
+def _refresh_step(db: Session) -> bool:
+    """Roll up one batch of usage rows, returns whether settled rows are left"""
+    state = _lock_state(db)
+    now = datetime.now(timezone.utc)
+    settle_cutoff = now - timedelta(seconds=settings.USAGE_ROLLUP_SETTLE_SECONDS)
+
+    # Ids are assigned before commit: rows up to pending_usage_id are only rolled up once every
+    # transaction that could still hold one of them has had time to commit
+    if state.pending_at <= settle_cutoff and state.pending_usage_id > state.last_usage_id:
+        to_id = min(state.pending_usage_id, state.last_usage_id + settings.USAGE_ROLLUP_BATCH_SIZE)
+        db.execute(text(_ROLLUP_USAGE.format(filters="")), {"from_id": state.last_usage_id, "to_id": to_id})
+        metrics.increment("usage_rollup.rows", to_id - state.last_usage_id)
+        state.last_usage_id = to_id
+
+    if state.pending_usage_id <= state.last_usage_id:
+        state.pending_usage_id = db.query(func.coalesce(func.max(Usage.id), 0)).scalar()
+        state.pending_at = now
+
+    more = state.pending_at <= settle_cutoff and state.pending_usage_id > state.last_usage_id
+    db.commit()
+    return more
+
+def refresh_rollup(db: Session) -> None:
+    """Move the high-water mark forward, one transaction per batch, until the settled rows are rolled up"""
+    while _refresh_step(db):
+        pass
+
+def rebuild_rollup(db: Session, realm_id: str, llm_id: Optional[UUID] = None) -> None:
+    """Recompute the rollup of a realm (or one of its models) after usage rows were deleted"""
+    if not settings.USAGE_ROLLUP_ENABLED:
+        return
+    state = _lock_state(db)
+
+    rollup = db.query(UsageDailyRollup).filter(UsageDailyRollup.realm_id == realm_id)
+    filters = "AND u.realm_id = :realm_id"
+    if llm_id:
+        rollup = rollup.filter(UsageDailyRollup.llm_id == llm_id)
+        filters += " AND c.llm_id = :llm_id"
+    rollup.delete(synchronize_session=False)
+
+    db.execute(
+        text(_ROLLUP_USAGE.format(filters=filters)),
+        {"from_id": 0, "to_id": state.last_usage_id, "realm_id": realm_id, "llm_id": llm_id}
+    )
+    db.commit()
+
+def _refresh() -> None:
+    db = SessionLocal()
+    try:
+        refresh_rollup(db)
+    finally:
+        db.close()
+
+rollup_task = PeriodicTask(name="usage_rollup", func=_refresh, interval=settings.USAGE_ROLLUP_INTERVAL)
+
+async def start() -> None:
+    if settings.USAGE_ROLLUP_ENABLED:
+        await rollup_task.start()
+
+async def stop() -> None:
+    await rollup_task.stop()
@@ -1,135 +1,415 @@
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.models.llm_cost import LLMCost
+from sqlalchemy import insert, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from app.models.usage import Usage
 from app.models.account import Account
-from app.models.large_language_model import LargeLanguageModel
-from app.models.realm import Realm
-from app.models.overhead import Overhead
-from app.schemas.usage import UsageCreate
-from datetime import datetime, timezone
+from app.schemas.usage import UsageCreate, UsageResponse
+from app.services import pricing_service, tokenization_service
+from app.services.pricing_service import PricingSnapshot
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core import events, metrics, pubsub
+from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException
-import tiktoken
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
 from uuid import UUID
 
-def get_or_create_account(db: Session, external_id: str, realm_id: str) -> Account:
-    account = db.query(Account).filter(
-        Account.external_id == external_id,
-        Account.realm_id == realm_id
-    ).first()
+# (realm_id, external_id) -> account id
+account_cache = TTLCache(max_size=settings.ACCOUNT_CACHE_MAX_SIZE, ttl=settings.ACCOUNT_CACHE_TTL)
 
-    if not account:
-        account = Account(
-            external_id=external_id,
-            realm_id=realm_id
-        )
-        db.add(account)
-        db.commit()
-        db.refresh(account)
+metrics.register_gauge("account_cache.hits", lambda: account_cache.hits)
+metrics.register_gauge("account_cache.misses", lambda: account_cache.misses)
+
+def _on_account_invalidation(payload: Optional[str]) -> None:
+    if payload is None:
+        account_cache.clear()
+        return
+    message = json.loads(payload)
+    if message.get("external_id") is None:
+        account_cache.delete_where(lambda key: key[0] == message["realm_id"])
+    else:
+        account_cache.delete((message["realm_id"], message["external_id"]))
+
+pubsub.subscribe("accounts", _on_account_invalidation)
+
+def invalidate_account(realm_id: str, external_id: Optional[str] = None) -> None:
+    """Drop a cached account (or all the accounts of a realm) in every worker"""
+    pubsub.publish("accounts", json.dumps({"realm_id": realm_id, "external_id": external_id}))
+
+def remember_accounts(realm_id: str, account_ids: Dict[str, UUID]) -> None:
+    """Cache resolved accounts, once the transaction that may have created them is committed"""
+    for external_id, account_id in account_ids.items():
+        account_cache.set((realm_id, external_id), account_id)
+
+# (realm_id, idempotency_key) -> usage returned to the first request, as JSON
+idempotency_cache = TTLCache(
+    max_size=settings.USAGE_IDEMPOTENCY_CACHE_MAX_SIZE,
+    ttl=min(settings.USAGE_IDEMPOTENCY_CACHE_TTL, settings.USAGE_IDEMPOTENCY_RETENTION_HOURS * 3600)
+)
+
+metrics.register_gauge("idempotency_cache.hits", lambda: idempotency_cache.hits)
+metrics.register_gauge("idempotency_cache.misses", lambda: idempotency_cache.misses)
+
+def get_idempotent_usage(realm_id: str, idempotency_key: Optional[str]) -> Optional[dict]:
+    """
+    The usage already tracked with this key, when this worker has it cached.
+    A miss is not proof of a new key: the unique index catches the other duplicates.
+    """
+    if not idempotency_key:
+        return None
+    usage = idempotency_cache.get((realm_id, idempotency_key))
+    if usage is not None:
+        metrics.increment("usage.idempotent_replays")
+    return usage
 
-    return account
+def remember_idempotent_usage(realm_id: str, idempotency_key: str, usage: dict) -> None:
+    """Cache the usage (as returned to the client) tracked with an idempotency key"""
+    idempotency_cache.set((realm_id, idempotency_key), usage)
 
-def get_current_overhead(db: Session, realm_id: str, current_time: datetime) -> float:
-    """Get the current valid overhead percentage for a realm"""
-    overhead = db.query(Overhead).filter(
-        Overhead.realm_id == realm_id,
-        Overhead.valid_from <= current_time,
-        (Overhead.valid_to.is_(None) | (Overhead.valid_to > current_time))
-    ).order_by(Overhead.valid_from.desc()).first()
+def _usage_json(usage: Usage) -> dict:
+    return UsageResponse.model_validate(usage).model_dump(mode="json")
+
+def _usage_row(usage: Usage) -> dict:
+    return {column.key: getattr(usage, column.key) for column in Usage.__table__.columns}
+
+def _emit_tracked(rows: List[dict]) -> None:
+    """Notify the in-process listeners (caches, counters...) of newly committed usage rows"""
+    if rows:
+        events.emit("usage_tracked", rows)
+
+def _find_idempotent_usages(db: Session, realm_id: str, idempotency_keys: Iterable[str]) -> Dict[str, dict]:
+    """Resolve the keys already used in a realm, from the cache and then with one SELECT"""
+    found = {}
+    missing = set()
+    for idempotency_key in set(idempotency_keys):
+        usage = get_idempotent_usage(realm_id, idempotency_key)
+        if usage is not None:
+            found[idempotency_key] = usage
+        else:
+            missing.add(idempotency_key)
+
+    if missing:
+        for existing in db.query(Usage).filter(
+            Usage.realm_id == realm_id,
+            Usage.idempotency_key.in_(missing)
+        ).all():
+            found[existing.idempotency_key] = _usage_json(existing)
+            remember_idempotent_usage(realm_id, existing.idempotency_key, found[existing.idempotency_key])
+            metrics.increment("usage.idempotent_replays")
+
+    return found
+
+def purge_expired_idempotency_keys(db: Session) -> int:
+    """Release the idempotency keys older than the retention window, returns how many were cleared"""
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.USAGE_IDEMPOTENCY_RETENTION_HOURS)
+    result = db.execute(
+        update(Usage)
+        .where(Usage.idempotency_key.isnot(None), Usage.created_at < cutoff)
+        .values(idempotency_key=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+def _insert_usage_statement():
+    """INSERT that skips usages whose idempotency key is already taken in the realm"""
+    return pg_insert(Usage).on_conflict_do_nothing(
+        index_elements=["realm_id", "idempotency_key"],
+        index_where=Usage.idempotency_key.isnot(None)
+    )
 
-    return overhead.percentage if overhead else 0
+def get_or_create_accounts(db: Session, external_ids: Iterable[str], realm_id: str) -> Dict[str, UUID]:
+    """
+    Resolve many external IDs to account IDs.
+    Cached accounts need no query; the others are upserted with one
+    INSERT ... ON CONFLICT DO NOTHING RETURNING, and the ones that already existed
+    (or were created concurrently) are read back with one SELECT.
+    Does not commit: new accounts are written in the caller's transaction.
+    """
+    account_ids = {}
+    missing = set()
+    for external_id in set(external_ids):
+        account_id = account_cache.get((realm_id, external_id))
+        if account_id:
+            account_ids[external_id] = account_id
+        else:
+            missing.add(external_id)
+
+    if not missing:
+        return account_ids
+
+    created = db.execute(
+        pg_insert(Account)
+        .values([{"external_id": external_id, "realm_id": realm_id} for external_id in missing])
+        .on_conflict_do_nothing(index_elements=["realm_id", "external_id"])
+        .returning(Account.external_id, Account.id)
+    ).all()
+    account_ids.update({row.external_id: row.id for row in created})
+
+    existing = missing - {row.external_id for row in created}
+    if existing:
+        rows = db.query(Account.external_id, Account.id).filter(
+            Account.realm_id == realm_id,
+            Account.external_id.in_(existing)
+        ).all()
+        found = {row.external_id: row.id for row in rows}
+        # These accounts are already committed, they can be cached right away
+        remember_accounts(realm_id, found)
+        account_ids.update(found)
+
+    return account_ids
+
+def get_or_create_account_id(db: Session, external_id: str, realm_id: str) -> UUID:
+    """Resolve a single external ID, see get_or_create_accounts"""
+    return get_or_create_accounts(db, [external_id], realm_id)[external_id]
+
+def build_usage_values(
+    usage: UsageCreate,
+    pricing: PricingSnapshot,
+    api_key_id: Optional[UUID],
+    account_id: Optional[UUID],
+    current_time: datetime
+) -> dict:
+    """Price a usage event and return the column values of its Usage row"""
+    total_tokens = usage.input_tokens + usage.output_tokens
+    total_model_price = total_tokens * pricing.price_per_token
+
+    # Calculate final price with overhead
+    total_price = total_model_price * (1 + pricing.overhead_percentage)
+
+    return {
+        "account_id": account_id,
+        "realm_id": usage.realm_id,
+        "api_key_id": api_key_id,
+        "llm_cost_id": pricing.llm_cost_id,
+        "input_tokens": usage.input_tokens,
+        "output_tokens": usage.output_tokens,
+        "total_tokens": total_tokens,
+        "total_model_price": total_model_price,
+        "total_price": total_price,
+        "created_at": current_time,
+        "idempotency_key": usage.idempotency_key
+    }
+
+def price_llm_usage(db: Session, usage: UsageCreate, api_key_id: UUID, current_time: datetime) -> dict:
+    """
+    Resolve the active pricing of a usage event and return its priced Usage column values.
+    The account is not resolved here: account_id is left empty.
+    """
+    pricing = pricing_service.get_pricing_snapshot(
+        db, usage.realm_id, usage.provider_name, usage.llm_model_name, current_time
+    )
+
+    # Tokenize messages if provided
+    tokenization_service.tokenize_usage(usage)
+
+    return build_usage_values(usage, pricing, api_key_id, None, current_time)
 
 def track_llm_usage(db: Session, usage: UsageCreate, api_key_id: UUID):
     current_time = datetime.now(timezone.utc)
 
-    # First, get the LLM model for the given provider and model name in the realm
-    llm = db.query(LargeLanguageModel).filter(
-        LargeLanguageModel.provider_name == usage.provider_name,
-        LargeLanguageModel.model_name == usage.llm_model_name,
-        LargeLanguageModel.realm_id == usage.realm_id
-    ).first()
+    values = price_llm_usage(db, usage, api_key_id, current_time)
 
-    if not llm:
-        raise HTTPException(
-            status_code=404, 
-            detail=f"Model {usage.llm_model_name} from provider {usage.provider_name} not found for this realm"
-        )
+    try:
+        # Handle account lookup/creation if external_id is provided
+        if usage.external_id:
+            values["account_id"] = get_or_create_account_id(db, usage.external_id, usage.realm_id)
 
-    # Get the current LLM cost for this model
-    llm_cost = db.query(LLMCost).filter(
-        LLMCost.llm_id == llm.id,
-        LLMCost.realm_id == usage.realm_id,
-        LLMCost.valid_from <= current_time,
-        (LLMCost.valid_to.is_(None) | (LLMCost.valid_to > current_time))
-    ).order_by(LLMCost.valid_from.desc()).first()
+        if usage.idempotency_key:
+            # When the key was already used (by an earlier or a concurrent request) nothing
+            # is inserted and the original usage is returned
+            new_usage = db.scalars(_insert_usage_statement().values(**values).returning(Usage)).first()
+            inserted = new_usage is not None
+            if new_usage is None:
+                metrics.increment("usage.idempotent_replays")
+                new_usage = db.query(Usage).filter(
+                    Usage.realm_id == usage.realm_id,
+                    Usage.idempotency_key == usage.idempotency_key
+                ).one()
+        else:
+            # Create new usage record
+            new_usage = Usage(**values)
+            db.add(new_usage)
+            inserted = True
 
-    if not llm_cost:
+        db.commit()
+        db.refresh(new_usage)
+        if usage.external_id:
+            remember_accounts(usage.realm_id, {usage.external_id: values["account_id"]})
+        if usage.idempotency_key:
+            remember_idempotent_usage(usage.realm_id, usage.idempotency_key, _usage_json(new_usage))
+        if inserted:
+            _emit_tracked([_usage_row(new_usage)])
+        return new_usage
+    except Exception as e:
+        db.rollback()
         raise HTTPException(
-            status_code=404, 
-            detail=f"No active cost configuration found for {usage.llm_model_name} from {usage.provider_name}"
+            status_code=500,
+            detail=f"An error occurred while tracking usage: {str(e)}"
         )
 
-    # Get realm configuration
-    realm = db.query(Realm).filter(Realm.id == usage.realm_id).first()
-    if not realm:
-        raise HTTPException(status_code=404, detail="Realm not found")
+async def price_llm_usage_async(db: AsyncSession, usage: UsageCreate, api_key_id: UUID, current_time: datetime) -> dict:
+    """price_llm_usage on an AsyncSession: the queries run without blocking the event loop"""
+    return await db.run_sync(price_llm_usage, usage, api_key_id, current_time)
+
+async def track_llm_usage_async(db: AsyncSession, usage: UsageCreate, api_key_id: UUID) -> Usage:
+    """track_llm_usage on an AsyncSession: the queries run without blocking the event loop"""
+    return await db.run_sync(track_llm_usage, usage, api_key_id)
+
+def track_llm_usage_batch(db: Session, usages: List[UsageCreate], api_key_id: UUID, realm_id: str) -> List[dict]:
+    """
+    Track many usage events of a realm in a single transaction.
+    Pricing is resolved once per (provider, model), accounts are upserted in bulk and
+    all Usage rows are written with one multi-row INSERT.
+    Events whose idempotency key was already used return the original usage.
+    Returns one result per event, in the same order as the input.
+    """
+    current_time = datetime.now(timezone.utc)
 
-    # Handle account lookup/creation if external_id is provided
-    account_id = None
-    if usage.external_id:
-        account = get_or_create_account(db, usage.external_id, usage.realm_id)
-        account_id = account.id
+    pricings = {}
+    results: List[dict] = [None] * len(usages)
+    priced: List[Tuple[int, UsageCreate, PricingSnapshot]] = []
 
-    # Tokenize message if provided
-    if usage.message:
+    replays = _find_idempotent_usages(db, realm_id, [usage.idempotency_key for usage in usages if usage.idempotency_key])
+    # Repeated keys inside the batch get the result of their first event
+    first_index_by_key: Dict[str, int] = {}
+    repeated: List[Tuple[int, int]] = []
+
+    for index, usage in enumerate(usages):
+        usage.realm_id = realm_id
+        if usage.idempotency_key:
+            if usage.idempotency_key in replays:
+                results[index] = {"index": index, "status": "tracked", "usage": replays[usage.idempotency_key]}
+                continue
+            if usage.idempotency_key in first_index_by_key:
+                repeated.append((index, first_index_by_key[usage.idempotency_key]))
+                continue
+            first_index_by_key[usage.idempotency_key] = index
+
+        model_key = (usage.provider_name, usage.llm_model_name)
         try:
-            encoding = tiktoken.encoding_for_model(usage.llm_model_name)
-            tokens = encoding.encode(usage.message)
-            usage.input_tokens = len(tokens)
-            usage.output_tokens = 0
-        except Exception as e:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Error tokenizing message: {str(e)}"
-            )
+            # Resolve pricing once per (provider, model)
+            if model_key not in pricings:
+                try:
+                    pricings[model_key] = pricing_service.get_pricing_snapshot(
+                        db, realm_id, usage.provider_name, usage.llm_model_name, current_time
+                    )
+                except HTTPException as e:
+                    pricings[model_key] = e
+            if isinstance(pricings[model_key], HTTPException):
+                raise pricings[model_key]
 
-    # Calculate total tokens and base price
-    total_tokens = usage.input_tokens + usage.output_tokens
-    price_per_token = llm_cost.price_per_unit / 1000 if llm_cost.unit_type == "1K" else llm_cost.price_per_unit
-    total_model_price = total_tokens * price_per_token
+            tokenization_service.tokenize_usage(usage)
+            if usage.input_tokens is None or usage.output_tokens is None:
+                raise HTTPException(
+                    status_code=422,
+                    detail="input_tokens and output_tokens are required when message is not provided"
+                )
+        except HTTPException as e:
+            results[index] = {"index": index, "status": "error", "status_code": e.status_code, "detail": e.detail}
+            continue
 
-    # Determine overhead percentage
-    overhead_percentage = 0
-    if llm_cost.overhead:  # First check LLMCost overhead
-        overhead_percentage = llm_cost.overhead
-    elif realm.overhead_enabled:  # Then check realm overhead if enabled
-        overhead_percentage = get_current_overhead(db, usage.realm_id, current_time)
+        priced.append((index, usage, pricings[model_key]))
 
-    # Calculate final price with overhead
-    total_price = total_model_price * (1 + overhead_percentage)
-
-    # Create new usage record
-    new_usage = Usage(
-        account_id=account_id,
-        realm_id=usage.realm_id,
-        api_key_id=api_key_id,
-        llm_cost_id=llm_cost.id,
-        input_tokens=usage.input_tokens,
-        output_tokens=usage.output_tokens,
-        total_tokens=total_tokens,
-        total_model_price=total_model_price,
-        total_price=total_price,
-        created_at=current_time
-    )
+    if priced:
+        _insert_priced_usages(db, priced, api_key_id, realm_id, current_time, results)
 
-    db.add(new_usage)
+    for index, first_index in repeated:
+        results[index] = {**results[first_index], "index": index}
 
+    return results
+
+def _insert_priced_usages(
+    db: Session,
+    priced: List[Tuple[int, UsageCreate, PricingSnapshot]],
+    api_key_id: UUID,
+    realm_id: str,
+    current_time: datetime,
+    results: List[dict]
+) -> None:
+    """Write the priced events of a batch in one transaction and fill in their results"""
     try:
+        account_ids = get_or_create_accounts(
+            db, {usage.external_id for _, usage, _ in priced if usage.external_id}, realm_id
+        )
+
+        rows = [
+            build_usage_values(
+                usage,
+                pricing,
+                api_key_id,
+                account_ids.get(usage.external_id) if usage.external_id else None,
+                current_time
+            )
+            for _, usage, pricing in priced
+        ]
+
+        # Keys were checked above: a key taken concurrently fails the batch, and its retry replays
+        new_usages = db.scalars(
+            insert(Usage).returning(Usage, sort_by_parameter_order=True),
+            rows
+        ).all()
         db.commit()
-        db.refresh(new_usage)
-        return new_usage
     except Exception as e:
         db.rollback()
         raise HTTPException(
-            status_code=500, 
+            status_code=500,
             detail=f"An error occurred while tracking usage: {str(e)}"
         )
+
+    remember_accounts(realm_id, account_ids)
+
+    for (index, usage, _), new_usage in zip(priced, new_usages):
+        results[index] = {"index": index, "status": "tracked", "usage": new_usage}
+        if usage.idempotency_key:
+            remember_idempotent_usage(realm_id, usage.idempotency_key, _usage_json(new_usage))
+    _emit_tracked([_usage_row(new_usage) for new_usage in new_usages])
+
+async def track_llm_usage_batch_async(db: AsyncSession, usages: List[UsageCreate], api_key_id: UUID, realm_id: str) -> List[dict]:
+    """track_llm_usage_batch on an AsyncSession: the queries run without blocking the event loop"""
+    return await db.run_sync(track_llm_usage_batch, usages, api_key_id, realm_id)
+
+def insert_usage_events(db: Session, usage_events: List[dict]) -> None:
+    """
+    Write already priced usage events (see price_llm_usage) with one multi-row INSERT.
+    Each event may carry an `external_id`, resolved to an account in bulk per realm.
+    Events whose idempotency key is already taken are skipped.
+    """
+    external_ids_by_realm: Dict[str, set] = {}
+    for event in usage_events:
+        if event.get("external_id"):
+            external_ids_by_realm.setdefault(event["realm_id"], set()).add(event["external_id"])
+
+    try:
+        account_ids = {
+            (realm_id, external_id): account_id
+            for realm_id, external_ids in external_ids_by_realm.items()
+            for external_id, account_id in get_or_create_accounts(db, external_ids, realm_id).items()
+        }
+
+        rows = []
+        for event in usage_events:
+            row = {key: value for key, value in event.items() if key != "external_id"}
+            if event.get("external_id"):
+                row["account_id"] = account_ids[(event["realm_id"], event["external_id"])]
+            rows.append(row)
+
+        inserted = db.execute(
+            _insert_usage_statement().returning(*Usage.__table__.columns),
+            rows
+        ).mappings().all()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    for (realm_id, external_id), account_id in account_ids.items():
+        remember_accounts(realm_id, {external_id: account_id})
+    for row in inserted:
+        if row["idempotency_key"]:
+            remember_idempotent_usage(
+                row["realm_id"], row["idempotency_key"], UsageResponse.model_validate(dict(row)).model_dump(mode="json")
+            )
+    _emit_tracked([dict(row) for row in inserted])
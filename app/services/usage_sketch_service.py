@@ -0,0 +1,223 @@
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from app.models.usage import Usage
+from app.models.llm_cost import LLMCost
+from app.models.usage_sketch import UsageSketch
+from app.core.config import settings
+from app.core.periodic import PeriodicTask
+from app.core.sketches import DDSketch, HyperLogLog, SpaceSaving
+from app.core import events, metrics
+from app.db.database import SessionLocal
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from uuid import UUID
+import threading
+
+class SketchKind(NamedTuple):
+    sketch_class: type
+    # Whether the sketch is kept per llm, or once for the whole realm
+    per_llm: bool
+    # Builds the sketch of a batch of usage rows (dicts of Usage columns)
+    build: Callable[[List[dict]], object]
+
+def _weights(rows: List[dict], key: str, weight: Optional[str]) -> Dict[UUID, float]:
+    weights: Dict[UUID, float] = {}
+    for row in rows:
+        if row[key] is not None:
+            weights[row[key]] = weights.get(row[key], 0.0) + (float(row[weight] or 0) if weight else 1.0)
+    return weights
+
+def _top(key: str, weight: Optional[str]) -> Callable[[List[dict]], SpaceSaving]:
+    def build(rows: List[dict]) -> SpaceSaving:
+        # The total includes the rows without key (usage without account...), as the exact KPIs do
+        total = sum(float(row[weight] or 0) for row in rows) if weight else float(len(rows))
+        return SpaceSaving.from_counts(settings.USAGE_SKETCH_TOP_CAPACITY, _weights(rows, key, weight), total)
+    return build
+
+def _active_accounts(rows: List[dict]) -> HyperLogLog:
+    sketch = HyperLogLog(settings.USAGE_SKETCH_HLL_PRECISION)
+    for account_id in {row["account_id"] for row in rows if row["account_id"] is not None}:
+        sketch.add(account_id)
+    return sketch
+
+def _distribution(column: str) -> Callable[[List[dict]], DDSketch]:
+    def build(rows: List[dict]) -> DDSketch:
+        sketch = DDSketch(settings.USAGE_SKETCH_RELATIVE_ACCURACY, settings.USAGE_SKETCH_MAX_BINS)
+        for row in rows:
+            sketch.add(float(row[column] or 0))
+        return sketch
+    return build
+
+TOP_DIMENSIONS = {"accounts": "account_id", "api_keys": "api_key_id"}
+TOP_MEASURES = {"events": None, "tokens": "total_tokens", "cost": "total_price"}
+
+# name -> SketchKind, every sketch maintained for every tracked usage row
+SKETCHES: Dict[str, SketchKind] = {
+    f"top_{dimension}:{measure}": SketchKind(SpaceSaving, False, _top(key, weight))
+    for dimension, key in TOP_DIMENSIONS.items()
+    for measure, weight in TOP_MEASURES.items()
+}
+# Realm-wide as well as per llm: a realm's count merges one register set per day instead of one per day and llm
+SKETCHES["active_accounts"] = SketchKind(HyperLogLog, False, _active_accounts)
+SKETCHES["active_accounts:llm"] = SketchKind(HyperLogLog, True, _active_accounts)
+
+DISTRIBUTION_METRICS = {"input_tokens": "input_tokens", "output_tokens": "output_tokens", "cost": "total_price"}
+for metric, column in DISTRIBUTION_METRICS.items():
+    SKETCHES[f"distribution:{metric}:llm"] = SketchKind(DDSketch, True, _distribution(column))
+
+_pending: List[dict] = []
+_pending_lock = threading.Lock()
+
+def _on_usage_tracked(rows: List[dict]) -> None:
+    if not settings.USAGE_SKETCHES_ENABLED:
+        return
+    with _pending_lock:
+        if len(_pending) + len(rows) > settings.USAGE_SKETCH_MAX_PENDING:
+            # The database is not keeping up: the sketches undercount rather than exhaust memory
+            metrics.increment("usage_sketches.dropped", len(rows))
+            return
+        _pending.extend(rows)
+
+events.subscribe("usage_tracked", _on_usage_tracked)
+
+def _day(created_at: datetime) -> date:
+    # UTC days, as date(created_at) of the rollup and the KPIs: sessions run in UTC (see app.db.database)
+    return created_at.astimezone(timezone.utc).date()
+
+def build_sketches(db: Session, rows: List[dict]) -> Dict[tuple, object]:
+    """Sketches of a batch of usage rows per (realm_id, day, llm_id, name), llm_id None for realm-wide ones"""
+    cost_ids = {row["llm_cost_id"] for row in rows}
+    llm_ids = dict(db.query(LLMCost.id, LLMCost.llm_id).filter(LLMCost.id.in_(cost_ids)).all()) if cost_ids else {}
+
+    groups: Dict[tuple, List[dict]] = {}
+    for row in rows:
+        realm_day = (str(row["realm_id"]), _day(row["created_at"]))
+        groups.setdefault(realm_day + (None,), []).append(row)
+        llm_id = llm_ids.get(row["llm_cost_id"])
+        if llm_id is not None:
+            groups.setdefault(realm_day + (llm_id,), []).append(row)
+
+    sketches = {}
+    for (realm_id, day, llm_id), group in groups.items():
+        for name, kind in SKETCHES.items():
+            if kind.per_llm == (llm_id is not None):
+                sketches[(realm_id, day, llm_id, name)] = kind.build(group)
+    return sketches
+
+def merge_into_db(db: Session, sketches: Dict[tuple, object]) -> None:
+    """Merge sketches into the stored ones; the caller commits"""
+    # Same lock order in every worker
+    for realm_id, day, llm_id, name in sorted(sketches, key=str):
+        sketch = sketches[(realm_id, day, llm_id, name)]
+        inserted = db.execute(
+            pg_insert(UsageSketch).values(
+                realm_id=realm_id, day=day, llm_id=llm_id, name=name, data=sketch.to_bytes()
+            ).on_conflict_do_nothing()
+        ).rowcount
+        if inserted:
+            continue
+
+        stored = db.query(UsageSketch).filter(
+            UsageSketch.realm_id == realm_id,
+            UsageSketch.name == name,
+            UsageSketch.day == day,
+            UsageSketch.llm_id == llm_id
+        ).with_for_update().one()
+        stored.data = SKETCHES[name].sketch_class.from_bytes(stored.data).merge(sketch).to_bytes()
+
+def flush_sketches() -> None:
+    """Merge the usage tracked by this worker since the last flush into the stored sketches"""
+    global _pending
+    with _pending_lock:
+        rows, _pending = _pending, []
+    if not rows:
+        return
+
+    db = SessionLocal()
+    try:
+        merge_into_db(db, build_sketches(db, rows))
+        db.commit()
+        metrics.increment("usage_sketches.rows", len(rows))
+    except Exception:
+        db.rollback()
+        with _pending_lock:
+            _pending = rows + _pending
+        raise
+    finally:
+        db.close()
+
+def rebuild_sketches(db: Session, realm_id: str, start_date: date, end_date: date, batch_size: int = 50000) -> None:
+    """Recompute the sketches of a realm's days from the usage rows, e.g. after an import"""
+    db.query(UsageSketch).filter(
+        UsageSketch.realm_id == realm_id,
+        UsageSketch.day >= start_date,
+        UsageSketch.day <= end_date
+    ).delete(synchronize_session=False)
+
+    start = datetime.combine(start_date, datetime.min.time(), timezone.utc)
+    end = datetime.combine(end_date + timedelta(days=1), datetime.min.time(), timezone.utc)
+    usages = db.query(*Usage.__table__.columns).filter(
+        Usage.realm_id == realm_id,
+        Usage.created_at >= start,
+        Usage.created_at < end
+    ).execution_options(yield_per=batch_size)
+
+    batch = []
+    for usage in usages:
+        batch.append(usage._asdict())
+        if len(batch) >= batch_size:
+            merge_into_db(db, build_sketches(db, batch))
+            batch = []
+    if batch:
+        merge_into_db(db, build_sketches(db, batch))
+    db.commit()
+
+def get_sketches(db: Session, realm_id: str, name: str, start_date: date, end_date: date) -> List[Tuple[date, Optional[UUID], object]]:
+    """Stored sketches of a range as (day, llm_id, sketch)"""
+    rows = db.query(UsageSketch.day, UsageSketch.llm_id, UsageSketch.data).filter(
+        UsageSketch.realm_id == realm_id,
+        UsageSketch.name == name,
+        UsageSketch.day >= start_date,
+        UsageSketch.day <= end_date
+    ).all()
+    sketch_class = SKETCHES[name].sketch_class
+    return [(day, llm_id, sketch_class.from_bytes(data)) for day, llm_id, data in rows]
+
+def get_merged_sketch(
+    db: Session,
+    realm_id: str,
+    name: str,
+    start_date: date,
+    end_date: date,
+    llm_ids: Optional[Iterable[UUID]] = None
+):
+    """
+    Merge of the stored sketches of a range: the realm-wide sketch, or for per-llm sketches
+    one merge for all the given llms (every llm when llm_ids is None). None when nothing is stored.
+    """
+    query = db.query(UsageSketch.data).filter(
+        UsageSketch.realm_id == realm_id,
+        UsageSketch.name == name,
+        UsageSketch.day >= start_date,
+        UsageSketch.day <= end_date
+    )
+    if llm_ids is not None:
+        query = query.filter(UsageSketch.llm_id.in_(list(llm_ids)))
+
+    kind = SKETCHES[name]
+    merged = None
+    for (data,) in query:
+        sketch = kind.sketch_class.from_bytes(data)
+        merged = sketch if merged is None else merged.merge(sketch)
+    return merged
+
+flush_task = PeriodicTask(name="usage_sketches", func=flush_sketches, interval=settings.USAGE_SKETCH_FLUSH_INTERVAL)
+
+async def start() -> None:
+    if settings.USAGE_SKETCHES_ENABLED:
+        await flush_task.start()
+
+async def stop() -> None:
+    await flush_task.stop()
+    # What was tracked since the last run
+    await flush_task.run_once()
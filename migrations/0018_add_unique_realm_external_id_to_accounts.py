@@ -0,0 +1,50 @@
+from yoyo import step
+
+__depends__ = {'0017_create_api_logs_table'}
+
+steps = [
+    step("""
+        -- Move the usage of duplicated accounts to the oldest account with the same external_id
+        WITH ranked AS (
+            SELECT
+                id,
+                first_value(id) OVER (
+                    PARTITION BY realm_id, external_id
+                    ORDER BY created_at, id
+                ) AS keep_id
+            FROM accounts
+        )
+        UPDATE usage
+        SET account_id = ranked.keep_id
+        FROM ranked
+        WHERE usage.account_id = ranked.id
+        AND ranked.id <> ranked.keep_id;
+
+        -- Remove the duplicated accounts
+        WITH ranked AS (
+            SELECT
+                id,
+                first_value(id) OVER (
+                    PARTITION BY realm_id, external_id
+                    ORDER BY created_at, id
+                ) AS keep_id
+            FROM accounts
+        )
+        DELETE FROM accounts
+        USING ranked
+        WHERE accounts.id = ranked.id
+        AND ranked.id <> ranked.keep_id;
+
+        ALTER TABLE accounts
+        ADD CONSTRAINT uix_accounts_realm_external_id UNIQUE (realm_id, external_id);
+
+        -- Covered by the unique index
+        DROP INDEX idx_accounts_realm_id;
+    """,
+    """
+        CREATE INDEX idx_accounts_realm_id ON accounts(realm_id);
+
+        ALTER TABLE accounts
+        DROP CONSTRAINT uix_accounts_realm_external_id;
+    """)
+]
@@ -0,0 +1,18 @@
+from yoyo import step
+
+__depends__ = {'0018_add_unique_realm_external_id_to_accounts'}
+
+steps = [
+    step("""
+        ALTER TABLE realms
+        ADD COLUMN log_sample_rate FLOAT NOT NULL DEFAULT 1.0,
+        ADD COLUMN log_error_sample_rate FLOAT NOT NULL DEFAULT 1.0,
+        ADD COLUMN log_max_body_size INTEGER NOT NULL DEFAULT 16384;
+    """,
+    """
+        ALTER TABLE realms
+        DROP COLUMN log_sample_rate,
+        DROP COLUMN log_error_sample_rate,
+        DROP COLUMN log_max_body_size;
+    """)
+]
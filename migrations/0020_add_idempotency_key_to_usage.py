@@ -0,0 +1,21 @@
+from yoyo import step
+
+__depends__ = {'0019_add_api_log_settings_to_realm'}
+
+steps = [
+    step("""
+        ALTER TABLE usage
+        ADD COLUMN idempotency_key VARCHAR(255);
+
+        -- Only keys still inside the retention window are set, which keeps the index small
+        CREATE UNIQUE INDEX uix_usage_realm_idempotency_key
+        ON usage(realm_id, idempotency_key)
+        WHERE idempotency_key IS NOT NULL;
+    """,
+    """
+        DROP INDEX uix_usage_realm_idempotency_key;
+
+        ALTER TABLE usage
+        DROP COLUMN idempotency_key;
+    """)
+]
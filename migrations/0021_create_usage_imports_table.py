@@ -0,0 +1,28 @@
+from yoyo import step
+
+__depends__ = {'0020_add_idempotency_key_to_usage'}
+
+steps = [
+    step("""
+        CREATE TABLE usage_imports (
+            id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+            realm_id CHAR(24) NOT NULL,
+            source VARCHAR(1024) NOT NULL,
+            format VARCHAR(10) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            rows_read BIGINT NOT NULL DEFAULT 0,
+            rows_imported BIGINT NOT NULL DEFAULT 0,
+            rows_skipped BIGINT NOT NULL DEFAULT 0,
+            rows_rejected BIGINT NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (realm_id) REFERENCES realms(id) ON DELETE CASCADE
+        );
+
+        CREATE INDEX idx_usage_imports_realm_id ON usage_imports(realm_id);
+    """,
+    """
+        DROP TABLE usage_imports;
+    """)
+]
@@ -0,0 +1,50 @@
+from yoyo import step
+
+__depends__ = {'0021_create_usage_imports_table'}
+
+steps = [
+    step("""
+        CREATE TABLE usage_daily_rollup (
+            id BIGSERIAL PRIMARY KEY,
+            realm_id CHAR(24) NOT NULL,
+            day DATE NOT NULL,
+            llm_id UUID NOT NULL,
+            -- No foreign keys: rows of deleted accounts and API keys are filtered out by the KPI joins
+            account_id UUID,
+            api_key_id UUID,
+            events BIGINT NOT NULL,
+            input_tokens BIGINT NOT NULL,
+            output_tokens BIGINT NOT NULL,
+            total_tokens BIGINT NOT NULL,
+            total_model_price DOUBLE PRECISION NOT NULL,
+            total_price DOUBLE PRECISION NOT NULL,
+            FOREIGN KEY (realm_id) REFERENCES realms(id) ON DELETE CASCADE,
+            FOREIGN KEY (llm_id) REFERENCES large_language_models(id) ON DELETE CASCADE
+        );
+
+        -- Upsert target of the catch-up job, also serves the (realm_id, day) range scans of the KPIs
+        CREATE UNIQUE INDEX uix_usage_daily_rollup_key ON usage_daily_rollup (
+            realm_id,
+            day,
+            llm_id,
+            COALESCE(account_id, '00000000-0000-0000-0000-000000000000'::uuid),
+            COALESCE(api_key_id, '00000000-0000-0000-0000-000000000000'::uuid)
+        );
+
+        -- High-water mark: usage rows with id <= last_usage_id are in the rollup.
+        -- pending_usage_id is the next mark, rolled up once pending_at is old enough
+        -- for every transaction holding a lower id to have committed.
+        CREATE TABLE usage_rollup_state (
+            id SMALLINT PRIMARY KEY,
+            last_usage_id BIGINT NOT NULL DEFAULT 0,
+            pending_usage_id BIGINT NOT NULL DEFAULT 0,
+            pending_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+
+        INSERT INTO usage_rollup_state (id) VALUES (1);
+    """,
+    """
+        DROP TABLE usage_rollup_state;
+        DROP TABLE usage_daily_rollup;
+    """)
+]
@@ -0,0 +1,28 @@
+from yoyo import step
+
+__depends__ = {'0022_create_usage_daily_rollup_table'}
+
+# CREATE INDEX CONCURRENTLY cannot run in a transaction: one statement per step
+__transactional__ = False
+
+steps = [
+    # Range scans of a realm (KPIs, rollup tail): every column they read is in the index,
+    # so they can be served by index-only scans
+    step(
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_usage_realm_created_at ON usage (realm_id, created_at)
+        INCLUDE (id, llm_cost_id, account_id, api_key_id, input_tokens, output_tokens, total_tokens, total_model_price, total_price)
+        """,
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_usage_realm_created_at"
+    ),
+    # KPIs filtered on an account
+    step(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_usage_realm_account_created_at ON usage (realm_id, account_id, created_at)",
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_usage_realm_account_created_at"
+    ),
+    # Covered by the two indexes above
+    step(
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_usage_realm_id",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_usage_realm_id ON usage(realm_id)"
+    )
+]
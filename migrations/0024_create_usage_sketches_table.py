@@ -0,0 +1,31 @@
+from yoyo import step
+
+__depends__ = {'0023_add_covering_indexes_to_usage'}
+
+steps = [
+    step("""
+        CREATE TABLE usage_sketches (
+            id BIGSERIAL PRIMARY KEY,
+            realm_id CHAR(24) NOT NULL,
+            day DATE NOT NULL,
+            -- NULL for the sketches of the whole realm
+            llm_id UUID,
+            name VARCHAR(64) NOT NULL,
+            data BYTEA NOT NULL,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (realm_id) REFERENCES realms(id) ON DELETE CASCADE,
+            FOREIGN KEY (llm_id) REFERENCES large_language_models(id) ON DELETE CASCADE
+        );
+
+        -- Merge target of the flushes, also serves the (realm_id, name, day) range reads
+        CREATE UNIQUE INDEX uix_usage_sketches_key ON usage_sketches (
+            realm_id,
+            name,
+            day,
+            COALESCE(llm_id, '00000000-0000-0000-0000-000000000000'::uuid)
+        );
+    """,
+    """
+        DROP TABLE usage_sketches;
+    """)
+]
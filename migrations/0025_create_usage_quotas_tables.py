@@ -0,0 +1,42 @@
+from yoyo import step
+
+__depends__ = {'0024_create_usage_sketches_table'}
+
+steps = [
+    step("""
+        CREATE TABLE usage_quotas (
+            id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+            realm_id CHAR(24) NOT NULL,
+            -- A quota applies to one account, to the accounts of a tier, or to every account when both are NULL
+            account_id UUID,
+            tier VARCHAR(255),
+            metric VARCHAR(20) NOT NULL,
+            period VARCHAR(20) NOT NULL,
+            amount DOUBLE PRECISION NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (realm_id) REFERENCES realms(id) ON DELETE CASCADE,
+            FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE,
+            CHECK (account_id IS NULL OR tier IS NULL)
+        );
+
+        CREATE INDEX idx_usage_quotas_realm_id ON usage_quotas(realm_id);
+
+        -- Sliding-window counters of the long periods, so loading one does not sum a month of usage
+        CREATE TABLE usage_quota_counters (
+            account_id UUID NOT NULL,
+            period VARCHAR(20) NOT NULL,
+            realm_id CHAR(24) NOT NULL,
+            -- Usage created up to this time is in the buckets
+            checkpointed_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            data BYTEA NOT NULL,
+            PRIMARY KEY (account_id, period),
+            FOREIGN KEY (realm_id) REFERENCES realms(id) ON DELETE CASCADE,
+            FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+        );
+    """,
+    """
+        DROP TABLE usage_quota_counters;
+        DROP TABLE usage_quotas;
+    """)
+]
@@ -0,0 +1,32 @@
+from yoyo import step
+
+__depends__ = {'0025_create_usage_quotas_tables'}
+
+steps = [
+    step("""
+        CREATE TABLE alert_rules (
+            id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+            realm_id CHAR(24) NOT NULL,
+            -- NULL for the spend of the whole realm
+            account_id UUID,
+            -- percentage of the bill limit, or amount of spend
+            threshold_type VARCHAR(20) NOT NULL,
+            threshold DOUBLE PRECISION NOT NULL,
+            webhook_url VARCHAR(2048) NOT NULL,
+            enabled BOOLEAN NOT NULL DEFAULT TRUE,
+            -- Fired in the budget period starting at period_start, until re-armed
+            armed BOOLEAN NOT NULL DEFAULT TRUE,
+            period_start TIMESTAMP WITH TIME ZONE,
+            last_triggered_at TIMESTAMP WITH TIME ZONE,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (realm_id) REFERENCES realms(id) ON DELETE CASCADE,
+            FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+        );
+
+        CREATE INDEX idx_alert_rules_realm_id ON alert_rules(realm_id);
+    """,
+    """
+        DROP TABLE alert_rules;
+    """)
+]
@@ -0,0 +1,18 @@
+from yoyo import step
+
+__depends__ = {'0026_create_alert_rules_table'}
+
+# Application sessions now run in UTC. A rollup built in another server time zone has other
+# day boundaries: empty it, the catch-up job rebuilds it (the KPIs read the raw usage meanwhile).
+steps = [
+    step("""
+        DO $$
+        BEGIN
+            IF current_setting('TimeZone') NOT IN ('UTC', 'Etc/UTC', 'GMT') THEN
+                TRUNCATE usage_daily_rollup;
+                UPDATE usage_rollup_state SET last_usage_id = 0, pending_usage_id = 0;
+            END IF;
+        END
+        $$;
+    """)
+]
@@ -0,0 +1,52 @@
+import asyncio
+import json
+import httpx
+import pytest
+from app.core.config import settings
+from app.services import alert_service
+
+@pytest.fixture
+def posts(monkeypatch):
+    posts = []
+
+    def handler(request):
+        posts.append((str(request.url), len(json.loads(request.content)["alerts"])))
+        return httpx.Response(503 if "down" in str(request.url) else 200)
+
+    transport = httpx.MockTransport(handler)
+    async_client = httpx.AsyncClient
+    monkeypatch.setattr(alert_service.httpx, "AsyncClient", lambda **kwargs: async_client(transport=transport, **kwargs))
+    monkeypatch.setattr(alert_service, "_outbox", {})
+    monkeypatch.setattr(settings, "ALERT_MAX_RETRIES", 3)
+    monkeypatch.setattr(settings, "ALERT_RETRY_BACKOFF", 0.05)
+    return posts
+
+def _notification(webhook_url, rule_id="rule"):
+    return {"webhook_url": webhook_url, "alert": {"rule_id": rule_id}}
+
+def test_failing_webhook_backs_off_alone(posts):
+    for rule_id in ("a", "b"):
+        alert_service.queue_notification(_notification("http://up.test/hook", rule_id))
+        alert_service.queue_notification(_notification("http://down.test/hook", rule_id))
+
+    asyncio.run(alert_service.deliver())
+    assert sorted(posts) == [("http://down.test/hook", 2), ("http://up.test/hook", 2)]
+    assert list(alert_service._outbox) == ["http://down.test/hook"]
+
+    # Backing off: not posted again right away
+    asyncio.run(alert_service.deliver())
+    assert len(posts) == 2
+
+def test_alerts_dropped_after_max_retries(posts):
+    alert_service.queue_notification(_notification("http://down.test/hook"))
+
+    async def run():
+        for _ in range(10):
+            await alert_service.deliver()
+            if not alert_service._outbox:
+                return
+            await asyncio.sleep(0.12)
+
+    asyncio.run(run())
+    assert len(posts) == 3
+    assert alert_service._outbox == {}
@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from app.core import batch_writer
+from app.core.batch_writer import BatchWriter
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(batch_writer, "_MAX_BACKOFF", 0.01)
+
+def _write(items, bad, down_rounds=0, **options):
+    written, dead, calls = [], [], []
+
+    def flush(batch):
+        calls.append(len(batch))
+        if len(calls) <= down_rounds:
+            raise ConnectionError("database is down")
+        if any(item in bad for item in batch):
+            raise ValueError("bad item")
+        written.extend(batch)
+
+    async def run():
+        writer = BatchWriter(
+            name="test_writer", flush_func=flush, max_queue_size=100, batch_size=100,
+            flush_interval=0.01, max_retries=1, dead_letter_func=dead.append, **options
+        )
+        await writer.start()
+        for item in items:
+            writer.put_nowait(item)
+        # Before stop(), which drops what cannot be flushed
+        await asyncio.sleep(0.2)
+        await writer.stop()
+
+    asyncio.run(run())
+    return written, dead, calls
+
+def test_flushes_batch():
+    written, dead, _ = _write(range(10), bad=set())
+    assert sorted(written) == list(range(10))
+    assert dead == []
+
+def test_isolates_failing_items():
+    written, dead, _ = _write(range(37), bad={3, 4, 30}, item_errors=(ValueError,))
+    assert sorted(written) == [item for item in range(37) if item not in {3, 4, 30}]
+    assert sorted(item for batch in dead for item in batch) == [3, 4, 30]
+
+def test_drops_batch_on_other_errors():
+    written, dead, calls = _write(range(10), bad=set(), down_rounds=1, item_errors=(ValueError,))
+    assert written == []
+    assert dead == [list(range(10))]
+    assert calls == [10]
+
+def test_keeps_batch_while_destination_is_down():
+    written, dead, calls = _write(range(10), bad={7}, down_rounds=3, item_errors=(ValueError,), retry_forever=True)
+    assert sorted(written) == [item for item in range(10) if item != 7]
+    assert dead == [[7]]
+    # Not bisected while the destination is down
+    assert calls[:4] == [10, 10, 10, 10]
+
+def test_keeps_retried_batch_mutations():
+    delivered, dead = [], []
+
+    def deliver(batch):
+        # A flush that keeps only what failed in the batch, then raises
+        delivered.extend(item for item in batch if item != "down")
+        batch[:] = [item for item in batch if item == "down"]
+        if batch:
+            raise ValueError("not delivered")
+
+    async def run():
+        writer = BatchWriter(
+            name="test_delivery", flush_func=deliver, max_queue_size=10, batch_size=10,
+            flush_interval=0.01, max_retries=2, dead_letter_func=dead.extend
+        )
+        await writer.start()
+        for item in ("a", "down", "b"):
+            writer.put_nowait(item)
+        await writer.stop()
+
+    asyncio.run(run())
+    assert sorted(delivered) == ["a", "b"]
+    assert dead == ["down"]
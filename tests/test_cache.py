@@ -0,0 +1,47 @@
+import pytest
+from app.core import cache
+from app.core.cache import TTLCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    return now
+
+def test_expires_entries(clock):
+    entries = TTLCache(max_size=10, ttl=60)
+    entries.set("a", 1)
+    entries.set("b", 2, ttl=10)
+    clock[0] += 30
+    assert entries.get("a") == 1
+    assert entries.get("b") is None
+    assert entries.keys() == ["a"]
+    clock[0] += 30
+    assert entries.get("a", "missing") == "missing"
+    assert (entries.hits, entries.misses) == (1, 2)
+
+def test_ttl_is_capped(clock):
+    entries = TTLCache(max_size=10, ttl=60)
+    entries.set("a", 1, ttl=3600)
+    entries.set("b", 2, ttl=0)
+    clock[0] += 61
+    assert entries.get("a") is None
+    assert len(entries) == 0
+
+def test_evicts_least_recently_used(clock):
+    entries = TTLCache(max_size=2, ttl=60)
+    entries.set("a", 1)
+    entries.set("b", 2)
+    entries.get("a")
+    entries.set("c", 3)
+    assert entries.keys() == ["a", "c"]
+
+def test_delete_where(clock):
+    entries = TTLCache(max_size=10, ttl=60)
+    for key in [("realm", None), ("realm", "account"), ("other", None)]:
+        entries.set(key, 0)
+    entries.delete_where(lambda key: key[0] == "realm")
+    assert entries.keys() == [("other", None)]
+    entries.delete(("other", None))
+    entries.delete(("missing", None))
+    assert len(entries) == 0
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.api.v1.kpi import router
+from app.api.deps import check_realm_access, get_current_user
+from app.db.database import get_db
+from app.services import kpi_service
+import pytest
+
+@pytest.fixture
+def client(monkeypatch):
+    calls = []
+
+    def get_kpi_distribution(db, realm_id, metric, start_date, end_date, percentiles, buckets, provider_name, model_name):
+        calls.append(percentiles)
+        return {"metric": metric, "percentiles": {str(p): None for p in percentiles}}
+
+    monkeypatch.setattr(kpi_service, "get_kpi_distribution", get_kpi_distribution)
+    app = FastAPI()
+    app.include_router(router, prefix="/realms/{realm_id}/usage")
+    app.dependency_overrides[get_db] = lambda: None
+    app.dependency_overrides[get_current_user] = lambda: {"id": "user"}
+    app.dependency_overrides[check_realm_access] = lambda: SimpleNamespace(id="realm")
+    client = TestClient(app)
+    client.calls = calls
+    return client
+
+URL = "/realms/realm/usage/distribution?start_date=2024-01-01&end_date=2024-01-31"
+
+def test_default_percentiles(client):
+    response = client.get(URL)
+    assert response.status_code == 200
+    assert client.calls == [[50, 90, 95, 99]]
+
+def test_given_percentiles(client):
+    response = client.get(URL + "&percentiles=25&percentiles=99.9")
+    assert response.status_code == 200
+    assert client.calls == [[25, 99.9]]
+
+@pytest.mark.parametrize("percentile", ["-1", "100.5"])
+def test_out_of_range_percentile(client, percentile):
+    response = client.get(URL + f"&percentiles={percentile}")
+    assert response.status_code == 422
+    assert client.calls == []
@@ -0,0 +1,38 @@
+from datetime import date
+from app.services.kpi_service import lttb, pick_granularity
+
+def test_lttb_keeps_short_series():
+    assert lttb([], 10) == []
+    assert lttb([1.0, 2.0, 3.0], 3) == [0, 1, 2]
+    assert lttb([1.0, 2.0, 3.0], 10) == [0, 1, 2]
+
+def test_lttb_small_thresholds():
+    values = [float(value) for value in range(10)]
+    assert lttb(values, 2) == [0, 9]
+    assert lttb(values, 1) == [9]
+    assert lttb(values, 0) == []
+
+def test_lttb_keeps_spikes():
+    values = [0.0] * 100
+    values[37] = 50.0
+    values[80] = -20.0
+    kept = lttb(values, 10)
+    assert len(kept) == 10
+    assert kept[0] == 0 and kept[-1] == 99
+    assert 37 in kept and 80 in kept
+
+def test_lttb_empty_buckets():
+    # Zero-filled buckets: every triangle is flat, one point is still kept per bucket
+    kept = lttb([0.0] * 50, 7)
+    assert len(kept) == 7
+    assert kept == sorted(set(kept))
+
+def test_pick_granularity():
+    day = date(2024, 3, 1)
+    assert pick_granularity(day, day, 24) == "hour"
+    assert pick_granularity(day, day, 23) == "day"
+    assert pick_granularity(date(2024, 1, 1), date(2024, 12, 31), 500) == "day"
+    assert pick_granularity(date(2024, 1, 1), date(2024, 12, 31), 100) == "week"
+    assert pick_granularity(date(2020, 1, 1), date(2024, 12, 31), 100) == "month"
+    # Months are the coarsest: a range with more months than points still gets them
+    assert pick_granularity(date(1990, 1, 1), date(2024, 12, 31), 10) == "month"
@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from app.api.v1.kpi import router
+from app.api.deps import check_live_usage_access, check_realm_access, get_current_user
+from app.db.database import get_db
+from app.services import user_service
+import pytest
+
+class FakeQuery:
+    def __init__(self, realm):
+        self.realm = realm
+
+    def filter(self, *criteria):
+        return self
+
+    def first(self):
+        return self.realm
+
+class FakeSession:
+    def __init__(self, realm=None):
+        self.realm = realm
+
+    def query(self, *entities):
+        return FakeQuery(self.realm)
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(router, prefix="/realms/{realm_id}/usage")
+    app.dependency_overrides[get_db] = lambda: FakeSession()
+    app.dependency_overrides[get_current_user] = lambda: {"id": "user"}
+    app.dependency_overrides[check_realm_access] = lambda: SimpleNamespace(id="realm")
+    return TestClient(app)
+
+def _stream_token(client, realm_id="realm"):
+    response = client.post(f"/realms/{realm_id}/usage/live/token")
+    assert response.status_code == 200
+    return response.json()["token"]
+
+def test_stream_token_opens_its_realm(client):
+    realm = SimpleNamespace(id="realm")
+    assert check_live_usage_access("realm", _stream_token(client), FakeSession(realm)) is realm
+
+def test_stream_token_of_another_realm(client):
+    with pytest.raises(HTTPException) as error:
+        check_live_usage_access("other", _stream_token(client), FakeSession(SimpleNamespace(id="other")))
+    assert error.value.status_code == 401
+
+def test_stream_requires_stream_token(client):
+    access_token = user_service.create_access_token({"sub": "user"})
+    assert client.get("/realms/realm/usage/live").status_code == 422
+    assert client.get(f"/realms/realm/usage/live?token={access_token}").status_code == 401
+    assert client.get("/realms/realm/usage/live?token=invalid").status_code == 401
+
+def test_stream_token_is_not_an_access_token(client):
+    credentials = SimpleNamespace(credentials=_stream_token(client))
+    with pytest.raises(HTTPException) as error:
+        get_current_user(credentials, FakeSession(SimpleNamespace(id="user", email="user@example.com")))
+    assert error.value.status_code == 401
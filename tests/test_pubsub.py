@@ -0,0 +1,23 @@
+import json
+from app.core import pubsub
+
+def test_publish_list_splits_messages(monkeypatch):
+    sent = []
+
+    def publish(channel, payload, local=True):
+        message = json.dumps({"sender": pubsub._sender_id, "channel": channel, "payload": payload})
+        sent.append((payload, len(message)))
+        return True
+
+    monkeypatch.setattr(pubsub, "publish", publish)
+    items = [["a" * 24, "b" * 36, [1.5, 2, "quoted \"name\""]] for _ in range(500)]
+    assert pubsub.publish_list("quota_usage", items, local=False)
+
+    assert len(sent) > 1
+    assert all(size <= pubsub.MAX_MESSAGE_SIZE for _, size in sent)
+    assert [item for payload, _ in sent for item in json.loads(payload)] == items
+
+def test_publish_list_reports_failures(monkeypatch):
+    monkeypatch.setattr(pubsub, "publish", lambda channel, payload, local=True: False)
+    assert not pubsub.publish_list("spend", [["realm", None, 1.0]])
+    assert pubsub.publish_list("spend", [])
@@ -0,0 +1,87 @@
+import pytest
+import random
+import uuid
+from app.core.sketches import DDSketch, HyperLogLog, SpaceSaving
+
+def test_space_saving_merge_bounds():
+    rng = random.Random(7)
+    keys = [uuid.UUID(int=index + 1) for index in range(200)]
+    exact = {key: 0.0 for key in keys}
+
+    merged = None
+    for _ in range(300):
+        counts = {}
+        for _ in range(20):
+            # Skewed keys, as the usage of a few heavy accounts
+            key = keys[min(int(rng.paretovariate(1.2)) - 1, len(keys) - 1)]
+            counts[key] = counts.get(key, 0.0) + 1
+            exact[key] += 1
+        sketch = SpaceSaving.from_counts(10, counts)
+        merged = sketch if merged is None else merged.merge(sketch)
+
+    top = merged.top(10)
+    assert [key for key, _, _ in top][:3] == sorted(exact, key=exact.get, reverse=True)[:3]
+    for key, lower_bound, upper_bound in top:
+        assert lower_bound <= exact[key] <= upper_bound <= merged.total
+    assert sum(lower_bound for _, lower_bound, _ in top) <= merged.total == sum(exact.values())
+    kept = {key for key, _, _ in top}
+    assert all(weight <= merged.missing for key, weight in exact.items() if key not in kept)
+
+def test_space_saving_round_trip():
+    sketch = SpaceSaving.from_counts(2, {uuid.UUID(int=1): 5.0, uuid.UUID(int=2): 3.0, uuid.UUID(int=3): 1.0}, total=10.0)
+    restored = SpaceSaving.from_bytes(sketch.to_bytes())
+    assert restored.top(5) == [(uuid.UUID(int=1), 5.0, 5.0), (uuid.UUID(int=2), 3.0, 3.0)]
+    assert (restored.capacity, restored.missing, restored.total) == (2, 1.0, 10.0)
+
+def test_hyperloglog_merge_and_round_trip():
+    first, second = HyperLogLog(12), HyperLogLog(12)
+    keys = [uuid.UUID(int=index) for index in range(20000)]
+    for key in keys[:12000]:
+        first.add(key)
+    for key in keys[8000:]:
+        second.add(key)
+
+    merged = first.merge(second)
+    assert abs(merged.count() - 20000) <= 20000 * merged.relative_error * 3
+    assert HyperLogLog.from_bytes(merged.to_bytes()).registers == merged.registers
+
+    small = HyperLogLog(12)
+    for key in keys[:10]:
+        small.add(key)
+    assert small.count() == 10
+    assert HyperLogLog(12).count() == 0
+
+    with pytest.raises(ValueError):
+        first.merge(HyperLogLog(10))
+
+def test_ddsketch_quantiles_within_accuracy():
+    rng = random.Random(3)
+    values = [rng.lognormvariate(6, 1.5) for _ in range(5000)] + [0.0] * 100
+    first, second = DDSketch(0.01, 2048), DDSketch(0.01, 2048)
+    for index, value in enumerate(values):
+        (first if index % 2 else second).add(value)
+
+    merged = DDSketch.from_bytes(first.merge(second).to_bytes())
+    assert merged.count == len(values)
+    assert merged.sum == pytest.approx(sum(values))
+    assert (merged.min, merged.max) == (0.0, max(values))
+    ranked = sorted(values)
+    for q in (0.01, 0.5, 0.9, 0.99):
+        exact = ranked[int(q * (len(ranked) - 1))]
+        assert merged.quantile(q) == pytest.approx(exact, rel=0.01)
+    assert sum(count for _, _, count in merged.histogram(10)) == len(values)
+
+def test_ddsketch_empty_and_collapsed():
+    empty = DDSketch.from_bytes(DDSketch(0.01, 16).to_bytes())
+    assert empty.quantile(0.5) is None
+    assert empty.histogram(10) == []
+
+    sketch = DDSketch(0.01, 16)
+    for value in range(1, 1001):
+        sketch.add(float(value))
+    assert len(sketch.bins) <= 16
+    # Collapsing merges the lowest bins: the high quantiles keep their accuracy
+    assert sketch.quantile(0.99) == pytest.approx(990, rel=0.01)
+
+    with pytest.raises(ValueError):
+        sketch.merge(DDSketch(0.05, 16))
@@ -0,0 +1,44 @@
+import pytest
+from app.core.sliding_window import SlidingWindowCounter
+
+def test_totals_cover_the_window():
+    counter = SlidingWindowCounter(window=60, buckets=6, measures=2)
+    counter.add(0, [1, 10])
+    counter.add(25, [2, 20])
+    counter.add(59, [3, 30])
+    assert counter.totals(59) == [6, 60]
+    # The bucket of t=0 leaves at 60, the one of t=25 at 80
+    assert counter.totals(60) == [5, 50]
+    assert counter.totals(80) == [3, 30]
+    assert counter.totals(200) == [0, 0]
+
+def test_resets_in():
+    counter = SlidingWindowCounter(window=60, buckets=6, measures=2)
+    counter.add(25, [1, 0])
+    counter.add(45, [1, 5])
+    assert counter.resets_in(50, 0) == 30
+    assert counter.resets_in(50, 1) == 50
+    assert counter.resets_in(200, 0) is None
+
+def test_prune():
+    counter = SlidingWindowCounter(window=60, buckets=6, measures=1)
+    counter.add(5, [1])
+    counter.add(65, [1])
+    counter.prune(65)
+    assert list(counter.buckets) == [6]
+
+def test_merge_and_round_trip():
+    first = SlidingWindowCounter(window=60, buckets=6, measures=2)
+    second = SlidingWindowCounter(window=60, buckets=6, measures=2)
+    first.add(10, [1, 2])
+    second.add(15, [3, 4])
+    second.add(30, [5, 6])
+    merged = first.merge(second)
+    assert merged.totals(30) == [9, 12]
+    assert first.totals(30) == [1, 2]
+
+    restored = SlidingWindowCounter.from_bytes(60, 6, 2, merged.to_bytes())
+    assert restored.buckets == merged.buckets
+
+    with pytest.raises(ValueError):
+        first.merge(SlidingWindowCounter(window=3600, buckets=6, measures=2))
@@ -0,0 +1,47 @@
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.api.v1.usage_import import router
+from app.api.deps import check_realm_access, get_current_user
+from app.core.config import settings
+from app.db.database import get_db
+from app.services import usage_import_service
+import pytest
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    def create_import(db, realm_id, source, format):
+        now = datetime.now(timezone.utc)
+        return SimpleNamespace(
+            id=uuid.uuid4(), realm_id=realm_id, source=source, format=format, status="pending", rows_read=0,
+            rows_imported=0, rows_skipped=0, rows_rejected=0, error=None, created_at=now, updated_at=now
+        )
+
+    monkeypatch.setattr(settings, "USAGE_IMPORT_DIR", str(tmp_path))
+    monkeypatch.setattr(usage_import_service, "create_import", create_import)
+    monkeypatch.setattr(usage_import_service, "run_import_in_background", lambda import_id: None)
+    app = FastAPI()
+    app.include_router(router, prefix="/realms/{realm_id}/usage-imports")
+    app.dependency_overrides[get_db] = lambda: None
+    app.dependency_overrides[get_current_user] = lambda: {"id": "user"}
+    app.dependency_overrides[check_realm_access] = lambda: SimpleNamespace(id="realm")
+    client = TestClient(app)
+    client.import_dir = tmp_path
+    return client
+
+def _upload(client, filename, query=""):
+    return client.post(f"/realms/realm/usage-imports/{query}", files={"file": (filename, b"created_at\n")})
+
+def test_import_is_created(client):
+    response = _upload(client, "usage.csv")
+    assert response.status_code == 202
+    assert response.json()["format"] == "csv"
+    # The path on the server is not exposed
+    assert "source" not in response.json()
+
+@pytest.mark.parametrize("filename, query", [("usage.csv", "?format=../x"), ("usage.xml", "")])
+def test_unknown_format_is_rejected_before_writing(client, filename, query):
+    assert _upload(client, filename, query).status_code == 422
+    assert list(client.import_dir.iterdir()) == []
@@ -0,0 +1,31 @@
+from app.services.usage_quota_service import QuotaRule, account_rules
+
+def _rule(id, account_id=None, tier=None, metric="tokens", period="day", amount=100.0):
+    return QuotaRule(id, account_id, tier, metric, period, amount)
+
+def _selected(rules, account_id, tier):
+    return sorted(rule.id for rule in account_rules(rules, account_id, tier))
+
+def test_most_specific_quota_wins():
+    rules = [
+        _rule("realm", amount=10),
+        _rule("tier", tier="pro", amount=1000),
+        _rule("account", account_id="a1", amount=5000)
+    ]
+    assert _selected(rules, "a1", "pro") == ["account"]
+    assert _selected(rules, "a2", "pro") == ["tier"]
+    assert _selected(rules, "a2", "") == ["realm"]
+    assert _selected(rules, "a2", "free") == ["realm"]
+
+def test_quotas_per_metric_and_period():
+    rules = [
+        _rule("realm_day"),
+        _rule("realm_hour", period="hour"),
+        _rule("tier_cost", tier="pro", metric="cost"),
+        _rule("account_day", account_id="a1")
+    ]
+    assert _selected(rules, "a1", "pro") == ["account_day", "realm_hour", "tier_cost"]
+
+def test_lowest_amount_on_ties():
+    rules = [_rule("high", tier="pro", amount=200), _rule("low", tier="pro", amount=50)]
+    assert _selected(rules, "a1", "pro") == ["low"]
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.api.v1.usage import router
+from app.api.deps import get_api_key
+from app.db.database import get_async_db
+from app.services import api_key_service, api_log_service, usage_ingest_service, usage_service
+import pytest
+
+REPLAYED_USAGE = {"id": 42, "realm_id": "realm", "idempotency_key": "retry-1"}
+
+@pytest.fixture
+def client(monkeypatch):
+    async def validate_api_key_async(db, api_key):
+        return SimpleNamespace(id="key", realm_id="realm")
+
+    async def log_api_request(**kwargs):
+        pass
+
+    monkeypatch.setattr(api_key_service, "validate_api_key_async", validate_api_key_async)
+    monkeypatch.setattr(api_log_service, "log_api_request", log_api_request)
+    monkeypatch.setattr(usage_ingest_service, "is_enabled", lambda: True)
+    monkeypatch.setattr(
+        usage_service, "get_idempotent_usage",
+        lambda realm_id, idempotency_key: REPLAYED_USAGE if idempotency_key == "retry-1" else None
+    )
+    app = FastAPI()
+    app.include_router(router, prefix="/usage")
+    app.dependency_overrides[get_async_db] = lambda: None
+    app.dependency_overrides[get_api_key] = lambda: "api-key"
+    return TestClient(app)
+
+def test_replay_is_not_queued_again(client):
+    response = client.post(
+        "/usage/track",
+        json={"provider_name": "openai", "llm_model_name": "gpt-4"},
+        headers={"Idempotency-Key": "retry-1"}
+    )
+    # Already tracked: 200 even in async mode, where new usage is answered with 202
+    assert response.status_code == 200
+    assert response.json()["usage"] == REPLAYED_USAGE